@@ -0,0 +1,279 @@
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from schemas import CarModel, CommuteEntity
+from core.charging_scheduler import (
+    ChargingTimeTable,
+    get_charging_time_table,
+    get_emission_intensity,
+    get_trip_offsets,
+)
+
+# Resolution of the charging plan. A chosen hour charges for a multiple of 1 / PLAN_STEPS_PER_HOUR
+# hours, counted from the start or from the end of the whole charging time.
+PLAN_STEPS_PER_HOUR = 4
+
+
+def get_trip_hours(
+    commutes: list[CommuteEntity], start: datetime, car_model: CarModel
+) -> tuple[pd.DatetimeIndex, pd.DatetimeIndex]:
+    """
+    Get the hours during which the car leaves and returns for every trip of the next seven days.
+
+    Every usage of a commute is a trip of its own, also when it directly follows another one.
+
+    Args:
+        commutes: A list of commutes during the next seven days
+        start: The time and date when the SOC curve starts
+        car_model: The car model of the user
+
+    Returns:
+        A tuple (starts, ends) of pandas.DatetimeIndex sorted by start. The car leaves during the
+        hour `start` and is available again from the full hour `end`.
+    """
+    first_hours, last_hours, _ = get_trip_offsets(commutes, start, car_model)
+    order = np.argsort(first_hours, kind="stable")
+    curve_start = pd.Timestamp(start.replace(minute=0, second=0, microsecond=0))
+
+    # The SOC first drops in the hour after the trip starts and last drops in the first full hour
+    # after it ends
+    return (
+        curve_start + pd.to_timedelta(first_hours[order] - 1, unit="h"),
+        curve_start + pd.to_timedelta(last_hours[order], unit="h"),
+    )
+
+
+def get_available_hours(
+    timestamps: pd.DatetimeIndex,
+    trip_starts: pd.DatetimeIndex,
+    trip_ends: pd.DatetimeIndex,
+) -> int:
+    """
+    Get the number of full hours the car is parked before its next trip.
+
+    Args:
+        timestamps: The hours that can be used for charging, sorted and starting now
+        trip_starts: The hours during which the trips start
+        trip_ends: The full hours at which the car is back from the trips
+
+    Returns:
+        The number of hours from the start of `timestamps` until the hour in which the next trip
+        starts, or 0 if the car is on a trip.
+    """
+    now = timestamps[0]
+    if ((trip_starts <= now) & (trip_ends > now)).any():
+        return 0
+
+    next_trip_starts = trip_starts[trip_starts > now]
+    if len(next_trip_starts) == 0:
+        return len(timestamps)
+
+    return int(np.searchsorted(timestamps.asi8, next_trip_starts.min().value))
+
+
+def solve_charging_plan(
+    emission_intensity: np.ndarray,
+    charging_time_table: ChargingTimeTable,
+    battery_capacity: float,
+    current_soc: float,
+    target_soc: int = 80,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Choose the hours with the lowest emissions that charge the car from its current to a target SOC.
+
+    At a constant charging rate, the cleanest hours are optimal. Otherwise the energy charged in an
+    hour depends on the SOC it starts at, so the order of the chosen hours matters and filling the
+    cleanest hours first is not optimal anymore. The plan is then found with a dynamic program over
+    SOC buckets, one for every step of 1 / `PLAN_STEPS_PER_HOUR` hours of charging time, counted
+    from the start and from the end of the charging time. Every chosen hour charges the car from
+    one bucket to a later one that is at most one hour of charging away. The program is
+    vectorized over the hours and loops over the buckets, so it scales with the charging time and
+    not with the horizon.
+
+    Args:
+        emission_intensity: The carbon intensity (gCO2/kWh) of every hour the car is available
+        charging_time_table: The charging time table of the car
+        battery_capacity: The battery capacity of the car in kWh
+        current_soc: The state of charge at the start (between 0 and 100)
+        target_soc: The state of charge that should be reached (between 0 and 100, defaults to 80)
+
+    Returns:
+        A tuple (hours, durations, costs) of numpy.ndarrays in chronological order, with the offset
+        of every chosen hour, the time in h spent charging during it and the gCO2 emitted. If the
+        target SOC cannot be reached, every available hour is used.
+    """
+    soc_levels = np.arange(len(charging_time_table.cumulative_hours))
+    charging_hours = (
+        charging_time_table.cumulative_hours / charging_time_table.efficiency
+    )
+    start_hours = np.interp(current_soc, soc_levels, charging_hours)
+    required_hours = np.interp(target_soc, soc_levels, charging_hours) - start_hours
+    n_hours = len(emission_intensity)
+
+    if required_hours <= 0 or n_hours == 0:
+        return np.array([], dtype="int64"), np.array([]), np.array([])
+
+    hours_per_percent = np.diff(charging_hours)[
+        int(np.floor(current_soc)) : int(np.ceil(target_soc))
+    ]
+    if required_hours > n_hours:
+        # Charge as much as possible
+        hours = np.arange(n_hours)
+        durations = np.ones(n_hours)
+    elif np.ptp(hours_per_percent) <= 1e-9 * hours_per_percent.max():
+        # Every hour charges the same energy at a constant charging rate, so the order of the
+        # hours does not matter and the cleanest hours are optimal
+        hours, durations = _get_cleanest_hours(emission_intensity, required_hours)
+    else:
+        bucket_hours = _get_bucket_hours(required_hours)
+        bucket_soc = np.interp(start_hours + bucket_hours, charging_hours, soc_levels)
+        hours, charged_hours = _solve_charging_plan(
+            emission_intensity, bucket_soc, bucket_hours
+        )
+        durations = np.minimum(np.diff(charged_hours), 1)
+
+    # Charge in chronological order to get the SOC at the end of every chosen hour
+    soc = np.interp(
+        start_hours + np.concatenate(([0], np.cumsum(durations))),
+        charging_hours,
+        soc_levels,
+    )
+    costs = emission_intensity[hours] * np.diff(soc) / 100 * battery_capacity
+
+    return hours, durations, costs
+
+
+def _get_cleanest_hours(
+    emission_intensity: np.ndarray, required_hours: float
+) -> tuple[np.ndarray, np.ndarray]:
+    # Fill the cleanest hours, the last one of them only partially
+    n_hours = int(np.ceil(required_hours))
+    hours = np.argsort(emission_intensity, kind="stable")[:n_hours]
+    durations = np.ones(n_hours)
+    durations[-1] = required_hours - (n_hours - 1)
+
+    chronological = np.argsort(hours, kind="stable")
+    return hours[chronological], durations[chronological]
+
+
+def _get_bucket_hours(required_hours: float) -> np.ndarray:
+    # Counting from both ends keeps every plan of full hours and one partial hour reachable
+    steps = np.arange(int(np.floor(required_hours * PLAN_STEPS_PER_HOUR)) + 1) / (
+        PLAN_STEPS_PER_HOUR
+    )
+    bucket_hours = np.sort(np.concatenate((steps, required_hours - steps)))
+    is_distinct = np.diff(bucket_hours, prepend=-np.inf) > 1e-9
+
+    return bucket_hours[is_distinct & (bucket_hours >= -1e-9)].clip(0, required_hours)
+
+
+def _solve_charging_plan(
+    emission_intensity: np.ndarray, bucket_soc: np.ndarray, bucket_hours: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    n_hours, n_buckets = len(emission_intensity), len(bucket_hours)
+
+    # The first bucket that can be charged to every bucket within one hour
+    first_buckets = np.searchsorted(bucket_hours, bucket_hours - 1 - 1e-9, side="left")
+    # Proportional to the cost of charging from 0 % up to every bucket during every hour
+    bucket_costs = bucket_soc[:, np.newaxis] * emission_intensity[np.newaxis, :]
+
+    # The lowest cost of reaching every bucket before every hour, and of reaching it during it.
+    # Buckets are rows, so that the buckets charged from are a contiguous block.
+    min_costs = np.full((n_buckets, n_hours + 1), np.inf)
+    min_costs[0] = 0
+    arrival_costs = np.full((n_buckets, n_hours), np.inf)
+    # The lowest cost of every bucket minus the cost of charging up to it during every hour
+    start_costs = np.empty((n_buckets, n_hours))
+    np.subtract(min_costs[0, :-1], bucket_costs[0], out=start_costs[0])
+    for bucket in range(1, n_buckets):
+        np.min(
+            start_costs[first_buckets[bucket] : bucket],
+            axis=0,
+            out=arrival_costs[bucket],
+        )
+        arrival_costs[bucket] += bucket_costs[bucket]
+        np.minimum.accumulate(arrival_costs[bucket], out=min_costs[bucket, 1:])
+        np.subtract(
+            min_costs[bucket, :-1], bucket_costs[bucket], out=start_costs[bucket]
+        )
+
+    # Follow the cheapest arrivals back from the target
+    hours, buckets = [], [n_buckets - 1]
+    bucket, n_previous_hours = n_buckets - 1, n_hours
+    while bucket > 0:
+        hour = int(np.argmin(arrival_costs[bucket, :n_previous_hours]))
+        first = first_buckets[bucket]
+        bucket = first + int(
+            np.argmin(min_costs[first:bucket, hour] - bucket_costs[first:bucket, hour])
+        )
+        hours.append(hour)
+        buckets.append(bucket)
+        n_previous_hours = hour
+
+    return np.array(hours[::-1], dtype="int64"), bucket_hours[buckets[::-1]]
+
+
+def get_charging_plan(
+    car_model: CarModel,
+    soc_curve: pd.Series,
+    energy_mix: pd.DataFrame,
+    max_charging_power: int,
+    trip_starts: pd.DatetimeIndex,
+    trip_ends: pd.DatetimeIndex,
+    target_soc: int = 80,
+    emission_intensity: np.ndarray | None = None,
+) -> list[tuple[datetime, datetime, float]]:
+    """
+    Get the charging slots with the lowest emissions that charge the car to a target SOC before its
+    next trip. Unlike `get_charging_windows`, the slots do not need to be contiguous.
+
+    Args:
+        car_model: The car model that is being charged
+        soc_curve: The current state of charge (between 0 and 100) at every hour
+        energy_mix: The predicted energy mix at every hour
+        max_charging_power: The maximum charging power available in kW
+        trip_starts: The hours during which the trips start, see `get_trip_hours`
+        trip_ends: The full hours at which the car is back from the trips
+        target_soc: The state of charge that should be reached (between 0 and 100, defaults to 80)
+        emission_intensity: The carbon intensity at every row of `energy_mix`, if it has already
+            been computed with `get_emission_intensity` (e.g. when scheduling many cars at once)
+
+    Returns:
+        A list containing the charging slots sorted by start time. Each charging slot is a tuple
+        of the form (start, end, cost), where `cost` is the gCO2 emitted during charging.
+    """
+    if emission_intensity is None:
+        emission_intensity = get_emission_intensity(energy_mix)
+
+    df = energy_mix[["timestamp"]].assign(emission_intensity=emission_intensity)
+    df = df.merge(right=soc_curve, left_on="timestamp", right_index=True)
+    df = df.sort_values("timestamp")
+
+    if df.empty:
+        return []
+
+    timestamps = pd.DatetimeIndex(df["timestamp"])
+    n_available_hours = get_available_hours(timestamps, trip_starts, trip_ends)
+
+    hours, durations, costs = solve_charging_plan(
+        emission_intensity=df["emission_intensity"].to_numpy(dtype="float64")[
+            :n_available_hours
+        ],
+        charging_time_table=get_charging_time_table(car_model, max_charging_power),
+        battery_capacity=car_model.battery_capacity,
+        current_soc=df["soc"].iloc[0],
+        target_soc=target_soc,
+    )
+
+    starts = timestamps.take(hours)
+    ends = (starts + pd.to_timedelta(durations, unit="h")).round("min")
+
+    # Merge adjacent hours into one slot
+    charging_plan: list[tuple[datetime, datetime, float]] = []
+    for start, end, cost in zip(starts.to_pydatetime(), ends.to_pydatetime(), costs):
+        if charging_plan and charging_plan[-1][1] == start:
+            charging_plan[-1] = (charging_plan[-1][0], end, charging_plan[-1][2] + cost)
+        else:
+            charging_plan.append((start, end, cost))
+
+    return charging_plan
@@ -1,11 +1,75 @@
+from dataclasses import dataclass
 from datetime import datetime, time, timedelta
-from math import floor
 import functools
+import numpy as np
 import pandas as pd
 from schemas import CommuteEntity, CarModel
 from model import config
 
 WEEK_DAYS = {"MON": 0, "TUE": 1, "WED": 2, "THU": 3, "FRI": 4, "SAT": 5, "SUN": 6}
+HOUR = timedelta(hours=1)
+
+
+def get_trip_offsets(
+    commutes: list[CommuteEntity],
+    start: datetime,
+    car_model: CarModel,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Get the hours during which every trip of the next seven days consumes energy.
+
+    Args:
+        commutes: A list of commutes during the next seven days
+        start: The time and date when the prediction should start
+        car_model: The car model of which the SOC should be predicted
+
+    Returns:
+        A tuple (first_hours, last_hours, soc_changes) of numpy.ndarrays with one entry per trip.
+        A trip lowers the SOC by `soc_change` spread evenly over the hours `first_hour` to
+        `last_hour` (inclusive), counted from the start of the hour of `start`.
+    """
+    curve_start = start.replace(minute=0, second=0, microsecond=0)
+
+    first_hours, last_hours, soc_changes = [], [], []
+    for commute in commutes:
+        trip_soc_change = (
+            car_model.consumption_per_kilometer * commute.approx_distance_km
+        ) / (
+            10 * car_model.battery_capacity
+        )  # (Wh/km * km * 100) / (1000 * Wh) = %
+
+        for trip in commute.usage:
+            # we should store trip.day as integers instead of strings
+            trip_day = start + timedelta(
+                days=((WEEK_DAYS[trip.day] - start.weekday()) % 7)
+            )
+
+            start_time = time.fromisoformat(trip.start_time)
+            trip_start = trip_day.replace(
+                hour=start_time.hour, minute=start_time.minute, second=0, microsecond=0
+            )
+
+            if trip.end_time:
+                end_time = time.fromisoformat(trip.end_time)
+                trip_end = trip_day.replace(
+                    hour=end_time.hour, minute=end_time.minute, second=0, microsecond=0
+                )
+            else:
+                trip_end = trip_start + timedelta(
+                    minutes=commute.approx_duration_minutes
+                )
+
+            # The SOC drops in every hour after the trip starts up to the first full hour
+            # after it ends
+            first_hours.append((trip_start - curve_start) // HOUR + 1)
+            last_hours.append(-((curve_start - trip_end) // HOUR))
+            soc_changes.append(trip_soc_change)
+
+    return (
+        np.array(first_hours, dtype="int64"),
+        np.array(last_hours, dtype="int64"),
+        np.array(soc_changes, dtype="float64"),
+    )
 
 
 def get_soc_curve_from_commutes(
@@ -27,79 +91,133 @@ def get_soc_curve_from_commutes(
         A pandas.Series with the hourly predicted SOC over the next seven days.
     """
     seven_day_hourly_index = pd.date_range(
-        start=start.replace(minute=0, second=0, microsecond=0), periods=7 * 24, freq="H"
+        start=start.replace(minute=0, second=0, microsecond=0), periods=7 * 24, freq="h"
+    )
+    n_hours = len(seven_day_hourly_index)
+
+    first_hours, last_hours, soc_changes = get_trip_offsets(commutes, start, car_model)
+
+    # Only the hours of a trip that lie within the next seven days are affected
+    first_hours = np.maximum(first_hours, 0)
+    last_hours = np.minimum(last_hours, n_hours - 1)
+    trip_lengths = last_hours - first_hours + 1
+    in_horizon = trip_lengths > 0
+    first_hours, trip_lengths, soc_changes = (
+        first_hours[in_horizon],
+        trip_lengths[in_horizon],
+        soc_changes[in_horizon],
+    )
+
+    # Spread the consumption of every trip evenly over its hours
+    affected_hours = np.repeat(first_hours, trip_lengths) + (
+        np.arange(trip_lengths.sum())
+        - np.repeat(np.cumsum(trip_lengths) - trip_lengths, trip_lengths)
+    )
+    hourly_consumption = np.zeros(n_hours, dtype="float64")
+    np.add.at(
+        hourly_consumption,
+        affected_hours,
+        np.repeat(soc_changes / trip_lengths, trip_lengths),
     )
-    soc_curve = pd.Series(
-        [initial_soc] * len(seven_day_hourly_index),
+
+    soc = np.subtract.accumulate(
+        np.concatenate(([initial_soc], hourly_consumption)), dtype="float64"
+    )[1:]
+
+    return pd.Series(
+        np.maximum(soc, 0),
         dtype="float64",
         name="soc",
         index=seven_day_hourly_index,
     )
 
-    if len(commutes) == 0:
-        return soc_curve
 
-    trips = []
-    for commute in commutes:
-        for trip in commute.usage:
-            start_time = time.fromisoformat(trip.start_time)
+@dataclass(frozen=True)
+class ChargingTimeTable:
+    """
+    The cumulative charging time of a car model from 0 % to every SOC.
 
-            # we should store trip.day as integers instead of strings
-            trip_start = (
-                start + timedelta(days=((WEEK_DAYS[trip.day] - start.weekday()) % 7))
-            ).replace(
-                hour=start_time.hour, minute=start_time.minute, second=0, microsecond=0
-            )
+    Attributes:
+        cumulative_hours: The time in h to charge from 0 % to every SOC (101 values)
+        efficiency: The efficiency of the charging process (between 0 and 1)
+    """
 
-            if trip.end_time:
-                end_time = time.fromisoformat(trip.end_time)
-                trip_end = (
-                    start
-                    + timedelta(days=((WEEK_DAYS[trip.day] - start.weekday()) % 7))
-                ).replace(
-                    hour=end_time.hour, minute=end_time.minute, second=0, microsecond=0
-                )
-            else:
-                trip_end = trip_start + timedelta(
-                    minutes=commute.approx_distance_minutes
-                )
+    cumulative_hours: np.ndarray
+    efficiency: float
 
-            trip_soc_change = (
-                car_model.consumption_per_kilometer * commute.approx_distance_km
-            ) / (
-                10 * car_model.battery_capacity
-            )  # (Wh/km * km * 100) / (1000 * Wh) = %
+    def get_time_to_charge(
+        self, current_soc: float | np.ndarray, target_soc: int = 80
+    ) -> float | np.ndarray:
+        """
+        Get the estimated time to charge from one or many SOCs to a target SOC.
 
-            trips.append((trip_start, trip_end, trip_soc_change))
+        Args:
+            current_soc: The current state of charge (between 0 and 100), scalar or array
+            target_soc: The target state of charge (between 0 and 100, defaults to 80)
 
-    trips.sort(key=lambda t: t[1])
+        Returns:
+            The estimated time to charge in h, with the same shape as `current_soc`
+        """
 
-    current_soc = initial_soc
-    last_updated_hour = None
-    last_trip_end = soc_curve.index[0]
-    for trip_start, trip_end, soc_change in trips:
-        for i in soc_curve.loc[
-            (soc_curve.index > last_trip_end) & (soc_curve.index <= trip_start)
-        ].index:
-            soc_curve.at[i] = current_soc
+        # floor current_soc to get conservative estimate in case of non-integer soc
+        current_soc = np.clip(np.floor(current_soc), 0, 100).astype("int64")
+        target_soc = min(max(target_soc, 0), 100)
 
-        last_trip_end = trip_end
-        mask = (soc_curve.index > trip_start) & (
-            soc_curve.index < trip_end + timedelta(hours=1)
+        return (
+            np.maximum(
+                self.cumulative_hours[target_soc] - self.cumulative_hours[current_soc],
+                0,
+            )
+            / self.efficiency
         )
-        affected_rows = soc_curve.loc[mask]
-        partial_soc_change = soc_change / len(affected_rows)
-        for i in affected_rows.index:
-            current_soc -= partial_soc_change
-            soc_curve.at[i] = max(current_soc, 0)
-            last_updated_hour = i
-            if current_soc <= 0:
-                break
 
-    for i in soc_curve.loc[soc_curve.index > last_updated_hour].index:
-        soc_curve.at[i] = current_soc
 
-    return soc_curve
+@functools.lru_cache(maxsize=256)
+def _build_charging_time_table(
+    battery_capacity: float,
+    charging_curve: tuple[float, ...],
+    max_charging_power: float,
+    efficiency: float,
+) -> ChargingTimeTable:
+    one_percent_capacity = battery_capacity / 100
+    charging_rates = np.asarray(charging_curve, dtype="float64")
+
+    hours_per_percent = (
+        2
+        * one_percent_capacity
+        / np.minimum(charging_rates[:-1] + charging_rates[1:], 2 * max_charging_power)
+    )
+    cumulative_hours = np.concatenate(([0.0], np.cumsum(hours_per_percent)))
+    cumulative_hours.setflags(write=False)  # shared between requests
+
+    return ChargingTimeTable(cumulative_hours=cumulative_hours, efficiency=efficiency)
+
+
+def get_charging_time_table(
+    car_model: CarModel, max_charging_power: float, efficiency: float = 0.9
+) -> ChargingTimeTable:
+    """
+    Get the (cached) charging time table of a car model.
+
+    Args:
+        car_model: The car model that is being charged
+        max_charging_power: The maximum charging power available in kW
+        efficiency: The efficiency of the charging process (between 0 and 1, defaults to 0.9)
+
+    Returns:
+        The ChargingTimeTable for the car model, charging power and efficiency
+    """
+    return _build_charging_time_table(
+        car_model.battery_capacity,
+        tuple(car_model.charging_curve),
+        max_charging_power,
+        efficiency,
+    )
+
+
+def clear_charging_time_table_cache() -> None:
+    """Clear the cache of `get_charging_time_table`, e.g. to benchmark building the tables."""
+    _build_charging_time_table.cache_clear()
 
 
 def get_time_to_charge(
@@ -121,24 +239,55 @@ def get_time_to_charge(
     Returns:
         The estimated time to charge in h
     """
-
-    current_soc = floor(
-        current_soc
-    )  # floor current_soc to get conservative estimate in case of non-integer soc
-    one_percent_capacity = car_model.battery_capacity / 100
-    charging_rates = zip(
-        car_model.charging_curve[current_soc:target_soc],
-        car_model.charging_curve[current_soc + 1 : target_soc + 1],
+    charging_time_table = get_charging_time_table(
+        car_model, max_charging_power, efficiency
     )
 
-    return (
-        sum(
-            2
-            * one_percent_capacity
-            / min(current_rate + next_rate, 2 * max_charging_power)
-            for (current_rate, next_rate) in charging_rates
+    return float(charging_time_table.get_time_to_charge(current_soc, target_soc))
+
+
+def get_emission_intensity(energy_mix: pd.DataFrame) -> np.ndarray:
+    """
+    Get the carbon intensity of the energy mix at every row.
+
+    Args:
+        energy_mix: The predicted energy mix at every hour
+
+    Returns:
+        A numpy.ndarray with the gCO2 emitted per kWh at every row of `energy_mix`.
+    """
+    emission_cols = [
+        col for col in energy_mix.columns if col not in ["timestamp", "soc", "Sum"]
+    ]
+    generation = energy_mix[emission_cols].to_numpy(dtype="float64")
+    emission_factors = np.array([config.EMISSION_FACTORS[col] for col in emission_cols])
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        relative_emissions = (
+            generation / np.nansum(generation, axis=1, keepdims=True) * emission_factors
         )
-        / efficiency
+
+    return np.nansum(relative_emissions, axis=1)
+
+
+def get_mean_window_emissions(
+    emission_intensity: np.ndarray, window_starts: np.ndarray, window_ends: np.ndarray
+) -> np.ndarray:
+    """
+    Get the mean carbon intensity of many windows at once using prefix sums.
+
+    Args:
+        emission_intensity: The carbon intensity at every offset of the grid
+        window_starts: The first offset of every window (inclusive)
+        window_ends: The last offset of every window (exclusive)
+
+    Returns:
+        A numpy.ndarray with the mean carbon intensity of every window.
+    """
+    cumulative_intensity = np.concatenate(([0.0], np.cumsum(emission_intensity)))
+
+    return (cumulative_intensity[window_ends] - cumulative_intensity[window_starts]) / (
+        window_ends - window_starts
     )
 
 
@@ -150,6 +299,7 @@ def get_charging_windows(
     max_charging_power: int,
     min_soc: int = 20,
     max_soc: int = 80,
+    emission_intensity: np.ndarray | None = None,
 ) -> list[tuple[datetime, datetime, float]]:
     """
     Get the possible charging windows given an energy mix and soc curve.
@@ -161,73 +311,195 @@ def get_charging_windows(
         min_charging_duration: A lower bound for the charging duration
         min_soc: A lower bound for the SOC where charging is considered
         max_soc: An upper bound for the SOC where charging is considered
+        emission_intensity: The carbon intensity at every row of `energy_mix`, if it has already
+            been computed with `get_emission_intensity` (e.g. when scheduling many cars at once)
 
     Returns:
         A list containing the possible charging windows sorted by cost (asc). Each charging window
         is a tuple of the form (start, end, cost), where `cost` is the gCO2 emitted during charging.
     """
 
-    def to_relative_emissions(col: pd.Series, sum_col: pd.Series):
-        if col.name not in ["timestamp", "Sum", "soc"]:
-            return col / sum_col * config.EMISSION_FACTORS[col.name]
-        return col
+    if emission_intensity is None:
+        emission_intensity = get_emission_intensity(energy_mix)
 
-    get_time_to_fully_charge = functools.partial(
-        get_time_to_charge, car_model=car_model, max_charging_power=max_charging_power
-    )
-
-    df = energy_mix.merge(right=soc_curve, left_on="timestamp", right_index=True)
+    df = energy_mix[["timestamp"]].assign(emission_intensity=emission_intensity)
+    df = df.merge(right=soc_curve, left_on="timestamp", right_index=True)
 
     df = df[df["soc"] <= max_soc]
     if not (above_min_soc := df[df["soc"] >= min_soc]).empty:  # pylint: disable=C0103
         df = above_min_soc
 
-    emission_cols = [
-        col for col in df.columns if col not in ["timestamp", "soc", "Sum"]
-    ]
+    if df.empty:
+        return []
 
-    df["Sum"] = df[emission_cols].sum(axis=1)
-    create_relative_emissions = functools.partial(
-        to_relative_emissions, sum_col=df["Sum"]
+    timestamps = pd.DatetimeIndex(df["timestamp"])
+    soc = df["soc"].to_numpy(dtype="float64")
+    emission_intensity = df["emission_intensity"].to_numpy(dtype="float64")
+
+    time_to_charge = get_charging_time_table(
+        car_model, max_charging_power
+    ).get_time_to_charge(soc)
+    finish_times = timestamps + pd.to_timedelta(
+        np.round(time_to_charge * 3.6e9).astype("int64"), unit="us"
+    )
+
+    # Every window covers the candidate rows between its start and the full hour after it
+    # finishes, so its mean emissions are a difference of two prefix sums
+    order = np.argsort(timestamps.asi8, kind="stable")
+    sorted_timestamps = timestamps.asi8[order]
+    charging_emissions = get_mean_window_emissions(
+        emission_intensity[order],
+        np.searchsorted(sorted_timestamps, timestamps.asi8, side="left"),
+        np.searchsorted(sorted_timestamps, finish_times.ceil("h").asi8, side="right"),
     )
-    df = df.apply(create_relative_emissions, axis=0)
-    df = df.assign(  # pylint: disable=C0103
-        finish_time=df.apply(
-            lambda row: row["timestamp"]
-            + timedelta(hours=get_time_to_fully_charge(current_soc=row["soc"])),
-            axis=1,
+
+    cost = charging_emissions * (max_soc - soc) / 100 * car_model.battery_capacity
+
+    end_times = finish_times.round("min")
+    is_long_enough = (end_times - timestamps) >= min_charging_duration
+
+    charging_windows = list(
+        zip(
+            timestamps[is_long_enough].to_pydatetime(),
+            end_times[is_long_enough].to_pydatetime(),
+            cost[is_long_enough].tolist(),
         )
     )
-    df["TotalEmissions"] = df[emission_cols].sum(axis=1)
 
-    df["charging_emissions"] = df.apply(
-        lambda row: df[
-            (df["timestamp"] >= row["timestamp"])
-            & (df["timestamp"] <= (row["finish_time"]).ceil("H"))
-        ]["TotalEmissions"].mean(),
-        axis=1,
+    return sorted(charging_windows, key=lambda t: t[2])
+
+
+def get_batch_charging_windows(
+    car_models: list[CarModel],
+    soc_curves: list[pd.Series],
+    energy_mix: pd.DataFrame,
+    min_charging_durations: list[timedelta],
+    max_charging_powers: list[int],
+    min_soc: int = 20,
+    max_soc: int = 80,
+    emission_intensity: np.ndarray | None = None,
+) -> list[list[tuple[datetime, datetime, float]]]:
+    """
+    Get the possible charging windows of many cars at once.
+
+    The SOC curves are stacked, so that the windows of all cars are computed with the same array
+    operations. The result is the same as calling `get_charging_windows` for every car.
+
+    Args:
+        car_models: The car model of every car
+        soc_curves: The state of charge of every car at every hour, all over the same hours
+        energy_mix: The predicted energy mix at every hour
+        min_charging_durations: A lower bound for the charging duration of every car
+        max_charging_powers: The maximum charging power available to every car
+        min_soc: A lower bound for the SOC where charging is considered
+        max_soc: An upper bound for the SOC where charging is considered
+        emission_intensity: The carbon intensity at every row of `energy_mix`, if it has already
+            been computed with `get_emission_intensity`
+
+    Returns:
+        The charging windows of every car sorted by cost (asc), see `get_charging_windows`.
+    """
+    if not soc_curves:
+        return []
+
+    index = soc_curves[0].index
+    if any(not soc_curve.index.equals(index) for soc_curve in soc_curves[1:]):
+        raise ValueError("The SOC curves of a batch must cover the same hours.")
+
+    if emission_intensity is None:
+        emission_intensity = get_emission_intensity(energy_mix)
+
+    # The rows of the energy mix that the SOC curves cover, in the order of the energy mix
+    energy_mix_timestamps = pd.DatetimeIndex(energy_mix["timestamp"]).as_unit("ns")
+    positions = index.get_indexer(energy_mix_timestamps)
+    rows = np.flatnonzero(positions >= 0)
+    timestamps = energy_mix_timestamps.asi8[rows]
+    emission_intensity = np.asarray(emission_intensity, dtype="float64")[rows]
+    soc = np.stack([soc_curve.to_numpy(dtype="float64") for soc_curve in soc_curves])[
+        :, positions[rows]
+    ]
+
+    # Charging is considered between min_soc and max_soc, or below max_soc if a car never
+    # reaches min_soc
+    is_candidate = soc <= max_soc
+    is_above_min_soc = is_candidate & (soc >= min_soc)
+    has_above_min_soc = is_above_min_soc.any(axis=1)
+    is_candidate[has_above_min_soc] = is_above_min_soc[has_above_min_soc]
+
+    # The candidate rows of all cars, grouped by car
+    cars, candidate_rows = np.nonzero(is_candidate)
+    candidate_soc = soc[cars, candidate_rows]
+    candidate_timestamps = timestamps[candidate_rows]
+
+    time_to_charge = np.concatenate(
+        [
+            get_charging_time_table(car_model, max_charging_power).get_time_to_charge(
+                car_soc
+            )
+            for car_model, max_charging_power, car_soc in zip(
+                car_models,
+                max_charging_powers,
+                np.split(candidate_soc, np.cumsum(is_candidate.sum(axis=1))[:-1]),
+            )
+        ]
+    )
+    finish_times = pd.DatetimeIndex(
+        candidate_timestamps + np.round(time_to_charge * 3.6e9).astype("int64") * 1000
     )
 
-    df["cost"] = df.apply(
-        lambda row: row["charging_emissions"]
-        * (max_soc - row["soc"])
-        / 100
-        * car_model.battery_capacity,
+    # The prefix sums of the emission intensity at the candidate rows of every car, so that the
+    # mean emissions of a window are a difference of two prefix sums like in
+    # `get_mean_window_emissions`
+    order = np.argsort(timestamps, kind="stable")
+    sorted_timestamps = timestamps[order]
+    is_sorted_candidate = is_candidate[:, order]
+    cumulative_intensity = np.zeros((len(soc_curves), len(rows) + 1))
+    np.cumsum(
+        np.where(is_sorted_candidate, emission_intensity[order], 0.0),
         axis=1,
+        out=cumulative_intensity[:, 1:],
     )
+    cumulative_counts = np.zeros((len(soc_curves), len(rows) + 1), dtype="int64")
+    np.cumsum(is_sorted_candidate, axis=1, out=cumulative_counts[:, 1:])
 
-    charging_windows = [
-        (
-            start_time,
-            end_time,
-            cost,
-        )
-        for (start, end, cost) in df[["timestamp", "finish_time", "cost"]].itertuples(
-            index=False, name=None
+    window_starts = np.searchsorted(
+        sorted_timestamps, candidate_timestamps, side="left"
+    )
+    window_ends = np.searchsorted(
+        sorted_timestamps, finish_times.ceil("h").asi8, side="right"
+    )
+    charging_emissions = (
+        cumulative_intensity[cars, window_ends]
+        - cumulative_intensity[cars, window_starts]
+    ) / (cumulative_counts[cars, window_ends] - cumulative_counts[cars, window_starts])
+
+    battery_capacities = np.array(
+        [car_model.battery_capacity for car_model in car_models], dtype="float64"
+    )
+    cost = (
+        charging_emissions * (max_soc - candidate_soc) / 100 * battery_capacities[cars]
+    )
+
+    end_times = finish_times.round("min").asi8
+    min_durations = np.array(
+        [
+            pd.Timedelta(min_charging_duration).value
+            for min_charging_duration in min_charging_durations
+        ],
+        dtype="int64",
+    )
+    is_long_enough = (end_times - candidate_timestamps) >= min_durations[cars]
+
+    cars = cars[is_long_enough]
+    start_times = pd.DatetimeIndex(candidate_timestamps[is_long_enough]).to_pydatetime()
+    end_times = pd.DatetimeIndex(end_times[is_long_enough]).to_pydatetime()
+    cost = cost[is_long_enough].tolist()
+
+    bounds = np.searchsorted(cars, np.arange(len(soc_curves) + 1))
+    return [
+        sorted(
+            zip(start_times[first:last], end_times[first:last], cost[first:last]),
+            key=lambda t: t[2],
         )
-        if (end_time := end.round("min").to_pydatetime())
-        - (start_time := start.to_pydatetime())
-        >= min_charging_duration
+        for first, last in zip(bounds[:-1], bounds[1:])
     ]
-
-    return sorted(charging_windows, key=lambda t: t[2])
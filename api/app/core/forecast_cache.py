@@ -0,0 +1,333 @@
+import asyncio
+import dataclasses
+import hashlib
+import math
+import logging
+import os
+import pathlib
+import threading
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Any, Callable
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+FORECAST_TTL = timedelta(minutes=float(os.environ.get("FORECAST_TTL_MINUTES", 90)))
+FORECAST_REFRESH_INTERVAL = timedelta(
+    minutes=float(os.environ.get("FORECAST_REFRESH_INTERVAL_MINUTES", 5))
+)
+# The longest forecast that is predicted, in hours
+MAX_FORECAST_HOURS = 7 * 24
+# Forecast horizons are rounded up to a multiple of this many hours, so that slightly longer
+# requests are served from the cache instead of extending the forecast every time
+FORECAST_HORIZON_STEP_HOURS = 24
+
+
+@dataclass(frozen=True)
+class Forecast:
+    """
+    A predicted energy mix together with the data it is based on.
+
+    Attributes:
+        energy_mix: The predicted energy mix at every hour
+        data_hour: The last hour of SMARD data that was used for the prediction
+        model_version: The version of the model that made the prediction
+        created_at: The UNIX time when the prediction was made
+    """
+
+    energy_mix: pd.DataFrame
+    data_hour: pd.Timestamp
+    model_version: str
+    created_at: float
+
+    @property
+    def age(self) -> float:
+        """The age of the forecast in seconds."""
+        return time.time() - self.created_at
+
+    @property
+    def horizon_hours(self) -> int:
+        """The number of predicted hours."""
+        return len(self.energy_mix)
+
+    def get_prefix(self, n_hours: int) -> "Forecast":
+        """Get the forecast of the first `n_hours` hours."""
+        if n_hours >= self.horizon_hours:
+            return self
+
+        return dataclasses.replace(self, energy_mix=self.energy_mix.iloc[:n_hours])
+
+
+def get_model_version(model_dir: str | pathlib.Path) -> str:
+    """
+    Get a short fingerprint of the files of a trained model.
+
+    Args:
+        model_dir: The directory of the trained model
+
+    Returns:
+        A hex string that changes whenever a file of the model is replaced.
+    """
+    digest = hashlib.sha1()
+    for path in sorted(pathlib.Path(model_dir).iterdir()):
+        if path.is_file():
+            stat = path.stat()
+            digest.update(f"{path.name}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+
+    return digest.hexdigest()[:12]
+
+
+def get_horizon_hours(
+    data_hour: pd.Timestamp | None,
+    until: pd.Timestamp | None,
+    max_horizon_hours: int = MAX_FORECAST_HOURS,
+) -> int:
+    """
+    Get the number of hours to predict so that a forecast covers a given hour.
+
+    Args:
+        data_hour: The last hour of SMARD data, after which the forecast starts
+        until: The last hour the forecast must cover, or None for the longest forecast
+        max_horizon_hours: The longest forecast
+
+    Returns:
+        The number of hours, rounded up to a multiple of `FORECAST_HORIZON_STEP_HOURS` and at
+        most `max_horizon_hours`.
+    """
+    if until is None or data_hour is None:
+        return max_horizon_hours
+
+    n_hours = max(math.ceil((until - data_hour) / pd.Timedelta(hours=1)), 1)
+    return min(
+        math.ceil(n_hours / FORECAST_HORIZON_STEP_HOURS) * FORECAST_HORIZON_STEP_HOURS,
+        max_horizon_hours,
+    )
+
+
+class ForecastCache:
+    """
+    Process-wide cache of the energy mix forecast.
+
+    The forecast is the same for every user, so it is computed at most once per data hour and
+    model version and then served from memory until it is older than the TTL. A background task
+    (see `run_refresh_loop`) recomputes it as soon as SMARD publishes a new hour.
+
+    Most schedules only depend on the hours until the next trip of a user, so callers ask for the
+    forecast until a given hour. The cached forecast is only as long as the requests need: shorter
+    requests get a prefix of it, and a longer request extends it.
+    """
+
+    def __init__(
+        self,
+        predict: Callable[[int], pd.DataFrame],
+        get_latest_data_hour: Callable[[], pd.Timestamp | None],
+        get_model_version: Callable[[], str],
+        ttl: timedelta = FORECAST_TTL,
+        max_horizon_hours: int = MAX_FORECAST_HOURS,
+    ):
+        """
+        Args:
+            predict: Predicts the energy mix of the given number of hours, starting right after
+                the latest SMARD data
+            get_latest_data_hour: Cheaply looks up the latest hour published by SMARD
+            get_model_version: Gets the current version of the model used by `predict`, which
+                is checked again before every refresh. It is first called by the first refresh,
+                so that creating the cache does not read the model files.
+            ttl: The maximum age of a forecast that is served from the cache
+            max_horizon_hours: The number of hours predicted for requests without an end
+        """
+        self.predict = predict
+        self.get_latest_data_hour = get_latest_data_hour
+        self.get_model_version = get_model_version
+        # Set by the first refresh
+        self.model_version: str | None = None
+        self.ttl = ttl
+        self.max_horizon_hours = max_horizon_hours
+
+        self.hits = 0
+        self.misses = 0
+        self.extensions = 0
+        self.refreshes = 0
+
+        self._forecast: Forecast | None = None
+        self._last_seen_data_hour: pd.Timestamp | None = None
+        # The longest horizon requested since the last refresh
+        self._requested_hours = 0
+        self._refresh_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+
+    def get(self, until: pd.Timestamp | None = None) -> Forecast:
+        """
+        Get the current forecast, computing it if the cached one is missing, expired or too short.
+
+        Args:
+            until: The last hour the forecast must cover, or None for the longest forecast
+
+        Returns:
+            The forecast from right after the latest SMARD data until at least `until`, or of
+            `max_horizon_hours` hours if `until` is None or later than that.
+        """
+        if (forecast := self._get_cached_forecast(until)) is not None:
+            return forecast
+
+        with self._refresh_lock:
+            # Another request may have refreshed the forecast while we were waiting
+            if (forecast := self._get_cached_forecast(until)) is not None:
+                return forecast
+
+            # Without a forecast, the horizon is estimated from the latest data hour seen by the
+            # refresh loop, or the longest forecast is predicted
+            cached_forecast = self._get_fresh_forecast()
+            data_hour = (
+                cached_forecast.data_hour
+                if cached_forecast is not None
+                else self._last_seen_data_hour
+            )
+            n_hours = get_horizon_hours(data_hour, until, self.max_horizon_hours)
+            with self._stats_lock:
+                if cached_forecast is None:
+                    self.misses += 1
+                else:
+                    self.extensions += 1
+
+            forecast = self._refresh(n_hours)
+
+            # The latest data may be older than expected, which makes the forecast too short
+            n_hours = get_horizon_hours(
+                forecast.data_hour, until, self.max_horizon_hours
+            )
+            if forecast.horizon_hours < n_hours:
+                forecast = self._refresh(n_hours)
+
+            return forecast.get_prefix(n_hours)
+
+    def refresh_if_new_data(self) -> bool:
+        """
+        Recompute the forecast if SMARD has published new data, the model changed or the cached
+        forecast expired.
+
+        Returns:
+            Whether the forecast was recomputed.
+        """
+        # Look up the model version and the latest data before taking the lock, so that requests
+        # are not blocked by the SMARD request
+        model_version = self.get_model_version()
+        latest_data_hour = self.get_latest_data_hour()
+
+        with self._refresh_lock:
+            # A forecast of an older model is not fresh anymore
+            if self.model_version is not None and model_version != self.model_version:
+                logger.info("Model version changed to %s", model_version)
+            self.model_version = model_version
+
+            has_new_data = latest_data_hour is not None and (
+                self._last_seen_data_hour is None
+                or latest_data_hour > self._last_seen_data_hour
+            )
+            if not has_new_data and self._get_fresh_forecast() is not None:
+                return False
+
+            # Predict as far ahead as the requests since the previous refresh needed
+            n_hours = self._requested_hours or (
+                self._forecast.horizon_hours
+                if self._forecast is not None
+                else self.max_horizon_hours
+            )
+            self._refresh(n_hours)
+            # Keep the later hour if the refresh saw newer data than the lookup or SMARD could
+            # not be reached
+            if latest_data_hour is not None:
+                self._last_seen_data_hour = max(
+                    self._last_seen_data_hour, latest_data_hour
+                )
+
+        return True
+
+    async def run_refresh_loop(
+        self, interval: timedelta = FORECAST_REFRESH_INTERVAL
+    ) -> None:
+        """Keep the forecast up to date by polling SMARD for new data until cancelled."""
+        while True:
+            try:
+                if await asyncio.to_thread(self.refresh_if_new_data):
+                    logger.info(
+                        "Refreshed forecast for data hour %s", self._forecast.data_hour
+                    )
+            except Exception:  # pylint: disable=W0718
+                logger.exception("Failed to refresh forecast")
+
+            await asyncio.sleep(interval.total_seconds())
+
+    def get_stats(self) -> dict[str, Any]:
+        """Get the hit/miss counters and the state of the cached forecast."""
+        forecast = self._forecast
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "extensions": self.extensions,
+            "refreshes": self.refreshes,
+            "model_version": self.model_version,
+            "ttl_seconds": self.ttl.total_seconds(),
+            "data_hour": forecast.data_hour.isoformat() if forecast else None,
+            "age_seconds": forecast.age if forecast else None,
+            "horizon_hours": forecast.horizon_hours if forecast else None,
+        }
+
+    def _get_cached_forecast(self, until: pd.Timestamp | None) -> Forecast | None:
+        """Get the cached forecast if it is fresh and covers `until`, counting a hit."""
+        forecast = self._get_fresh_forecast()
+        if forecast is None:
+            return None
+
+        n_hours = get_horizon_hours(forecast.data_hour, until, self.max_horizon_hours)
+        with self._stats_lock:
+            self._requested_hours = max(self._requested_hours, n_hours)
+        if forecast.horizon_hours < n_hours:
+            return None
+
+        self._count_hit()
+        return forecast.get_prefix(n_hours)
+
+    def _get_fresh_forecast(self) -> Forecast | None:
+        forecast = self._forecast
+        if (
+            forecast is None
+            or forecast.model_version != self.model_version
+            or forecast.age > self.ttl.total_seconds()
+        ):
+            return None
+
+        return forecast
+
+    def _count_hit(self):
+        with self._stats_lock:
+            self.hits += 1
+
+    def _refresh(self, n_hours: int) -> Forecast:
+        # `predict` reloads the model if its files changed
+        model_version = self.get_model_version()
+        self.model_version = model_version
+        energy_mix = self.predict(n_hours)
+        forecast = Forecast(
+            energy_mix=energy_mix,
+            # The prediction starts right after the last hour of SMARD data
+            data_hour=energy_mix["timestamp"].min() - pd.Timedelta(hours=1),
+            model_version=model_version,
+            created_at=time.time(),
+        )
+
+        self._forecast = forecast
+        if (
+            self._last_seen_data_hour is None
+            or forecast.data_hour > self._last_seen_data_hour
+        ):
+            self._last_seen_data_hour = forecast.data_hour
+        with self._stats_lock:
+            self.refreshes += 1
+            self._requested_hours = 0
+
+        return forecast
@@ -1,14 +1,47 @@
+import asyncio
+import logging
 import sys
 import os
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 import uvicorn
 
 sys.path.append(os.getcwd())
+from metrics import PROMETHEUS_CONTENT_TYPE, render_metrics, track_requests
+from mongodb import close_db
 from routers import commutes, schedule, user, car_model
 
-app = FastAPI()
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    """Warm up the forecasting models in the background while the API is running."""
+    warm_up_task = asyncio.create_task(warm_up())
+    yield
+    warm_up_task.cancel()
+    close_db()
+
+
+async def warm_up():
+    """
+    Load the forecasting models and keep the forecast up to date.
+
+    This runs in the background, so that the API is ready before the forecasting stack is imported.
+    Schedule requests that arrive earlier load the models themselves.
+    """
+    try:
+        await asyncio.to_thread(schedule.load_models)
+    except Exception:  # pylint: disable=W0718
+        logger.exception("Failed to load the forecasting models")
+
+    await schedule.forecast_cache.run_refresh_loop()
+
+
+app = FastAPI(lifespan=lifespan)
 
 origins = ["*"]
 app.add_middleware(
@@ -18,6 +51,7 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.middleware("http")(track_requests)
 
 app.include_router(commutes.router)
 app.include_router(schedule.router)
@@ -31,5 +65,11 @@ async def main():
     return "Welcome to the Chargify API"
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Expose request counts and stage latencies in the Prometheus text format."""
+    return PlainTextResponse(render_metrics(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+
 if __name__ == "__main__":
     uvicorn.run(app, host="localhost", port=8000)
@@ -0,0 +1,242 @@
+import bisect
+import contextlib
+import threading
+import time
+from typing import Iterator
+
+from fastapi import Request, Response
+
+# Latency buckets in seconds, from sub-millisecond scheduling stages up to a full forecast refresh
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Metric:
+    """
+    Base class of a metric with optional labels, kept in memory and rendered in Prometheus format.
+
+    Attributes:
+        name: The name of the metric
+        documentation: The help text of the metric
+        label_names: The names of the labels every value of the metric is recorded with
+    """
+
+    metric_type = "untyped"
+
+    def __init__(
+        self, name: str, documentation: str, label_names: tuple[str, ...] = ()
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self._lock = threading.Lock()
+
+    def render(self) -> list[str]:
+        """Render the metric in the Prometheus text exposition format."""
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.metric_type}",
+        ]
+
+    def _get_label_values(self, labels: dict[str, str]) -> tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def _format_labels(self, label_values: tuple[str, ...], **extra_labels) -> str:
+        pairs = [*zip(self.label_names, label_values), *extra_labels.items()]
+        if not pairs:
+            return ""
+
+        escaped = (f'{name}="{_escape_label_value(value)}"' for name, value in pairs)
+        return "{" + ",".join(escaped) + "}"
+
+
+class Counter(Metric):
+    """A value that only goes up, e.g. the number of requests."""
+
+    metric_type = "counter"
+
+    def __init__(
+        self, name: str, documentation: str, label_names: tuple[str, ...] = ()
+    ):
+        super().__init__(name, documentation, label_names)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        """Increase the counter of the given labels."""
+        label_values = self._get_label_values(labels)
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values = list(self._values.items())
+
+        return super().render() + [
+            f"{self.name}{self._format_labels(label_values)} {value}"
+            for label_values, value in values
+        ]
+
+
+class Gauge(Metric):
+    """A value that goes up and down, e.g. the number of requests in flight."""
+
+    metric_type = "gauge"
+
+    def __init__(self, name: str, documentation: str):
+        super().__init__(name, documentation)
+        self._value = 0.0
+
+    def inc(self, amount: float = 1):
+        """Increase the gauge."""
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1):
+        """Decrease the gauge."""
+        with self._lock:
+            self._value -= amount
+
+    def render(self) -> list[str]:
+        return super().render() + [f"{self.name} {self._value}"]
+
+
+class Histogram(Metric):
+    """Observed values, e.g. latencies, counted in cumulative buckets."""
+
+    metric_type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, label_names)
+        self.buckets = buckets
+        # Per label values: the count of every bucket (plus +Inf) and the sum of all values
+        self._bucket_counts: dict[tuple[str, ...], list[int]] = {}
+        self._sums: dict[tuple[str, ...], float] = {}
+
+    def observe(self, value: float, **labels):
+        """Record a value for the given labels."""
+        label_values = self._get_label_values(labels)
+        bucket = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            if label_values not in self._bucket_counts:
+                self._bucket_counts[label_values] = [0] * (len(self.buckets) + 1)
+                self._sums[label_values] = 0.0
+            self._bucket_counts[label_values][bucket] += 1
+            self._sums[label_values] += value
+
+    @contextlib.contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """Record the time spent in the `with` block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values = [
+                (label_values, list(bucket_counts), self._sums[label_values])
+                for label_values, bucket_counts in self._bucket_counts.items()
+            ]
+
+        lines = super().render()
+        for label_values, bucket_counts, total in values:
+            cumulative_count = 0
+            for upper_bound, count in zip(
+                [*map(str, self.buckets), "+Inf"], bucket_counts
+            ):
+                cumulative_count += count
+                labels = self._format_labels(label_values, le=upper_bound)
+                lines.append(f"{self.name}_bucket{labels} {cumulative_count}")
+            labels = self._format_labels(label_values)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative_count}")
+
+        return lines
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+REQUESTS = Counter(
+    "chargify_http_requests_total",
+    "Number of handled HTTP requests.",
+    ("method", "path", "status"),
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "chargify_http_requests_in_flight", "Number of HTTP requests being handled."
+)
+REQUEST_DURATION = Histogram(
+    "chargify_http_request_duration_seconds",
+    "Time spent handling HTTP requests.",
+    ("method", "path"),
+)
+STAGE_DURATION = Histogram(
+    "chargify_stage_duration_seconds",
+    "Time spent in each stage of computing a charging schedule.",
+    ("stage",),
+)
+METRICS = [REQUESTS, REQUESTS_IN_FLIGHT, REQUEST_DURATION, STAGE_DURATION]
+
+
+def time_stage(stage: str) -> contextlib.AbstractContextManager:
+    """
+    Time a stage of computing a charging schedule.
+
+    Args:
+        stage: The name of the stage, e.g. "smard_fetch" or "soc_curve"
+
+    Returns:
+        A context manager that records the time spent in its `with` block.
+    """
+    return STAGE_DURATION.time(stage=stage)
+
+
+async def track_requests(request: Request, call_next) -> Response:
+    """HTTP middleware that counts requests and records their duration."""
+    REQUESTS_IN_FLIGHT.inc()
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        REQUESTS_IN_FLIGHT.dec()
+        # Use the route template instead of the raw path to keep the number of labels bounded
+        route = request.scope.get("route")
+        path = getattr(route, "path", "unmatched")
+        REQUEST_DURATION.observe(
+            time.perf_counter() - start, method=request.method, path=path
+        )
+        REQUESTS.inc(method=request.method, path=path, status=status)
+
+
+def render_metrics() -> str:
+    """Render all metrics in the Prometheus text exposition format."""
+    return "\n".join(line for metric in METRICS for line in metric.render()) + "\n"
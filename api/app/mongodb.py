@@ -1,10 +1,17 @@
+import os
+
+from motor.motor_asyncio import AsyncIOMotorClient
 from pymongo import MongoClient
 
+MONGODB_URL = os.environ.get("MONGODB_URL", "mongodb://localhost:27017/")
+MONGODB_DATABASE = os.environ.get("MONGODB_DATABASE", "chargify")
+MONGODB_MAX_POOL_SIZE = int(os.environ.get("MONGODB_MAX_POOL_SIZE", 100))
+
 
 class MongoDBClient:
     def __init__(self):
-        self.client = MongoClient("mongodb://localhost:27017/")
-        self.db = self.client["chargify"]
+        self.client = MongoClient(MONGODB_URL, maxPoolSize=MONGODB_MAX_POOL_SIZE)
+        self.db = self.client[MONGODB_DATABASE]
 
         self.commutes = self.db["commutes"]
         self.car_models = self.db["car_models"]
@@ -27,6 +34,11 @@ class MongoDBClient:
 
         return collection.find_one({"name": name})
 
+    def find_users_by_names(self, names: list[str]):
+        collection = self.db["users"]
+
+        return collection.find({"name": {"$in": names}})
+
     def insert_car_model(self, car_model):
         collection = self.db["car_models"]
 
@@ -44,6 +56,11 @@ class MongoDBClient:
 
         return collection.find_one({"name": name})
 
+    def find_car_models_by_names(self, names: list[str]):
+        collection = self.db["car_models"]
+
+        return collection.find({"name": {"$in": names}})
+
     def insert_commute(self, commute):
         collection = self.db["commutes"]
 
@@ -55,3 +72,102 @@ class MongoDBClient:
         collection = self.db["commutes"]
 
         return collection.find({"userId": user_id})
+
+    def find_commutes_by_user_ids(self, user_ids: list[str]):
+        collection = self.db["commutes"]
+
+        return collection.find({"userId": {"$in": user_ids}})
+
+
+class AsyncMongoDBClient:
+    def __init__(self):
+        self.client = AsyncIOMotorClient(MONGODB_URL, maxPoolSize=MONGODB_MAX_POOL_SIZE)
+        self.db = self.client[MONGODB_DATABASE]
+
+        self.commutes = self.db["commutes"]
+        self.car_models = self.db["car_models"]
+        self.users = self.db["users"]
+
+    def close(self):
+        self.client.close()
+
+    async def insert_user(self, user):
+        collection = self.db["users"]
+
+        result = await collection.insert_one(user)
+
+        return result.inserted_id
+
+    async def find_user_by_id(self, user_id: int):
+        collection = self.db["users"]
+
+        return await collection.find_one({"_id": user_id})
+
+    async def find_user_by_name(self, name: str):
+        collection = self.db["users"]
+
+        return await collection.find_one({"name": name})
+
+    async def find_users_by_names(self, names: list[str]):
+        collection = self.db["users"]
+
+        return await collection.find({"name": {"$in": names}}).to_list(length=None)
+
+    async def insert_car_model(self, car_model):
+        collection = self.db["car_models"]
+
+        result = await collection.insert_one(car_model)
+
+        return result.inserted_id
+
+    async def find_car_model_by_id(self, car_model_id: int):
+        collection = self.db["car_models"]
+
+        return await collection.find_one({"id": car_model_id})
+
+    async def find_car_model_by_name(self, name: str):
+        collection = self.db["car_models"]
+
+        return await collection.find_one({"name": name})
+
+    async def find_car_models_by_names(self, names: list[str]):
+        collection = self.db["car_models"]
+
+        return await collection.find({"name": {"$in": names}}).to_list(length=None)
+
+    async def insert_commute(self, commute):
+        collection = self.db["commutes"]
+
+        result = await collection.insert_one(commute)
+
+        return result.inserted_id
+
+    async def find_commutes_by_user_id(self, user_id: str):
+        collection = self.db["commutes"]
+
+        return await collection.find({"userId": user_id}).to_list(length=None)
+
+    async def find_commutes_by_user_ids(self, user_ids: list[str]):
+        collection = self.db["commutes"]
+
+        return await collection.find({"userId": {"$in": user_ids}}).to_list(length=None)
+
+
+_async_db: AsyncMongoDBClient | None = None
+
+
+def get_db() -> AsyncMongoDBClient:
+    """FastAPI dependency returning the async client that is shared by all requests."""
+    global _async_db  # pylint: disable=W0603
+    if _async_db is None:
+        _async_db = AsyncMongoDBClient()
+
+    return _async_db
+
+
+def close_db():
+    """Close the connection pool of the shared async client."""
+    global _async_db  # pylint: disable=W0603
+    if _async_db is not None:
+        _async_db.close()
+        _async_db = None
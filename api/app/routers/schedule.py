@@ -1,23 +1,65 @@
+import logging
+import os
 import pathlib
 import sys
+import threading
 import pytz
 
 base_path = pathlib.Path(__file__).parents[3]
 sys.path.append(str(base_path))
 
+from collections import defaultdict
 from datetime import datetime, timedelta
-from fastapi import APIRouter, Query
+from typing import AsyncIterator
 
-from mongodb import MongoDBClient
-from schemas import CarModel, ChargingWindow, CommuteEntity, User
+import numpy as np
+import pandas as pd
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+
+from metrics import time_stage
+from mongodb import AsyncMongoDBClient, get_db
+from schemas import (
+    CarModel,
+    ChargingWindow,
+    CommuteEntity,
+    ScheduleMode,
+    ScheduleRequest,
+    ScheduleResult,
+    User,
+)
 from core.charging_scheduler import (
+    get_batch_charging_windows,
+    get_charging_time_table,
+    get_emission_intensity,
     get_soc_curve_from_commutes,
     get_charging_windows,
 )
-from model.inference.inference_helper import InferenceHelper
-from model.scripts.fetch_live_data import fetch
+from core.charging_planner import get_charging_plan, get_trip_hours
+from core.forecast_cache import MAX_FORECAST_HOURS, ForecastCache, get_model_version
+from model.inference.registry import ModelRegistry
+
+# The forecasting stack (darts, torch, meteostat) is only imported when the models are loaded or
+# live data is fetched, so that the API starts quickly
+
+MODEL_RESULTS_DIR = base_path / "model_results"
+FORECAST_MODEL_NAME = os.environ.get("FORECAST_MODEL_NAME", "lstm")
+MODEL_NAMES = os.environ.get("MODEL_NAMES", FORECAST_MODEL_NAME).split(",")
+# "darts" or "torchscript" for models exported with `model.scripts.export_model`
+FORECAST_RUNTIME = os.environ.get("FORECAST_RUNTIME", "darts")
+TIMEZONE = pytz.timezone("Europe/Berlin")  # hard coded to Germany (for now)
+# Larger batches are rejected, so that a single request cannot occupy the workers for too long
+MAX_BATCH_SIZE = int(os.environ.get("MAX_SCHEDULE_BATCH_SIZE", 1000))
+# Number of schedules of a batch computed per call to the thread pool. The charging windows of a
+# chunk are computed at once with `get_batch_charging_windows`.
+BATCH_CHUNK_SIZE = 64
 
-db = MongoDBClient()
+logger = logging.getLogger(__name__)
+
+model_registry = ModelRegistry()  # loaded by `load_models`
+_loaded_model_version: str | None = None
+_load_models_lock = threading.Lock()
 router = APIRouter(prefix="/schedule", tags=["schedule"])
 
 
@@ -33,6 +75,18 @@ async def get_schedule(
     max_charging_power: int = Query(
         30, description="Maximum charging power (defaults to 30 kW)"
     ),
+    mode: ScheduleMode = Query(
+        ScheduleMode.WINDOWS,
+        description="WINDOWS for contiguous windows ranked by emissions or PLAN for the "
+        "cleanest set of charging slots before the next trip (defaults to WINDOWS)",
+    ),
+    n_trips: int = Query(
+        None,
+        ge=1,
+        description="Only return charging windows that start before the n-th next trip, "
+        "which needs a shorter forecast (WINDOWS mode, defaults to the next seven days)",
+    ),
+    db: AsyncMongoDBClient = Depends(get_db),
 ) -> list[ChargingWindow]:
     """Get the charging schedule for a specific user.
 
@@ -42,57 +96,492 @@ async def get_schedule(
         initial_soc: The initial state of charge of the user's car (defaults to 100)
         min_charging_duration: The minimum charging duration (defaults to 5 min)
         max_charging_power: The maximum charging power available (defaults to 30 kW)
+        mode: How the schedule is computed (defaults to WINDOWS)
+        n_trips: Only return charging windows that start before the n-th next trip (WINDOWS
+            mode, defaults to all windows of the next seven days)
 
     Returns
     -------
-        A list of charging windows sorted by cost (asc)
+        In WINDOWS mode, a list of charging windows sorted by cost (asc). In PLAN mode, the
+        charging slots that together reach the target SOC sorted by start time.
 
     """
-    user = get_user_by_name(user_id)
+    with time_stage("user_lookup"):
+        user = await get_user_by_name(db, user_id)
     if user is None:
         return []
 
-    car = get_car_model_by_name(user.car_model_id)
+    with time_stage("car_model_lookup"):
+        car = await get_car_model_by_name(db, user.car_model_id)
 
     # Get all the commutes for the given user
-    commutes = [
-        CommuteEntity(**doc) for doc in db.find_commutes_by_user_id(user_id=user_id)
-    ]
+    with time_stage("commutes_lookup"):
+        commutes = [
+            CommuteEntity(**doc)
+            for doc in await db.find_commutes_by_user_id(user_id=user_id)
+        ]
+
+    # Only forecast as far ahead as the schedule needs. The same time is used to trim the
+    # forecast and to pick the trips, so that both agree around an hour boundary.
+    now = datetime.now(TIMEZONE)
+    soc_curve = get_soc_curve(commutes, initial_soc, car, now)
+    trips = get_trips(commutes, car, now)
+    until = get_forecast_end(trips[0], car, mode, max_charging_power, n_trips, now)
+
+    with time_stage("forecast"):
+        energy_mix = (await run_in_threadpool(forecast_cache.get, until)).energy_mix
+
+    return get_charging_schedule(
+        car=car,
+        commutes=commutes,
+        energy_mix=energy_mix,
+        initial_soc=initial_soc,
+        min_charging_duration=min_charging_duration,
+        max_charging_power=max_charging_power,
+        mode=mode,
+        soc_curve=soc_curve,
+        trips=trips,
+        n_trips=n_trips,
+        now=now,
+    )
+
+
+@router.post("/batch")
+async def get_schedules(
+    schedule_requests: list[ScheduleRequest],
+    db: AsyncMongoDBClient = Depends(get_db),
+) -> StreamingResponse:
+    """Get the charging schedules for many users at once.
+
+    The energy mix is only predicted once, as far ahead as the longest schedule needs, and all
+    users, car models and commutes are loaded with one query per collection. The schedules are
+    computed in chunks of `BATCH_CHUNK_SIZE` per thread, where the charging windows of all
+    requests in WINDOWS mode are computed at once, and streamed back as newline-delimited JSON,
+    one ScheduleResult per line. A schedule that fails only sets the error of its result.
+
+    Args
+    ----
+        schedule_requests: The users to schedule and their current charging situation, at most
+            `MAX_BATCH_SIZE`
+
+    Returns
+    -------
+        A stream of ScheduleResult objects in the order of the requests
+
+    """
+    if len(schedule_requests) > MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=422,
+            detail=f"A batch can contain at most {MAX_BATCH_SIZE} schedule requests, "
+            f"but contains {len(schedule_requests)}.",
+        )
+
+    user_ids = list(
+        {schedule_request.user_id for schedule_request in schedule_requests}
+    )
+    with time_stage("user_lookup"):
+        users = {
+            doc["name"]: User(**doc) for doc in await db.find_users_by_names(user_ids)
+        }
+    with time_stage("car_model_lookup"):
+        car_models = {
+            doc["name"]: CarModel(**doc)
+            for doc in await db.find_car_models_by_names(
+                list({user.car_model_id for user in users.values()})
+            )
+        }
+    with time_stage("commutes_lookup"):
+        commutes = defaultdict(list)
+        for doc in await db.find_commutes_by_user_ids(user_ids):
+            commute = CommuteEntity(**doc)
+            commutes[commute.user_id].append(commute)
+
+    # The SOC curve and trips of every request that can be scheduled and the error of every
+    # request that failed, by its position in the batch
+    soc_curves: dict[int, pd.Series] = {}
+    trips: dict[int, tuple[pd.DatetimeIndex, pd.DatetimeIndex]] = {}
+    errors: dict[int, str] = {}
+    now = datetime.now(TIMEZONE)
+
+    def get_batch_forecast_end() -> pd.Timestamp | None:
+        forecast_ends = []
+        for i, schedule_request in enumerate(schedule_requests):
+            user = users.get(schedule_request.user_id)
+            car = car_models.get(user.car_model_id) if user is not None else None
+            if car is None:
+                continue
+
+            try:
+                soc_curves[i] = get_soc_curve(
+                    commutes[schedule_request.user_id],
+                    schedule_request.initial_soc,
+                    car,
+                    now,
+                )
+                trips[i] = get_trips(commutes[schedule_request.user_id], car, now)
+                forecast_ends.append(
+                    get_forecast_end(
+                        trips[i][0],
+                        car,
+                        schedule_request.mode,
+                        schedule_request.max_charging_power,
+                        schedule_request.n_trips,
+                        now,
+                    )
+                )
+            except Exception as e:  # pylint: disable=W0718
+                logger.exception("Failed to get the SOC curve of %s", user.name)
+                errors[i] = str(e)
+
+        if not forecast_ends or any(end is None for end in forecast_ends):
+            return None
+        return max(forecast_ends)
+
+    until = await run_in_threadpool(get_batch_forecast_end)
+    with time_stage("forecast"):
+        energy_mix = (await run_in_threadpool(forecast_cache.get, until)).energy_mix
+    emission_intensity = get_emission_intensity(energy_mix)
+
+    def get_schedule_result(
+        i: int, schedule_request: ScheduleRequest
+    ) -> ScheduleResult:
+        user = users.get(schedule_request.user_id)
+        if user is None:
+            return ScheduleResult(user_id=schedule_request.user_id, charging_windows=[])
+
+        car = car_models.get(user.car_model_id)
+        if car is None:
+            return ScheduleResult(
+                user_id=schedule_request.user_id,
+                charging_windows=[],
+                error=f"Car Model with ID {user.car_model_id} does not exist.",
+            )
+
+        if i in errors:
+            return ScheduleResult(
+                user_id=schedule_request.user_id, charging_windows=[], error=errors[i]
+            )
+
+        return ScheduleResult(
+            user_id=schedule_request.user_id,
+            charging_windows=get_charging_schedule(
+                car=car,
+                commutes=commutes[schedule_request.user_id],
+                energy_mix=energy_mix,
+                initial_soc=schedule_request.initial_soc,
+                min_charging_duration=schedule_request.min_charging_duration,
+                max_charging_power=schedule_request.max_charging_power,
+                mode=schedule_request.mode,
+                emission_intensity=emission_intensity,
+                soc_curve=soc_curves[i],
+                trips=trips[i],
+                n_trips=schedule_request.n_trips,
+                now=now,
+            ),
+        )
+
+    def get_batch_charging_schedules(
+        start: int, end: int
+    ) -> dict[int, list[ChargingWindow]]:
+        # The requests in WINDOWS mode whose SOC curve could be computed
+        windows_requests = [
+            i
+            for i in range(start, end)
+            if schedule_requests[i].mode == ScheduleMode.WINDOWS and i in soc_curves
+        ]
+        if not windows_requests:
+            return {}
+
+        try:
+            with time_stage("charging_windows"):
+                batch_charging_windows = get_batch_charging_windows(
+                    car_models=[
+                        car_models[users[schedule_requests[i].user_id].car_model_id]
+                        for i in windows_requests
+                    ],
+                    soc_curves=[soc_curves[i] for i in windows_requests],
+                    energy_mix=energy_mix,
+                    min_charging_durations=[
+                        timedelta(minutes=schedule_requests[i].min_charging_duration)
+                        for i in windows_requests
+                    ],
+                    max_charging_powers=[
+                        schedule_requests[i].max_charging_power
+                        for i in windows_requests
+                    ],
+                    emission_intensity=emission_intensity,
+                )
+        except Exception:  # pylint: disable=W0718
+            # Schedule the requests one by one, so that only the failing ones get an error
+            logger.exception("Failed to get the charging windows of a batch at once")
+            return {}
+
+        charging_schedules = {}
+        for i, charging_windows in zip(windows_requests, batch_charging_windows):
+            if schedule_requests[i].n_trips is not None:
+                charging_windows = get_charging_windows_before_trip(
+                    charging_windows, trips[i][0], schedule_requests[i].n_trips, now
+                )
+            charging_schedules[i] = to_charging_windows(charging_windows)
+
+        return charging_schedules
+
+    def get_schedule_results(start: int, end: int) -> list[ScheduleResult]:
+        charging_schedules = get_batch_charging_schedules(start, end)
+        results = []
+        for i in range(start, end):
+            schedule_request = schedule_requests[i]
+            try:
+                if i in charging_schedules:
+                    results.append(
+                        ScheduleResult(
+                            user_id=schedule_request.user_id,
+                            charging_windows=charging_schedules[i],
+                        )
+                    )
+                else:
+                    results.append(get_schedule_result(i, schedule_request))
+            except Exception as e:  # pylint: disable=W0718
+                logger.exception("Failed to schedule %s", schedule_request.user_id)
+                results.append(
+                    ScheduleResult(
+                        user_id=schedule_request.user_id,
+                        charging_windows=[],
+                        error=str(e),
+                    )
+                )
+
+        return results
+
+    async def stream_schedule_results() -> AsyncIterator[str]:
+        for start in range(0, len(schedule_requests), BATCH_CHUNK_SIZE):
+            end = min(start + BATCH_CHUNK_SIZE, len(schedule_requests))
+            for result in await run_in_threadpool(get_schedule_results, start, end):
+                yield result.model_dump_json(by_alias=True) + "\n"
+
+    return StreamingResponse(
+        stream_schedule_results(), media_type="application/x-ndjson"
+    )
+
+
+@router.get("/forecast")
+async def get_forecast_stats() -> dict:
+    """Get the cache hit/miss counters and the age of the cached energy mix forecast."""
+    return forecast_cache.get_stats()
+
+
+def get_forecast_model_version() -> str:
+    """Get the version of the files of the forecasting model."""
+    return get_model_version(MODEL_RESULTS_DIR / FORECAST_MODEL_NAME)
+
 
-    m = InferenceHelper(str(base_path / "model_results" / "lstm"))
+def load_models():
+    """Load the forecasting models, unless they are already loaded and their files unchanged."""
+    global _loaded_model_version  # pylint: disable=W0603
+
+    with _load_models_lock:
+        model_version = get_forecast_model_version()
+        if not model_registry.names or model_version != _loaded_model_version:
+            model_registry.load(str(MODEL_RESULTS_DIR), MODEL_NAMES, FORECAST_RUNTIME)
+            _loaded_model_version = model_version
+
+
+def get_latest_data_hour() -> pd.Timestamp | None:
+    """Look up the latest hour published by SMARD."""
+    from model.inference.smard import (  # pylint: disable=C0415
+        fetch_latest_smard_timestamp,
+    )
+
+    return fetch_latest_smard_timestamp()
+
+
+def get_energy_mix(n_hours: int = MAX_FORECAST_HOURS) -> pd.DataFrame:
+    """Predict the energy mix of the given number of hours, by default the next seven days."""
+    from model.scripts.fetch_live_data import fetch  # pylint: disable=C0415
+
+    load_models()
+    m = model_registry.get(FORECAST_MODEL_NAME)
+
+    data_req = m.get_data_request_info(n_hours)
+    # The TorchScript runtime takes and returns DataFrames instead of darts TimeSeries
+    as_time_series = FORECAST_RUNTIME == "darts"
+    smard_data, weather_data = fetch(
+        data_req, timer=time_stage, as_time_series=as_time_series
+    )
+    with time_stage("inference"):
+        prediction = m.predict(smard_data, weather_data, n_hours)
+    if not as_time_series:
+        return prediction
 
-    data_req = m.get_data_request_info(
-        7 * 24
-    )  # Data requirements for 7 days ahead prediction
-    smard_data, weather_data = fetch(data_req)
-    prediction = m.predict(smard_data, weather_data, 7 * 24)
     energy_mix = prediction.pd_dataframe()
     energy_mix = energy_mix.reset_index()
 
-    timezone = pytz.timezone("Europe/Berlin")  # hard coded to Germany (for now)
+    return energy_mix
+
+
+def get_soc_curve(
+    commutes: list[CommuteEntity],
+    initial_soc: float,
+    car: CarModel,
+    now: datetime | None = None,
+) -> pd.Series:
+    """Get the SOC curve of a car over the next seven days, starting at midnight today."""
+    now = now or datetime.now(TIMEZONE)
+    with time_stage("soc_curve"):
+        return get_soc_curve_from_commutes(
+            commutes, get_curve_start(now), initial_soc, car
+        )
+
+
+def get_trips(
+    commutes: list[CommuteEntity], car: CarModel, now: datetime | None = None
+) -> tuple[pd.DatetimeIndex, pd.DatetimeIndex]:
+    """Get the hours during which the trips of the next seven days start and end."""
+    now = now or datetime.now(TIMEZONE)
+    return get_trip_hours(commutes, get_curve_start(now), car)
+
+
+def get_curve_start(now: datetime) -> datetime:
+    """Get the start of the SOC curve and the trips of a car, which is midnight today."""
+    return datetime(now.year, now.month, now.day, 0, 0, 0)
+
+
+def get_next_trip_start(
+    trip_starts: pd.DatetimeIndex, n_trips: int, now: datetime | None = None
+) -> pd.Timestamp | None:
+    """
+    Get the start of the hour during which the n-th next trip of a car starts.
+
+    Args:
+        trip_starts: The hours during which the trips of the car start, see `get_trips`
+        n_trips: The number of the trip, counting from 1 for the next trip
+        now: The current time in Germany, defaults to the system time
+
+    Returns:
+        The start of the hour, or None if the car makes fewer trips until the end of the curve.
+    """
+    now = now or datetime.now(TIMEZONE)
+    current_hour = pd.Timestamp(now.replace(tzinfo=None)).floor("h")
+    trip_starts = trip_starts[trip_starts >= current_hour]
+    if len(trip_starts) < n_trips:
+        return None
+
+    return trip_starts[n_trips - 1]
+
+
+def get_forecast_end(
+    trip_starts: pd.DatetimeIndex,
+    car: CarModel,
+    mode: ScheduleMode,
+    max_charging_power: int,
+    n_trips: int | None = None,
+    now: datetime | None = None,
+) -> pd.Timestamp | None:
+    """
+    Get the last hour of the energy mix that the charging schedule of a car depends on.
+
+    Args:
+        trip_starts: The hours during which the trips of the car start, see `get_trips`
+        car: The car model
+        mode: How the schedule is computed
+        max_charging_power: The maximum charging power available
+        n_trips: Only schedule charging windows that start before the n-th next trip
+        now: The current time in Germany, defaults to the system time
+
+    Returns:
+        The last hour, or None if the schedule depends on the whole forecast.
+    """
+    if mode == ScheduleMode.PLAN:
+        # The plan only uses the hours before the next trip
+        trip_start = get_next_trip_start(trip_starts, 1, now)
+        return trip_start + pd.Timedelta(hours=1) if trip_start is not None else None
+
+    if (
+        n_trips is None
+        or (trip_start := get_next_trip_start(trip_starts, n_trips, now)) is None
+    ):
+        return None
+
+    # A window that starts before the trip lasts at most as long as charging an empty battery
+    max_charging_hours = get_charging_time_table(
+        car, max_charging_power
+    ).get_time_to_charge(0)
+    return trip_start + pd.Timedelta(hours=int(np.ceil(max_charging_hours)))
+
+
+def get_charging_schedule(
+    car: CarModel,
+    commutes: list[CommuteEntity],
+    energy_mix: pd.DataFrame,
+    initial_soc: float,
+    min_charging_duration: int,
+    max_charging_power: int,
+    mode: ScheduleMode = ScheduleMode.WINDOWS,
+    emission_intensity: np.ndarray | None = None,
+    soc_curve: pd.Series | None = None,
+    trips: tuple[pd.DatetimeIndex, pd.DatetimeIndex] | None = None,
+    n_trips: int | None = None,
+    now: datetime | None = None,
+) -> list[ChargingWindow]:
+    """Get the charging windows of a car given its commutes and the predicted energy mix."""
+    now = now or datetime.now(TIMEZONE)
+    if soc_curve is None:
+        soc_curve = get_soc_curve(commutes, initial_soc, car, now)
+    if trips is None:
+        trips = get_trips(commutes, car, now)
 
     # calculate charging windows
-    soc_curve = get_soc_curve_from_commutes(
-        commutes,
-        datetime(
-            datetime.now(timezone).year,
-            datetime.now(timezone).month,
-            datetime.now(timezone).day,
-            0,
-            0,
-            0,
-        ),
-        initial_soc,
-        car,
-    )
-    charging_windows = get_charging_windows(
-        car_model=car,
-        soc_curve=soc_curve,
-        energy_mix=energy_mix,
-        min_charging_duration=timedelta(minutes=min_charging_duration),
-        max_charging_power=max_charging_power,
-    )
+    if mode == ScheduleMode.PLAN:
+        with time_stage("charging_plan"):
+            charging_windows = get_charging_plan(
+                car_model=car,
+                soc_curve=soc_curve,
+                energy_mix=energy_mix,
+                max_charging_power=max_charging_power,
+                trip_starts=trips[0],
+                trip_ends=trips[1],
+                emission_intensity=emission_intensity,
+            )
+    else:
+        with time_stage("charging_windows"):
+            charging_windows = get_charging_windows(
+                car_model=car,
+                soc_curve=soc_curve,
+                energy_mix=energy_mix,
+                min_charging_duration=timedelta(minutes=min_charging_duration),
+                max_charging_power=max_charging_power,
+                emission_intensity=emission_intensity,
+            )
+        if n_trips is not None:
+            charging_windows = get_charging_windows_before_trip(
+                charging_windows, trips[0], n_trips, now
+            )
+
+    return to_charging_windows(charging_windows)
+
+
+def get_charging_windows_before_trip(
+    charging_windows: list[tuple[datetime, datetime, float]],
+    trip_starts: pd.DatetimeIndex,
+    n_trips: int,
+    now: datetime | None = None,
+) -> list[tuple[datetime, datetime, float]]:
+    """Keep the charging windows that start before the n-th next trip of a car."""
+    trip_start = get_next_trip_start(trip_starts, n_trips, now)
+    if trip_start is None:
+        return charging_windows
 
+    return [
+        charging_window
+        for charging_window in charging_windows
+        if charging_window[0] < trip_start
+    ]
+
+
+def to_charging_windows(
+    charging_windows: list[tuple[datetime, datetime, float]],
+) -> list[ChargingWindow]:
+    """Convert (start, end, gCO2) tuples to ChargingWindow objects with emissions in kgCO2."""
     return [
         ChargingWindow(
             start_time=start_time.isoformat(),
@@ -103,19 +592,26 @@ async def get_schedule(
     ]
 
 
-def get_user_by_name(user: str) -> User:
+async def get_user_by_name(db: AsyncMongoDBClient, user: str) -> User:
     """Get a user given their ID."""
-    user = db.find_user_by_name(user)
+    user = await db.find_user_by_name(user)
     if user is None:
         return None
 
     return User(**user)
 
 
-def get_car_model_by_name(car_model: str) -> CarModel:
+async def get_car_model_by_name(db: AsyncMongoDBClient, car_model: str) -> CarModel:
     """Get a car model given its ID."""
-    car = db.find_car_model_by_name(car_model)
+    car = await db.find_car_model_by_name(car_model)
     if car is None:
         raise ValueError(f"Car Model with ID {car_model} does not exist.")
 
     return CarModel(**car)
+
+
+forecast_cache = ForecastCache(
+    predict=get_energy_mix,
+    get_latest_data_hour=get_latest_data_hour,
+    get_model_version=get_forecast_model_version,
+)
@@ -1,19 +1,18 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends
 
-from mongodb import MongoDBClient
+from mongodb import AsyncMongoDBClient, get_db
 from schemas import User
 
-db = MongoDBClient()
 router = APIRouter(prefix="/user", tags=["user"])
 
 
 @router.post("/")
-async def add_user(user: User):
+async def add_user(user: User, db: AsyncMongoDBClient = Depends(get_db)):
     """
     Add a new user to the database.
     """
     try:
-        user_id = db.insert_user(user.to_dict())
+        user_id = await db.insert_user(user.to_dict())
 
         return {"id": str(user_id), "message": "User added successfully!"}
     except Exception as e:  # pylint: disable=W0718
@@ -100,6 +100,40 @@ class ChargingWindow(CamelModel):
     emissions: float
 
 
+class ScheduleMode(str, Enum):
+    """Enum for storing the ways a charging schedule can be computed."""
+
+    WINDOWS = "WINDOWS"  # Contiguous windows ranked by emissions
+    PLAN = "PLAN"  # Cleanest charging slots before the next trip
+
+
+class ScheduleRequest(CamelModel):
+    """Schedule Request Model."""
+
+    user_id: str
+    initial_soc: float = 100
+    min_charging_duration: int = 5
+    max_charging_power: int = 30
+    mode: ScheduleMode = ScheduleMode.WINDOWS
+    n_trips: int | None = None  # Only windows before the n-th next trip (WINDOWS mode)
+
+    @field_validator("n_trips")
+    @classmethod
+    def validate_n_trips(cls, v):  # pylint: disable=C0103
+        """Validate the number of trips."""
+        if v is not None and v < 1:
+            raise ValueError("The number of trips must be at least 1")
+        return v
+
+
+class ScheduleResult(CamelModel):
+    """Schedule Result Model."""
+
+    user_id: str
+    charging_windows: list[ChargingWindow]
+    error: str | None = None
+
+
 class CarModel(CamelModel):
     """Car Model."""
 
@@ -0,0 +1,388 @@
+"""
+Benchmarks of the charging scheduler core on synthetic data.
+
+Run from the project root:
+
+    python api/benchmarks/bench_charging_scheduler.py --output before.json
+    python api/benchmarks/bench_charging_scheduler.py --output after.json --compare before.json
+"""
+
+import argparse
+import functools
+import json
+import pathlib
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from typing import Any, Callable
+
+base_path = pathlib.Path(__file__).parents[2]
+sys.path.append(str(base_path))
+sys.path.append(str(base_path / "api" / "app"))
+
+import numpy as np
+import pandas as pd
+
+from schemas import CarModel, CommuteEntity
+from core import charging_scheduler
+from core.charging_scheduler import (
+    get_charging_windows,
+    get_soc_curve_from_commutes,
+    get_time_to_charge,
+)
+from model import config
+
+try:
+    from core import charging_planner
+except ImportError:
+    charging_planner = None
+
+# Functions that were added later are looked up optionally, so that the suite also runs on older
+# revisions to compare against. The benchmarks of missing functions are skipped.
+clear_charging_time_table_cache = getattr(
+    charging_scheduler, "clear_charging_time_table_cache", None
+)
+get_batch_charging_windows = getattr(
+    charging_scheduler, "get_batch_charging_windows", None
+)
+get_charging_time_table = getattr(charging_scheduler, "get_charging_time_table", None)
+get_charging_plan = getattr(charging_planner, "get_charging_plan", None)
+get_trip_hours = getattr(charging_planner, "get_trip_hours", None)
+solve_charging_plan = getattr(charging_planner, "solve_charging_plan", None)
+
+COMMUTE_SCALES = [1, 10, 100]
+HORIZON_SCALES = [168, 672, 2688]
+DEFAULT_COMMUTES = 10
+DEFAULT_HORIZON = 168
+# Number of cars whose charging windows are computed at once, like a chunk of a batch request
+BATCH_SIZE = 64
+MAX_CHARGING_POWER = 11
+# Peak power of a car whose charging curve tapers below MAX_CHARGING_POWER from 65 % SOC
+TAPERING_PEAK_POWER = 20
+MIN_BENCHMARK_SECONDS = 0.5
+WEEK_DAYS = ["MON", "TUE", "WED", "THU", "FRI", "SAT", "SUN"]
+
+
+def generate_car_model(
+    rng: np.random.Generator, peak_power: float | None = None
+) -> CarModel:
+    """Generate a car model with a 101-point charging curve that drops towards 100 %."""
+    peak_power = peak_power or rng.uniform(100, 250)
+    soc = np.arange(101)
+    charging_curve = peak_power * np.clip(1.2 - soc / 100, 0.1, 1.0)
+
+    return CarModel(
+        name="benchmark-car",
+        battery_capacity=float(rng.uniform(50, 100)),
+        charging_curve=charging_curve.round(1).tolist(),
+        consumption_per_kilometer=float(rng.uniform(150, 250)),
+    )
+
+
+def generate_commutes(n_commutes: int, rng: np.random.Generator) -> list[CommuteEntity]:
+    """Generate commutes with one to five usages each, half of them round trips."""
+    commutes = []
+    for i in range(n_commutes):
+        is_round_trip = bool(i % 2)
+        usage = []
+        for day in rng.choice(WEEK_DAYS, size=rng.integers(1, 6), replace=False):
+            start_hour = int(rng.integers(5, 20))
+            usage_entry = {
+                "day": day,
+                "start_time": f"{start_hour:02d}:{int(rng.integers(0, 60)):02d}",
+            }
+            if is_round_trip:
+                usage_entry["end_time"] = (
+                    f"{start_hour + 2:02d}:{int(rng.integers(0, 60)):02d}"
+                )
+            usage.append(usage_entry)
+
+        commutes.append(
+            CommuteEntity(
+                user_id="benchmark-user",
+                name=f"commute-{i}",
+                is_round_trip=is_round_trip,
+                usage=usage,
+                approx_distance_km=float(rng.uniform(5, 60)),
+                approx_duration_minutes=float(rng.uniform(10, 90)),
+                traffic="MEDIUM",
+            )
+        )
+
+    return commutes
+
+
+def generate_energy_mix(
+    n_hours: int, start: datetime, rng: np.random.Generator
+) -> pd.DataFrame:
+    """Generate a predicted energy mix like the forecast, with float32 generation in MWh."""
+    energy_mix = pd.DataFrame(
+        rng.uniform(0, 20000, (n_hours, len(config.EMISSION_FACTORS))).astype(
+            "float32"
+        ),
+        columns=list(config.EMISSION_FACTORS),
+    )
+    energy_mix.insert(0, "timestamp", pd.date_range(start, periods=n_hours, freq="h"))
+
+    return energy_mix
+
+
+def measure(function: Callable[[], Any]) -> dict[str, float]:
+    """
+    Measure the latency, throughput and peak memory of a function.
+
+    Args:
+        function: The function to measure, called without arguments
+
+    Returns:
+        A dict with the median and p95 latency in ms, the calls per second and the peak memory
+        of a single call in KiB.
+    """
+    # Warm up and measure the peak memory of a single call
+    function()
+    tracemalloc.start()
+    function()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies = []
+    benchmark_start = time.perf_counter()
+    while time.perf_counter() - benchmark_start < MIN_BENCHMARK_SECONDS:
+        call_start = time.perf_counter()
+        function()
+        latencies.append(time.perf_counter() - call_start)
+    total_seconds = time.perf_counter() - benchmark_start
+
+    return {
+        "latency_ms_median": float(np.median(latencies)) * 1000,
+        "latency_ms_p95": float(np.percentile(latencies, 95)) * 1000,
+        "throughput_per_s": len(latencies) / total_seconds,
+        "peak_memory_kib": peak_memory / 1024,
+        "n_calls": len(latencies),
+    }
+
+
+def run_benchmarks(seed: int = 0) -> list[dict[str, Any]]:
+    """Run every benchmark at every scale and return one result per function and scale."""
+    rng = np.random.default_rng(seed)
+    start = datetime(2024, 1, 1)
+    car_model = generate_car_model(rng)
+    results = []
+
+    def add_result(function: str, scale: dict[str, int], benchmark: Callable | None):
+        if benchmark is None:
+            print(f"{function:<32} {json.dumps(scale):<36} {'skipped':>13}")
+            return
+
+        result = {"function": function, "scale": scale, **measure(benchmark)}
+        results.append(result)
+        print(
+            f"{function:<32} {json.dumps(scale):<36} "
+            f"{result['latency_ms_median']:>10.3f} ms {result['peak_memory_kib']:>10.1f} KiB"
+        )
+
+    # The SOC curve always covers seven days, only the number of commutes changes
+    for n_commutes in COMMUTE_SCALES:
+        commutes = generate_commutes(n_commutes, rng)
+        add_result(
+            "get_soc_curve_from_commutes",
+            {"commutes": n_commutes},
+            lambda commutes=commutes: get_soc_curve_from_commutes(
+                commutes, start, 100, car_model
+            ),
+        )
+
+    # Once with a cold charging time table cache and once with a warm one
+    def get_time_to_charge_cold():
+        clear_charging_time_table_cache()
+        get_time_to_charge(car_model, 20, MAX_CHARGING_POWER)
+
+    add_result(
+        "get_time_to_charge[cold]",
+        {},
+        get_time_to_charge_cold if clear_charging_time_table_cache else None,
+    )
+    add_result(
+        "get_time_to_charge[warm]",
+        {},
+        lambda: get_time_to_charge(car_model, 20, MAX_CHARGING_POWER),
+    )
+
+    scales = [(n_commutes, DEFAULT_HORIZON) for n_commutes in COMMUTE_SCALES] + [
+        (DEFAULT_COMMUTES, n_hours)
+        for n_hours in HORIZON_SCALES
+        if n_hours != DEFAULT_HORIZON
+    ]
+    for n_commutes, n_hours in scales:
+        commutes = generate_commutes(n_commutes, rng)
+        soc_curve = get_soc_curve_from_commutes(commutes, start, 60, car_model)
+        trip_starts, trip_ends = (
+            get_trip_hours(commutes, start, car_model)
+            if get_trip_hours
+            else (None, None)
+        )
+        energy_mix = generate_energy_mix(n_hours, start, rng)
+        scale = {"commutes": n_commutes, "hours": n_hours}
+
+        add_result(
+            "get_charging_windows",
+            scale,
+            lambda soc_curve=soc_curve, energy_mix=energy_mix: get_charging_windows(
+                car_model=car_model,
+                soc_curve=soc_curve,
+                energy_mix=energy_mix,
+                min_charging_duration=timedelta(minutes=5),
+                max_charging_power=MAX_CHARGING_POWER,
+            ),
+        )
+        add_result(
+            "get_charging_plan",
+            scale,
+            (
+                functools.partial(
+                    get_charging_plan,
+                    car_model=car_model,
+                    soc_curve=soc_curve,
+                    energy_mix=energy_mix,
+                    max_charging_power=MAX_CHARGING_POWER,
+                    trip_starts=trip_starts,
+                    trip_ends=trip_ends,
+                )
+                if get_charging_plan and get_trip_hours
+                else None
+            ),
+        )
+
+    # The charging windows of a chunk of cars, one by one and at once
+    car_models = [generate_car_model(rng) for _ in range(BATCH_SIZE)]
+    soc_curves = [
+        get_soc_curve_from_commutes(
+            generate_commutes(DEFAULT_COMMUTES, rng), start, rng.uniform(20, 100), model
+        )
+        for model in car_models
+    ]
+    energy_mix = generate_energy_mix(DEFAULT_HORIZON, start, rng)
+    scale = {"cars": BATCH_SIZE, "hours": DEFAULT_HORIZON}
+    add_result(
+        "get_charging_windows[loop]",
+        scale,
+        lambda: [
+            get_charging_windows(
+                car_model=model,
+                soc_curve=soc_curve,
+                energy_mix=energy_mix,
+                min_charging_duration=timedelta(minutes=5),
+                max_charging_power=MAX_CHARGING_POWER,
+            )
+            for model, soc_curve in zip(car_models, soc_curves)
+        ],
+    )
+    add_result(
+        "get_batch_charging_windows",
+        scale,
+        (
+            functools.partial(
+                get_batch_charging_windows,
+                car_models=car_models,
+                soc_curves=soc_curves,
+                energy_mix=energy_mix,
+                min_charging_durations=[timedelta(minutes=5)] * BATCH_SIZE,
+                max_charging_powers=[MAX_CHARGING_POWER] * BATCH_SIZE,
+            )
+            if get_batch_charging_windows
+            else None
+        ),
+    )
+
+    # The solver alone, with every hour of the horizon available, for a car that charges at a
+    # constant power and for one whose charging curve tapers
+    tapering_car_model = generate_car_model(rng, TAPERING_PEAK_POWER)
+    for n_hours in HORIZON_SCALES:
+        emission_intensity = rng.uniform(50, 500, n_hours)
+        for name, model in [("constant", car_model), ("tapering", tapering_car_model)]:
+            add_result(
+                f"solve_charging_plan[{name}]",
+                {"hours": n_hours},
+                (
+                    functools.partial(
+                        solve_charging_plan,
+                        emission_intensity=emission_intensity,
+                        charging_time_table=get_charging_time_table(
+                            model, MAX_CHARGING_POWER
+                        ),
+                        battery_capacity=model.battery_capacity,
+                        current_soc=20,
+                    )
+                    if solve_charging_plan and get_charging_time_table
+                    else None
+                ),
+            )
+
+    return results
+
+
+def get_revision() -> str | None:
+    """Get the current git revision of the project, if available."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=base_path,
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: list[dict[str, Any]], baseline: list[dict[str, Any]]):
+    """Print the latency and memory of every benchmark relative to a baseline run."""
+
+    def get_key(result: dict[str, Any]) -> str:
+        return f"{result['function']} {json.dumps(result['scale'])}"
+
+    baseline_by_key = {get_key(result): result for result in baseline}
+    print(f"\n{'benchmark':<68} {'latency':>10} {'memory':>10}")
+    for result in results:
+        base = baseline_by_key.get(get_key(result))
+        if base is None:
+            print(f"{get_key(result):<68} {'new':>10}")
+            continue
+
+        latency_ratio = result["latency_ms_median"] / base["latency_ms_median"]
+        memory_ratio = result["peak_memory_kib"] / max(base["peak_memory_kib"], 1e-9)
+        print(f"{get_key(result):<68} {latency_ratio:>9.2f}x {memory_ratio:>9.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output", type=str, help="Write the results to a JSON file")
+    parser.add_argument(
+        "--compare", type=str, help="Compare the results with an earlier JSON file"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.seed)
+    report = {
+        "revision": get_revision(),
+        "created_at": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": results,
+    }
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            compare(results, json.load(file)["results"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""
+Benchmark of the forecast horizons that typical commute patterns need, and of the inference
+latency saved by predicting only that far ahead instead of seven days.
+
+The horizons are computed for every hour of a week. The latency of every horizon is measured
+with the trained model on random data. Run from the project root:
+
+    python api/benchmarks/bench_forecast_horizon.py --model_dir model_results/lstm
+"""
+
+import argparse
+import json
+import pathlib
+import sys
+import time
+from datetime import datetime, timedelta
+
+base_path = pathlib.Path(__file__).parents[2]
+sys.path.append(str(base_path))
+sys.path.append(str(base_path / "api" / "app"))
+
+import numpy as np
+import pandas as pd
+
+from bench_charging_scheduler import generate_car_model, get_revision
+from schemas import CommuteEntity, ScheduleMode
+from core.forecast_cache import MAX_FORECAST_HOURS, get_horizon_hours
+from routers.schedule import get_forecast_end, get_trips
+
+MAX_CHARGING_POWER = 11
+N_LATENCY_RUNS = 10
+# SMARD publishes the generation of an hour a few hours later, so the forecast starts in the past
+DEFAULT_DATA_LAG_HOURS = 3
+
+# Typical commute patterns, as (day, start time, end time) of every usage
+COMMUTE_PATTERNS = {
+    "weekday_commuter": [
+        (day, "07:30", "17:30") for day in ["MON", "TUE", "WED", "THU", "FRI"]
+    ],
+    "part_time_commuter": [(day, "08:00", "13:00") for day in ["MON", "WED", "FRI"]],
+    "daily_errands": [
+        (day, "18:00", None)
+        for day in ["MON", "TUE", "WED", "THU", "FRI", "SAT", "SUN"]
+    ],
+    "weekend_trips": [("SAT", "10:00", "18:00"), ("SUN", "11:00", None)],
+    "no_trips": [],
+}
+
+# The schedule modes of the benchmark, as (mode, number of trips)
+SCHEDULE_MODES = {
+    "plan": (ScheduleMode.PLAN, None),
+    "windows_next_trip": (ScheduleMode.WINDOWS, 1),
+    "windows_next_3_trips": (ScheduleMode.WINDOWS, 3),
+    "windows": (ScheduleMode.WINDOWS, None),
+}
+
+
+def get_commutes(pattern: list[tuple[str, str, str | None]]) -> list[CommuteEntity]:
+    """Get the commutes of a pattern, as one commute with a usage per trip."""
+    if not pattern:
+        return []
+
+    return [
+        CommuteEntity(
+            user_id="benchmark-user",
+            name="benchmark-commute",
+            is_round_trip=any(end_time is not None for _, _, end_time in pattern),
+            usage=[
+                {"day": day, "start_time": start_time}
+                | ({"end_time": end_time} if end_time is not None else {})
+                for day, start_time, end_time in pattern
+            ],
+            approx_distance_km=30,
+            approx_duration_minutes=40,
+            traffic="MEDIUM",
+        )
+    ]
+
+
+def get_horizons(data_lag_hours: int, seed: int = 0) -> dict[str, dict[str, list[int]]]:
+    """
+    Get the forecast horizon of every commute pattern and schedule mode at every hour of a week.
+
+    Returns:
+        The horizons in hours by pattern and mode, one per hour of the week.
+    """
+    car_model = generate_car_model(np.random.default_rng(seed))
+    week_start = datetime(2024, 1, 1)  # a Monday
+    horizons = {}
+    for pattern_name, pattern in COMMUTE_PATTERNS.items():
+        commutes = get_commutes(pattern)
+        horizons[pattern_name] = {mode_name: [] for mode_name in SCHEDULE_MODES}
+
+        for hour in range(7 * 24):
+            now = week_start + timedelta(hours=hour, minutes=30)
+            trip_starts, _ = get_trips(commutes, car_model, now)
+            data_hour = pd.Timestamp(now).floor("h") - pd.Timedelta(
+                hours=data_lag_hours
+            )
+
+            for mode_name, (mode, n_trips) in SCHEDULE_MODES.items():
+                until = get_forecast_end(
+                    trip_starts, car_model, mode, MAX_CHARGING_POWER, n_trips, now
+                )
+                horizons[pattern_name][mode_name].append(
+                    get_horizon_hours(data_hour, until)
+                )
+
+    return horizons
+
+
+def measure_latencies(
+    model_dir: str, n_hours: list[int], seed: int = 0
+) -> dict[int, float]:
+    """
+    Measure the median latency of predicting the energy mix of every horizon with a model.
+
+    Returns:
+        The median latency in ms by horizon in hours.
+    """
+    # pylint: disable=C0415
+    from model.inference.inference_helper import InferenceHelper
+    from model.scripts.export_model import get_random_data
+    from model.util import convert_df_to_time_series
+
+    helper = InferenceHelper(model_dir)
+    smard_data, weather_data = get_random_data(helper, seed)
+    smard_data = convert_df_to_time_series(smard_data)
+    weather_data = convert_df_to_time_series(weather_data)
+
+    latencies = {}
+    for n in sorted(set(n_hours)):
+        helper.predict(smard_data, weather_data, n)  # warm up
+
+        runs = []
+        for _ in range(N_LATENCY_RUNS):
+            start = time.perf_counter()
+            helper.predict(smard_data, weather_data, n)
+            runs.append(time.perf_counter() - start)
+        latencies[n] = float(np.median(runs)) * 1000
+        print(f"Median latency of {n:>3} hours: {latencies[n]:>8.1f} ms")
+
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_dir", type=str, default="model_results/lstm")
+    parser.add_argument(
+        "--data_lag_hours",
+        type=int,
+        default=DEFAULT_DATA_LAG_HOURS,
+        help="The hours between the latest SMARD data and the current time",
+    )
+    parser.add_argument("--output", type=str, help="Write the results to a JSON file")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    horizons = get_horizons(args.data_lag_hours, args.seed)
+    all_horizons = [
+        n
+        for mode_horizons in horizons.values()
+        for pattern_horizons in mode_horizons.values()
+        for n in pattern_horizons
+    ]
+    latencies = measure_latencies(
+        args.model_dir, all_horizons + [MAX_FORECAST_HOURS], args.seed
+    )
+    full_latency = latencies[MAX_FORECAST_HOURS]
+
+    # The mean over the week, as if a schedule was requested at every hour
+    results = []
+    print(
+        f"\n{'pattern':<20} {'mode':<22} {'horizon':>10} {'latency':>12} {'saved':>8}"
+    )
+    for pattern_name, mode_horizons in horizons.items():
+        for mode_name, pattern_horizons in mode_horizons.items():
+            mean_latency = float(np.mean([latencies[n] for n in pattern_horizons]))
+            result = {
+                "pattern": pattern_name,
+                "mode": mode_name,
+                "horizon_hours_mean": float(np.mean(pattern_horizons)),
+                "latency_ms_mean": mean_latency,
+                "latency_saved": 1 - mean_latency / full_latency,
+            }
+            results.append(result)
+            print(
+                f"{pattern_name:<20} {mode_name:<22} "
+                f"{result['horizon_hours_mean']:>8.1f} h {mean_latency:>9.1f} ms "
+                f"{result['latency_saved']:>7.0%}"
+            )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(
+                {
+                    "revision": get_revision(),
+                    "created_at": datetime.now().isoformat(),
+                    "model_dir": args.model_dir,
+                    "data_lag_hours": args.data_lag_hours,
+                    "latency_ms_by_horizon": latencies,
+                    "results": results,
+                },
+                file,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Benchmark of the API startup: the time it takes to import the app, and which modules it imports.
+
+Fails if the median import time exceeds the budget or if the forecasting stack is imported
+eagerly. Run from the project root:
+
+    python api/benchmarks/bench_startup.py --budget_ms 1500
+"""
+
+import argparse
+import json
+import pathlib
+import re
+import subprocess
+import sys
+from datetime import datetime
+
+import numpy as np
+
+from bench_charging_scheduler import get_revision
+
+base_path = pathlib.Path(__file__).parents[2]
+app_path = base_path / "api" / "app"
+
+DEFAULT_BUDGET_MS = 1500
+DEFAULT_RUNS = 5
+N_SLOWEST_IMPORTS = 15
+
+# Modules that are only needed to forecast and must not be imported when the API starts
+DEFERRED_MODULES = [
+    "darts",
+    "torch",
+    "pytorch_lightning",
+    "meteostat",
+    "sklearn",
+    "xgboost",
+    "model.inference.inference_helper",
+    "model.scripts.fetch_live_data",
+]
+
+# Imports the app in a fresh interpreter and prints the import time and the deferred modules
+# that were imported anyway
+IMPORT_SCRIPT = f"""
+import json, sys, time
+start = time.perf_counter()
+import main
+seconds = time.perf_counter() - start
+print(json.dumps({{
+    "seconds": seconds,
+    "deferred_modules": [name for name in {DEFERRED_MODULES!r} if name in sys.modules],
+}}))
+"""
+
+IMPORT_TIME_PATTERN = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+
+def measure_import(profile_imports: bool = False) -> dict:
+    """
+    Import the app in a fresh interpreter, like a new uvicorn worker.
+
+    Args:
+        profile_imports: Whether to also measure the time of every import with `-X importtime`,
+            which slows the import down
+
+    Returns:
+        A dict with the import time in seconds, the deferred modules that were imported and,
+        if `profile_imports` is set, the slowest imports.
+    """
+    result = subprocess.run(
+        [
+            sys.executable,
+            *(["-X", "importtime"] * profile_imports),
+            "-c",
+            IMPORT_SCRIPT,
+        ],
+        cwd=app_path,
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+
+    # `-X importtime` writes the time of every import to stderr, indented by its nesting level.
+    # Keep the top-level imports and their direct imports, e.g. the routers imported by `main`.
+    imports = [
+        {"module": match[4], "cumulative_ms": int(match[2]) / 1000}
+        for match in IMPORT_TIME_PATTERN.finditer(result.stderr)
+        if len(match[3]) <= 3
+    ]
+
+    return {
+        **json.loads(result.stdout.strip().splitlines()[-1]),
+        "imports": sorted(imports, key=lambda x: -x["cumulative_ms"]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--budget_ms",
+        type=float,
+        default=DEFAULT_BUDGET_MS,
+        help="The maximum median time to import the app",
+    )
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS)
+    parser.add_argument("--output", type=str, help="Write the results to a JSON file")
+    args = parser.parse_args()
+
+    # Warm up the file system cache, then profile the imports once
+    profile = measure_import(profile_imports=True)
+    runs = [measure_import() for _ in range(args.runs)]
+    import_ms = [run["seconds"] * 1000 for run in runs]
+    deferred_modules = sorted(
+        {name for run in runs for name in run["deferred_modules"]}
+    )
+    median_ms = float(np.median(import_ms))
+
+    print(f"{'module':<48} {'cumulative':>12}")
+    for entry in profile["imports"][:N_SLOWEST_IMPORTS]:
+        print(f"{entry['module']:<48} {entry['cumulative_ms']:>9.1f} ms")
+    print(
+        f"\nImport time of the app: median {median_ms:.1f} ms, "
+        f"max {max(import_ms):.1f} ms (budget {args.budget_ms:.0f} ms)"
+    )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(
+                {
+                    "revision": get_revision(),
+                    "created_at": datetime.now().isoformat(),
+                    "import_ms": import_ms,
+                    "budget_ms": args.budget_ms,
+                    "deferred_modules": deferred_modules,
+                    "imports": profile["imports"],
+                },
+                file,
+                indent=2,
+            )
+
+    failures = []
+    if deferred_modules:
+        failures.append(f"The app imports {deferred_modules} at startup.")
+    if median_ms > args.budget_ms:
+        failures.append(
+            f"The app takes {median_ms:.1f} ms to import, "
+            f"more than the budget of {args.budget_ms:.0f} ms."
+        )
+    if failures:
+        sys.exit("\n".join(failures))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,8 @@
+import pathlib
+import sys
+
+# The API modules import each other by their top-level names, like when the API is started from
+# api/app
+base_path = pathlib.Path(__file__).parents[2]
+sys.path.append(str(base_path))
+sys.path.append(str(base_path / "api" / "app"))
@@ -0,0 +1,314 @@
+"""
+Tests of the vectorized charging scheduler against straightforward loops over the trips, SOCs and
+hours, and of the charging plan solver on a case where the cleanest hours are not optimal.
+"""
+
+from datetime import datetime, time, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from schemas import CarModel, CommuteEntity
+from core.charging_planner import solve_charging_plan
+from core.charging_scheduler import (
+    WEEK_DAYS,
+    get_batch_charging_windows,
+    get_charging_time_table,
+    get_charging_windows,
+    get_soc_curve_from_commutes,
+    get_time_to_charge,
+)
+from model import config
+
+# A Monday, so that all trips of the week lie within the seven days of the SOC curve
+START = datetime(2024, 1, 1)
+MAX_CHARGING_POWER = 11
+
+
+def get_car_model(rng: np.random.Generator, peak_power: float = 20) -> CarModel:
+    """Get a car model with a charging curve that drops towards 100 %."""
+    soc = np.arange(101)
+
+    return CarModel(
+        name="test-car",
+        battery_capacity=float(rng.uniform(40, 100)),
+        charging_curve=(peak_power * np.clip(1.2 - soc / 100, 0.1, 1.0)).tolist(),
+        consumption_per_kilometer=float(rng.uniform(150, 250)),
+    )
+
+
+def get_commutes(rng: np.random.Generator) -> list[CommuteEntity]:
+    """Get a commute in the morning and one in the evening, which never overlap."""
+    commutes = []
+    for name, first_hour in [("morning", 6), ("evening", 16)]:
+        is_round_trip = name == "evening"
+        usage = []
+        for day in rng.choice(list(WEEK_DAYS), size=4, replace=False):
+            start_hour = first_hour + int(rng.integers(0, 3))
+            usage_entry = {
+                "day": day,
+                "start_time": f"{start_hour:02d}:{int(rng.integers(0, 60)):02d}",
+            }
+            if is_round_trip:
+                usage_entry["end_time"] = (
+                    f"{start_hour + 2:02d}:{int(rng.integers(0, 60)):02d}"
+                )
+            usage.append(usage_entry)
+
+        commutes.append(
+            CommuteEntity(
+                user_id="test-user",
+                name=name,
+                is_round_trip=is_round_trip,
+                usage=usage,
+                approx_distance_km=float(rng.uniform(5, 40)),
+                approx_duration_minutes=float(rng.uniform(10, 90)),
+                traffic="MEDIUM",
+            )
+        )
+
+    return commutes
+
+
+def get_energy_mix(rng: np.random.Generator) -> pd.DataFrame:
+    """Get a random energy mix over the seven days of the SOC curve."""
+    energy_mix = pd.DataFrame(
+        rng.uniform(0, 20000, (7 * 24, len(config.EMISSION_FACTORS))),
+        columns=list(config.EMISSION_FACTORS),
+    )
+    energy_mix.insert(0, "timestamp", pd.date_range(START, periods=7 * 24, freq="h"))
+
+    return energy_mix
+
+
+def get_reference_soc_curve(
+    commutes: list[CommuteEntity], initial_soc: float, car_model: CarModel
+) -> pd.Series:
+    """Lower the SOC hour by hour for every trip, down to at most 0 %."""
+    soc_curve = pd.Series(
+        initial_soc,
+        dtype="float64",
+        name="soc",
+        index=pd.date_range(START, periods=7 * 24, freq="h"),
+    )
+
+    for commute in commutes:
+        soc_change = (
+            car_model.consumption_per_kilometer * commute.approx_distance_km
+        ) / (10 * car_model.battery_capacity)
+
+        for trip in commute.usage:
+            trip_day = START + timedelta(days=WEEK_DAYS[trip.day])
+            trip_start = datetime.combine(trip_day, time.fromisoformat(trip.start_time))
+            if trip.end_time:
+                trip_end = datetime.combine(trip_day, time.fromisoformat(trip.end_time))
+            else:
+                trip_end = trip_start + timedelta(
+                    minutes=commute.approx_duration_minutes
+                )
+
+            # The SOC drops in every hour after the trip starts up to the first full hour after
+            # it ends, and stays there
+            affected_hours = soc_curve.index[
+                (soc_curve.index > trip_start)
+                & (soc_curve.index < trip_end + timedelta(hours=1))
+            ]
+            for hour in affected_hours:
+                soc_curve[soc_curve.index >= hour] -= soc_change / len(affected_hours)
+
+    return soc_curve.clip(lower=0)
+
+
+def get_reference_time_to_charge(
+    car_model: CarModel,
+    current_soc: float,
+    target_soc: int = 80,
+    efficiency: float = 0.9,
+) -> float:
+    """Sum up the time to charge every percent from the current to the target SOC."""
+    one_percent_capacity = car_model.battery_capacity / 100
+    charging_rates = zip(
+        car_model.charging_curve[int(np.floor(current_soc)) : target_soc],
+        car_model.charging_curve[int(np.floor(current_soc)) + 1 : target_soc + 1],
+    )
+
+    return (
+        sum(
+            2
+            * one_percent_capacity
+            / min(current_rate + next_rate, 2 * MAX_CHARGING_POWER)
+            for current_rate, next_rate in charging_rates
+        )
+        / efficiency
+    )
+
+
+def get_reference_charging_windows(
+    car_model: CarModel,
+    soc_curve: pd.Series,
+    energy_mix: pd.DataFrame,
+    min_charging_duration: timedelta,
+    min_soc: int = 20,
+    max_soc: int = 80,
+) -> list[tuple[datetime, datetime, float]]:
+    """Average the emissions of every window over its candidate hours one window at a time."""
+    df = energy_mix.merge(right=soc_curve, left_on="timestamp", right_index=True)
+    df = df[df["soc"] <= max_soc]
+    if not (above_min_soc := df[df["soc"] >= min_soc]).empty:
+        df = above_min_soc
+
+    emission_cols = list(config.EMISSION_FACTORS)
+    emission_factors = np.array(list(config.EMISSION_FACTORS.values()))
+    generation = df[emission_cols].to_numpy()
+    emission_intensity = (
+        generation / generation.sum(axis=1, keepdims=True) * emission_factors
+    ).sum(axis=1)
+
+    charging_windows = []
+    for timestamp, soc in zip(df["timestamp"], df["soc"]):
+        finish_time = timestamp + timedelta(
+            hours=get_reference_time_to_charge(car_model, soc, max_soc)
+        )
+        in_window = (df["timestamp"] >= timestamp) & (
+            df["timestamp"] <= finish_time.ceil("h")
+        )
+        cost = (
+            emission_intensity[in_window.to_numpy()].mean()
+            * (max_soc - soc)
+            / 100
+            * car_model.battery_capacity
+        )
+
+        end_time = finish_time.round("min").to_pydatetime()
+        if end_time - timestamp.to_pydatetime() >= min_charging_duration:
+            charging_windows.append((timestamp.to_pydatetime(), end_time, cost))
+
+    return sorted(charging_windows, key=lambda t: t[2])
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_soc_curve_matches_loop(seed: int):
+    rng = np.random.default_rng(seed)
+    car_model = get_car_model(rng)
+    commutes = get_commutes(rng)
+
+    soc_curve = get_soc_curve_from_commutes(commutes, START, 90, car_model)
+    reference = get_reference_soc_curve(commutes, 90, car_model)
+
+    assert soc_curve.index.equals(reference.index)
+    np.testing.assert_allclose(soc_curve.to_numpy(), reference.to_numpy(), atol=1e-9)
+
+
+def test_time_to_charge_matches_sum():
+    rng = np.random.default_rng(0)
+    car_model = get_car_model(rng)
+
+    for current_soc in np.linspace(0, 100, 301):
+        for target_soc in [50, 80, 100]:
+            assert get_time_to_charge(
+                car_model, current_soc, MAX_CHARGING_POWER, target_soc
+            ) == pytest.approx(
+                get_reference_time_to_charge(car_model, current_soc, target_soc),
+                rel=1e-12,
+                abs=1e-12,
+            )
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_charging_windows_match_loop(seed: int):
+    rng = np.random.default_rng(seed)
+    car_model = get_car_model(rng)
+    soc_curve = get_soc_curve_from_commutes(
+        get_commutes(rng), START, float(rng.uniform(30, 90)), car_model
+    )
+    energy_mix = get_energy_mix(rng)
+
+    charging_windows = get_charging_windows(
+        car_model, soc_curve, energy_mix, timedelta(minutes=5), MAX_CHARGING_POWER
+    )
+    reference = get_reference_charging_windows(
+        car_model, soc_curve, energy_mix, timedelta(minutes=5)
+    )
+
+    assert len(charging_windows) == len(reference)
+    assert sorted(window[:2] for window in charging_windows) == sorted(
+        window[:2] for window in reference
+    )
+    assert [window[2] for window in charging_windows] == pytest.approx(
+        [window[2] for window in reference], rel=1e-9
+    )
+
+
+def test_batch_charging_windows_match_single_car():
+    rng = np.random.default_rng(0)
+    car_models = [get_car_model(rng, rng.uniform(10, 50)) for _ in range(8)]
+    soc_curves = [
+        get_soc_curve_from_commutes(
+            get_commutes(rng), START, float(rng.uniform(10, 100)), car_model
+        )
+        for car_model in car_models
+    ]
+    energy_mix = get_energy_mix(rng)
+    min_charging_durations = [
+        timedelta(minutes=int(rng.integers(5, 120))) for _ in car_models
+    ]
+    max_charging_powers = [int(rng.choice([4, 11, 22])) for _ in car_models]
+
+    batch_charging_windows = get_batch_charging_windows(
+        car_models, soc_curves, energy_mix, min_charging_durations, max_charging_powers
+    )
+
+    assert batch_charging_windows == [
+        get_charging_windows(
+            car_model,
+            soc_curve,
+            energy_mix,
+            min_charging_duration,
+            max_charging_power,
+        )
+        for car_model, soc_curve, min_charging_duration, max_charging_power in zip(
+            car_models, soc_curves, min_charging_durations, max_charging_powers
+        )
+    ]
+
+
+def test_charging_plan_beats_cleanest_hours():
+    # With a tapering charging curve, an hour charges less energy the later it is used. Charging
+    # in the cleanest hours 1 and 0 spends the fast first hour at 40 gCO2/kWh, while charging in
+    # hours 1 and 2 spends it at 0 gCO2/kWh and only the slower second hour at 45 gCO2/kWh.
+    soc = np.arange(101)
+    car_model = CarModel(
+        name="test-car",
+        battery_capacity=100,
+        charging_curve=(20 * np.clip(1.2 - soc / 100, 0.1, 1.0)).tolist(),
+        consumption_per_kilometer=200,
+    )
+    charging_time_table = get_charging_time_table(car_model, MAX_CHARGING_POWER)
+    charging_hours = (
+        charging_time_table.cumulative_hours / charging_time_table.efficiency
+    )
+    # The SOC from which charging to 80 % takes exactly two hours
+    current_soc = np.interp(np.interp(80, soc, charging_hours) - 2, charging_hours, soc)
+    emission_intensity = np.array([40.0, 0.0, 45.0])
+
+    hours, durations, costs = solve_charging_plan(
+        emission_intensity, charging_time_table, car_model.battery_capacity, current_soc
+    )
+
+    # Charge during the cleanest hours in chronological order
+    cleanest_soc = np.interp(
+        np.interp(current_soc, soc, charging_hours) + np.arange(3),
+        charging_hours,
+        soc,
+    )
+    cleanest_cost = np.sum(
+        emission_intensity[[0, 1]]
+        * np.diff(cleanest_soc)
+        / 100
+        * car_model.battery_capacity
+    )
+
+    assert hours.tolist() == [1, 2]
+    np.testing.assert_allclose(durations, [1, 1])
+    assert costs.sum() < cleanest_cost
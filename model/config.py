@@ -28,6 +28,15 @@ SMARD_DATA_PATHS = [
     os.path.abspath("C:\\Your\\Path\\hpi-porsche-challenge\\data\\raw\\2021_2022.csv"),
     os.path.abspath("C:\\Your\\Path\\hpi-porsche-challenge\\data\\raw\\2022_2023.csv"),
 ]
+# Preprocessed data is cached here, keyed by a hash of the raw files
+PROCESSED_DATA_PATH = os.path.join(RAW_DATA_PATH, "data", "processed")
+FEATURE_STORE_PATH = os.path.join(PROCESSED_DATA_PATH, "features")
+# Live SMARD and weather observations are recorded here between forecast refreshes
+OBSERVATION_STORE_PATH = os.path.join(PROCESSED_DATA_PATH, "observations")
+# Responses of the SMARD API, see `model.inference.response_cache`
+SMARD_RESPONSE_CACHE_PATH = os.path.join(PROCESSED_DATA_PATH, "smard_responses")
+# Hourly data of every weather station, shared by training and inference
+WEATHER_STATION_CACHE_PATH = os.path.join(PROCESSED_DATA_PATH, "weather_stations")
 WEATHER_DATA_SOLAR_PATH = os.path.join(
     RAW_DATA_PATH, "data/raw/weather_data_solar_stations.csv"
 )
@@ -91,3 +100,6 @@ EMISSION_FACTORS = {
 }
 
 N_OPTUNA_TRIALS = 10
+
+# Maximum number of concurrent requests to the SMARD API
+SMARD_MAX_CONCURRENT_REQUESTS = 8
@@ -4,6 +4,7 @@ from darts import TimeSeries
 
 from model.data.smard import load as load_smard_data
 from model.data.weather import load as load_weather_data
+from model.data.weather import load_from_station_cache as load_cached_weather_data
 
 
 @dataclass
@@ -14,8 +15,29 @@ class Dataset:
     weather: TimeSeries
 
 
-def load():
+def load(use_weather_station_cache: bool = False):
     train, val, test = load_smard_data()
-    weather = load_weather_data()
+    weather = _load_weather(use_weather_station_cache, train, test)
 
     return Dataset(train=train, val=val, test=test, weather=weather)
+
+
+def load_weather(use_weather_station_cache: bool = False) -> TimeSeries:
+    """
+    Load only the weather data of `load`, reading the SMARD data only if its range is needed.
+    """
+    if use_weather_station_cache:
+        train, _, test = load_smard_data()
+        return _load_weather(use_weather_station_cache, train, test)
+
+    return load_weather_data()
+
+
+def _load_weather(
+    use_weather_station_cache: bool, train: TimeSeries, test: TimeSeries
+) -> TimeSeries:
+    if use_weather_station_cache:
+        # Read the same weather source as inference, covering the whole SMARD data
+        return load_cached_weather_data(train.start_time(), test.end_time())
+
+    return load_weather_data()
@@ -1,33 +1,35 @@
+import hashlib
 import logging
+import os
 import pandas as pd
 
 from model import config
 from model.util import (
-    convert_comma_str_to_float,
     convert_df_to_time_series,
     fix_float64,
 )
 
 logger = logging.getLogger(__name__)
 
+# Bump this whenever `_preprocess` changes so that stale caches are not reused
+CACHE_VERSION = 1
+
 
 def load():
-    # Load data files
-    data = pd.concat(
-        [pd.read_csv(file, delimiter=";") for file in config.SMARD_DATA_PATHS],
-        ignore_index=True,
+    cache_path = _get_cache_path(config.SMARD_DATA_PATHS)
+    if not os.path.exists(cache_path):
+        _build_cache(cache_path)
+
+    # Split data into sets, only reading the rows of each set from the cache
+    train_data = _read_cache(cache_path, [("timestamp", "<=", config.TRAIN_END_DATE)])
+    validation_data = _read_cache(
+        cache_path,
+        [
+            ("timestamp", ">", config.TRAIN_END_DATE),
+            ("timestamp", "<=", config.VAL_END_DATE),
+        ],
     )
-
-    # Preprocess data
-    data = _preprocess(data)
-
-    # Split data into sets
-    train_data = data.loc[data["timestamp"] <= config.TRAIN_END_DATE]
-    validation_data = data.loc[
-        (data["timestamp"] > config.TRAIN_END_DATE)
-        & (data["timestamp"] <= config.VAL_END_DATE)
-    ]
-    test_data = data.loc[data["timestamp"] > config.VAL_END_DATE]
+    test_data = _read_cache(cache_path, [("timestamp", ">", config.VAL_END_DATE)])
     logger.info(
         "Data split into sets: train=%s, val=%s, test=%s",
         len(train_data),
@@ -57,22 +59,66 @@ def load():
     return (train_data, validation_data, test_data)
 
 
-def _preprocess(data: pd.DataFrame) -> pd.DataFrame:
-    # Convert "Datum" column to datetime
-    data["Datum"] = pd.to_datetime(data["Datum"], format="%d.%m.%Y")
+def _get_cache_path(paths: list[str]) -> str:
+    """Get the path of the preprocessed data, which changes whenever a raw file changes."""
+    digest = hashlib.sha256(f"v{CACHE_VERSION}".encode())
+    for path in paths:
+        with open(path, "rb") as file:
+            while chunk := file.read(1 << 20):
+                digest.update(chunk)
+
+    return os.path.join(
+        config.PROCESSED_DATA_PATH, f"smard_{digest.hexdigest()[:16]}.parquet"
+    )
 
-    # Convert "Anfang" and "Ende" columns to time
-    data["Anfang"] = pd.to_datetime(data["Anfang"], format="%H:%M").dt.time
-    data["Ende"] = pd.to_datetime(data["Ende"], format="%H:%M").dt.time
 
-    # Convert energy columns to float
+def _build_cache(cache_path: str):
+    logger.info("Preprocessing SMARD data into %s", cache_path)
+
+    # Load data files, parsing the German number format natively
+    data = pd.concat(
+        [
+            pd.read_csv(
+                file,
+                delimiter=";",
+                decimal=",",
+                thousands=".",
+                na_values=["-"],
+                dtype={"Datum": str, "Anfang": str, "Ende": str},
+            )
+            for file in config.SMARD_DATA_PATHS
+        ],
+        ignore_index=True,
+    )
+
+    # Preprocess data
+    data = _preprocess(data)
+
+    # Write to a temporary file first so that an interrupted run leaves no broken cache behind
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    temporary_path = f"{cache_path}.{os.getpid()}.tmp"
+    data.to_parquet(temporary_path, index=False)
+    os.replace(temporary_path, cache_path)
+
+
+def _read_cache(cache_path: str, filters: list[tuple]) -> pd.DataFrame:
+    return pd.read_parquet(
+        cache_path,
+        filters=[(column, op, pd.Timestamp(value)) for column, op, value in filters],
+        memory_map=True,
+    )
+
+
+def _preprocess(data: pd.DataFrame) -> pd.DataFrame:
+    # Convert energy columns to float, cells that could not be parsed become NaN
     energy_columns = [col for col in data.columns if "MWh" in col]
-    for col in energy_columns:
-        data[col] = data[col].apply(convert_comma_str_to_float)
+    data[energy_columns] = (
+        data[energy_columns].apply(pd.to_numeric, errors="coerce").astype("float64")
+    )
 
     # Combine "Datum" and "Anfang" into a single datetime column
     data["Timestamp"] = pd.to_datetime(
-        data["Datum"].astype(str) + " " + data["Anfang"].astype(str)
+        data["Datum"] + " " + data["Anfang"], format="%d.%m.%Y %H:%M"
     )
 
     # Drop the "Datum", "Anfang", and "Ende" columns
@@ -33,6 +33,31 @@ def load() -> TimeSeries:
     # Convert timestamp to datetime
     data["timestamp"] = pd.to_datetime(data["timestamp"])
 
+    return _to_time_series(data)
+
+
+def load_from_station_cache(start: pd.Timestamp, end: pd.Timestamp) -> TimeSeries:
+    """
+    Loads the weather data from the weather station cache that is also used for inference,
+    fetching the stations that are missing in the cache first.
+    """
+    # pylint: disable=C0415
+    from model.inference.weather import aggregate_stations, get_station_data
+
+    logger.info("Loading weather data from the station cache...")
+    station_data = get_station_data(config.WIND_IDS + config.SOLAR_IDS, start, end)
+
+    # Same columns as the weather data files
+    data_wind = aggregate_stations(station_data, config.WIND_IDS, config.WIND_COLUMNS)
+    data_solar = aggregate_stations(
+        station_data, config.SOLAR_IDS, config.SOLAR_COLUMNS
+    )
+    data = pd.concat([data_wind, data_solar], axis=1).reset_index(names=["timestamp"])
+
+    return _to_time_series(data)
+
+
+def _to_time_series(data: pd.DataFrame) -> TimeSeries:
     # Avoid any missing values
     missing_values = data.isnull().sum()
     assert missing_values.sum() == 0, (
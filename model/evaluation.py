@@ -1,5 +1,9 @@
 import logging
-from typing import Callable, Any
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Any, Sequence
 from collections import defaultdict
 
 import numpy as np
@@ -15,6 +19,95 @@ from model.util import get_covariate_args_for_model
 
 logger = logging.getLogger(__name__)
 
+ERROR_PROFILE_FILE_NAME = "error_profile.npz"
+
+
+@dataclass
+class ErrorProfile:
+    """CO2-weighted forecast errors broken down by lead time and energy source.
+
+    Attributes
+    ----------
+    sources
+        The names of the energy sources.
+    overall
+        The CO2 RMSE averaged over splits and sources, equal to the `co2_rmse` metric.
+    per_lead_time
+        The CO2 RMSE over all splits at every lead time (hour 1 to the horizon), averaged over
+        sources. Shape (horizon,).
+    per_source
+        The CO2 RMSE of every source, averaged over splits. Shape (sources,).
+    per_lead_time_and_source
+        The CO2 RMSE over all splits at every lead time for every source.
+        Shape (horizon, sources).
+    """
+
+    sources: list[str]
+    overall: float
+    per_lead_time: np.ndarray
+    per_source: np.ndarray
+    per_lead_time_and_source: np.ndarray
+
+    def save(self, output_dir: str):
+        """Save the error profile as a compressed NumPy archive in `output_dir`."""
+        np.savez_compressed(
+            os.path.join(output_dir, ERROR_PROFILE_FILE_NAME),
+            sources=np.array(self.sources),
+            overall=self.overall,
+            per_lead_time=self.per_lead_time,
+            per_source=self.per_source,
+            per_lead_time_and_source=self.per_lead_time_and_source,
+        )
+
+    @classmethod
+    def load(cls, output_dir: str) -> "ErrorProfile":
+        """Load an error profile saved with `save` from `output_dir`."""
+        with np.load(os.path.join(output_dir, ERROR_PROFILE_FILE_NAME)) as archive:
+            return cls(
+                sources=archive["sources"].tolist(),
+                overall=float(archive["overall"]),
+                per_lead_time=archive["per_lead_time"],
+                per_source=archive["per_source"],
+                per_lead_time_and_source=archive["per_lead_time_and_source"],
+            )
+
+
+def get_error_profile(
+    y_true: np.ndarray, y_pred: np.ndarray, sources: list[str]
+) -> ErrorProfile:
+    """Compute the CO2-weighted error profile of stacked forecasts.
+
+    Parameters
+    ----------
+    y_true
+        The original values of shape (splits, horizon, sources).
+    y_pred
+        The forecasted values of shape (splits, horizon, sources).
+    sources
+        The names of the energy sources.
+
+    Returns
+    -------
+    ErrorProfile
+        The overall, per-lead-time and per-source errors.
+    """
+    weights = np.array([EMISSION_FACTORS[name] for name in sources])
+    squared_error = (weights * (y_true.astype(np.float64) - y_pred)) ** 2
+
+    # RMSE over the time axis of every split, like `co2_rmse`, and over the split axis of every
+    # lead time
+    rmse_per_split_and_source = np.sqrt(np.mean(squared_error, axis=1))
+    per_lead_time_and_source = np.sqrt(np.mean(squared_error, axis=0))
+    per_source = np.mean(rmse_per_split_and_source, axis=0)
+
+    return ErrorProfile(
+        sources=list(sources),
+        overall=float(np.mean(per_source)),
+        per_lead_time=np.mean(per_lead_time_and_source, axis=1),
+        per_source=per_source,
+        per_lead_time_and_source=per_lead_time_and_source,
+    )
+
 
 def cross_validation_without_refit(
     model: ForecastingModel,
@@ -27,6 +120,10 @@ def cross_validation_without_refit(
     forecast_horizon: int = 7 * 24,
     refit=False,
     truncate_refit_train_dataset=None,
+    on_split_end: Callable[[int, dict[str, float]], None] | None = None,
+    batched: bool = False,
+    n_jobs: int = 1,
+    return_error_profile: bool = False,
 ) -> defaultdict[str, list[Any]]:
     """Perform cross-validation without refitting the model.
 
@@ -44,11 +141,32 @@ def cross_validation_without_refit(
         The scaler used for rescaling the data, if any.
     max_n_split
         Maximal number of splits for cross-validation. No limiting if none. Default is None.
+    refit
+        Refit the model on all data before each split. Default is False.
+    truncate_refit_train_dataset
+        Number of hours before each split the model is refitted on, if `refit` is set. All
+        data before the split is used if None. Default is None.
     covariates
         Dictionary of covariates to be used during evaluation.
     forecast_horizon
         Forecast horizon in hours, i.e. the size of intervals the model will be tested on.
         Default is 7 * 24.
+    on_split_end
+        Called after every split with the index of the split and the average of every metric
+        over the splits so far, e.g. to report intermediate values for pruning. May raise an
+        exception to stop the evaluation early. Default is None.
+    batched
+        Predict all splits at once as a batch of series instead of one split after another. The
+        results are the same, but models that predict many series in one pass (e.g. the LSTM)
+        are a lot faster. Not possible together with `refit`. Default is False.
+    n_jobs
+        Number of worker processes that refit and evaluate splits in parallel if `refit` is
+        set. Every split is then fitted on its own untrained clone of `model` with the index of
+        the split as random seed, instead of refitting `model` itself one split after another.
+        Default is 1.
+    return_error_profile
+        Also return the `ErrorProfile` of all splits under the key "error_profile".
+        Default is False.
 
     Returns
     -------
@@ -57,6 +175,7 @@ def cross_validation_without_refit(
     """
 
     assert forecast_horizon > 0, "`forecast_horizon` must be bigger than 0."
+    assert not (batched and refit), "`batched` is not possible together with `refit`."
     assert prefix_series.end_time() + Timedelta(hours=1) == test_series.start_time(), (
         f"The series must be continuous but prefix ends at {prefix_series.end_time()} "
         f"and test starts at {test_series.start_time()}."
@@ -86,82 +205,309 @@ def cross_validation_without_refit(
     # Get covariates
     _, covariate_args_inference = get_covariate_args_for_model(model, covariates)
 
-    # Calculate per split
-    metrics_dict = defaultdict(list)
-    for start, end in tqdm(ranges):
-        # Refit model, if requested
-        if refit:
-            # Get training data
-            if truncate_refit_train_dataset is not None:
-                train = full_series_scaled[
-                    max(0, start - truncate_refit_train_dataset) : start
-                ]
-            else:
-                train = full_series_scaled[:start]
-
-            # Fit model
-            model.fit(train, **covariate_args_inference)
-
-        # Run model prediction
-        forecast = model.predict(
-            forecast_horizon,
-            series=full_series_scaled[:start],
-            **covariate_args_inference,
-            verbose=False,
+    if batched:
+        return _cross_validation_batched(
+            model=model,
+            full_series=full_series,
+            full_series_scaled=full_series_scaled,
+            starts=[start for start, _ in ranges],
+            metrics=metrics,
+            data_scaler=data_scaler,
+            covariate_args_inference=covariate_args_inference,
+            forecast_horizon=forecast_horizon,
+            on_split_end=on_split_end,
+            return_error_profile=return_error_profile,
         )
 
-        # Rescale forecast and original data
-        forecast_rescaled = None
-        if data_scaler is not None:
-            forecast_rescaled = data_scaler.inverse_transform(forecast)
-        else:
-            forecast_rescaled = forecast
+    split_kwargs = dict(
+        full_series=full_series,
+        full_series_scaled=full_series_scaled,
+        metrics=metrics,
+        data_scaler=data_scaler,
+        covariate_args_inference=covariate_args_inference,
+        forecast_horizon=forecast_horizon,
+        refit=refit,
+        truncate_refit_train_dataset=truncate_refit_train_dataset,
+    )
 
-        original = full_series[forecast.start_time() : forecast.end_time()]
+    # Calculate per split
+    metrics_dict = defaultdict(list)
+    originals, forecasts = [], []
+    if refit and n_jobs > 1:
+        with ProcessPoolExecutor(
+            max_workers=n_jobs,
+            initializer=_init_refit_worker,
+            initargs=(model.untrained_model(), split_kwargs),
+        ) as executor:
+            futures = [
+                executor.submit(_refit_split_in_worker, start, seed)
+                for seed, (start, _) in enumerate(ranges)
+            ]
+            try:
+                for i, future in enumerate(tqdm(futures)):
+                    split_metrics, original, forecast = future.result()
+                    for name, value in split_metrics.items():
+                        metrics_dict[name].append(value)
+                    originals.append(original)
+                    forecasts.append(forecast)
+                    if on_split_end is not None:
+                        on_split_end(
+                            i,
+                            {
+                                name: average(results)
+                                for name, results in metrics_dict.items()
+                            },
+                        )
+            except BaseException:
+                executor.shutdown(cancel_futures=True)
+                raise
+    else:
+        for i, (start, _) in enumerate(tqdm(ranges)):
+            split_metrics, original, forecast = _evaluate_split(
+                model=model, start=start, **split_kwargs
+            )
+            for name, value in split_metrics.items():
+                metrics_dict[name].append(value)
+            originals.append(original)
+            forecasts.append(forecast)
 
-        # Calculate metrics
-        for name, metric in metrics.items():
-            metrics_dict[name].append(metric(original, forecast_rescaled))
+            if on_split_end is not None:
+                on_split_end(
+                    i,
+                    {name: average(results) for name, results in metrics_dict.items()},
+                )
 
     for metric, results in metrics_dict.items():  # type: ignore
         metrics_dict[metric] = average(results)  # type: ignore
 
     metrics_dict = dict(metrics_dict)  # type: ignore
+    if return_error_profile and originals:
+        metrics_dict["error_profile"] = get_error_profile(
+            np.stack(originals), np.stack(forecasts), list(full_series.columns)
+        )
+
+    return metrics_dict
+
+
+def _evaluate_split(
+    model: ForecastingModel,
+    start,
+    full_series: TimeSeries,
+    full_series_scaled: TimeSeries,
+    metrics: dict[str, Callable],
+    data_scaler: Scaler | None,
+    covariate_args_inference: dict[str, TimeSeries],
+    forecast_horizon: int,
+    refit: bool,
+    truncate_refit_train_dataset: int | None,
+) -> tuple[dict[str, Any], np.ndarray, np.ndarray]:
+    """Evaluate one split of `cross_validation_without_refit`, refitting the model if requested.
+
+    Returns the metrics of the split and the original and forecasted values after rescaling.
+    """
+    # Refit model, if requested
+    if refit:
+        # Get training data
+        if truncate_refit_train_dataset is not None:
+            train = full_series_scaled[
+                max(
+                    full_series_scaled.start_time(),
+                    start - Timedelta(hours=truncate_refit_train_dataset),
+                ) : start
+            ]
+        else:
+            train = full_series_scaled[:start]
+
+        # Fit model
+        model.fit(train, **covariate_args_inference)
+
+    # Run model prediction
+    forecast = model.predict(
+        forecast_horizon,
+        series=full_series_scaled[:start],
+        **covariate_args_inference,
+        verbose=False,
+    )
+
+    # Rescale forecast and original data
+    forecast_rescaled = None
+    if data_scaler is not None:
+        forecast_rescaled = data_scaler.inverse_transform(forecast)
+    else:
+        forecast_rescaled = forecast
+
+    original = full_series[forecast.start_time() : forecast.end_time()]
+
+    # Calculate metrics
+    split_metrics = {
+        name: metric(original, forecast_rescaled) for name, metric in metrics.items()
+    }
+
+    return split_metrics, original.values(), forecast_rescaled.values()
+
+
+# State of a refit worker process, set once by `_init_refit_worker`
+_refit_worker_state: dict[str, Any] = {}
+
+
+def _init_refit_worker(untrained_model: ForecastingModel, split_kwargs: dict):
+    _refit_worker_state["untrained_model"] = untrained_model
+    _refit_worker_state["split_kwargs"] = split_kwargs
+
+
+def _refit_split_in_worker(
+    start, seed: int
+) -> tuple[dict[str, Any], np.ndarray, np.ndarray]:
+    # Seed every random generator so that the result of a split does not depend on the worker
+    random.seed(seed)
+    np.random.seed(seed)
+    try:
+        import torch  # pylint: disable=C0415
+
+        torch.manual_seed(seed)
+    except ImportError:
+        pass
+
+    return _evaluate_split(
+        model=_refit_worker_state["untrained_model"].untrained_model(),
+        start=start,
+        **_refit_worker_state["split_kwargs"],
+    )
+
+
+def _cross_validation_batched(
+    model: ForecastingModel,
+    full_series: TimeSeries,
+    full_series_scaled: TimeSeries,
+    starts: list,
+    metrics: dict[str, Callable],
+    data_scaler: Scaler | None,
+    covariate_args_inference: dict[str, TimeSeries],
+    forecast_horizon: int,
+    on_split_end: Callable[[int, dict[str, float]], None] | None,
+    return_error_profile: bool,
+) -> dict[str, Any]:
+    """Predict all splits of `cross_validation_without_refit` as one batch of series."""
+    if not starts:
+        return {}
+
+    # Run model prediction for all splits at once, every split uses the same covariates
+    forecasts = model.predict(
+        forecast_horizon,
+        series=[full_series_scaled[:start] for start in starts],
+        **{
+            name: [covariates] * len(starts)
+            for name, covariates in covariate_args_inference.items()
+        },
+        verbose=False,
+    )
+
+    # Rescale all forecasts in one pass over their stacked values
+    if data_scaler is not None:
+        values = np.concatenate([forecast.values(copy=False) for forecast in forecasts])
+        values = data_scaler.inverse_transform(
+            TimeSeries.from_values(values, columns=forecasts[0].columns)
+        ).values(copy=False)
+        forecasts = [
+            TimeSeries.from_times_and_values(
+                times=forecast.time_index,
+                values=split_values,
+                columns=forecast.columns,
+            )
+            for forecast, split_values in zip(
+                forecasts, np.split(values, len(forecasts))
+            )
+        ]
+    originals = [
+        full_series[forecast.start_time() : forecast.end_time()]
+        for forecast in forecasts
+    ]
+
+    # Calculate metrics for all splits at once
+    split_metrics = {
+        name: np.asarray(metric(originals, forecasts), dtype=np.float64)
+        for name, metric in metrics.items()
+    }
+
+    if on_split_end is not None:
+        for i in range(len(starts)):
+            on_split_end(
+                i,
+                {
+                    name: average(values[: i + 1])
+                    for name, values in split_metrics.items()
+                },
+            )
+
+    metrics_dict = {name: average(values) for name, values in split_metrics.items()}
+    if return_error_profile:
+        metrics_dict["error_profile"] = get_error_profile(
+            np.stack([original.values(copy=False) for original in originals]),
+            np.stack([forecast.values(copy=False) for forecast in forecasts]),
+            list(full_series.columns),
+        )
+
     return metrics_dict
 
 
 def co2_rmse(
-    original: TimeSeries,
-    forecast: TimeSeries,
+    original: TimeSeries | Sequence[TimeSeries],
+    forecast: TimeSeries | Sequence[TimeSeries],
     disable_weights: bool = False,
-) -> float:
+) -> float | list[float]:
     """Calculate the RMSE of CO2 emissions.
 
     Parameters
     ----------
     original
-        The original time series.
+        The original time series, or a sequence of them.
     forecast
-        The forecasted time series.
+        The forecasted time series, or a sequence of them of the same length.
 
     Returns
     -------
-    float
-        The RMSE of CO2 emissions.
+    float | list[float]
+        The RMSE of CO2 emissions, or one RMSE per pair of series if sequences were given.
     """
+    if not isinstance(original, TimeSeries):
+        assert len(original) == len(forecast), "Number of series must be equal."
+        if len(original) == 0:
+            return []
+        for original_series, forecast_series in zip(original, forecast):
+            _check_co2_rmse_inputs(original_series, forecast_series)
+
+        # Compute all RMSEs at once on arrays of shape (series, time, components)
+        return list(
+            _co2_rmse(
+                names=list(original[0].columns),
+                y_true=np.stack([series.values(copy=False) for series in original]),
+                y_pred=np.stack([series.values(copy=False) for series in forecast]),
+                disable_weights=disable_weights,
+            )
+        )
+
+    _check_co2_rmse_inputs(original, forecast)
+
+    return _co2_rmse(
+        names=list(original.columns),
+        y_true=original.values(),
+        y_pred=forecast.values(),
+        disable_weights=disable_weights,
+    )
+
 
+def _check_co2_rmse_inputs(original: TimeSeries, forecast: TimeSeries):
     assert original.start_time() == forecast.start_time(), "Start times must be equal."
     assert original.end_time() == forecast.end_time(), "End times must be equal."
     assert list(original.columns) == list(forecast.columns), "Columns must be equal."
-
-    names = list(original.columns)
-    y_true = original.values()
-    y_pred = forecast.values()
-
     assert (
-        len(EMISSION_FACTORS.values()) == y_true.shape[1] == y_pred.shape[1]
+        len(EMISSION_FACTORS.values()) == original.width == forecast.width
     ), "Number of emission factors must be equal to number of columns."
 
+
+def _co2_rmse(
+    names: list[str], y_true: np.ndarray, y_pred: np.ndarray, disable_weights: bool
+):
     # Weighted RMSE
     # Calculate difference between true and predicted values
     if not disable_weights:
@@ -170,9 +516,9 @@ def co2_rmse(
     else:
         diff = y_true - y_pred
     # Calculate RMSE, make sure to average over time axis only
-    mse = np.mean(diff**2, axis=0)
+    mse = np.mean(diff**2, axis=-2)
     rmse = np.sqrt(mse)
     # Average over all energy resources
-    rmse = np.mean(rmse)
+    rmse = np.mean(rmse, axis=-1)
 
     return rmse
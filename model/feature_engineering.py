@@ -1,66 +1,129 @@
 import numpy as np
+import pandas as pd
 from darts import TimeSeries
-from darts.dataprocessing.transformers import Scaler
-from darts.utils.timeseries_generation import datetime_attribute_timeseries
+
+from model.time_covariates import TIME_COVARIATE_COLUMNS, get_time_covariate_values
 
 
 def get_covariates_time(reference_series: TimeSeries) -> TimeSeries:
-    # Create time covariates
-    weekday = datetime_attribute_timeseries(
-        reference_series, attribute="weekday", dtype=np.float32
-    )
-    month = datetime_attribute_timeseries(
-        reference_series, attribute="month", dtype=np.float32
+    # Create the scaled weekday, hour and month covariates in closed form, so that every window
+    # is scaled the same way as the training data
+    return TimeSeries.from_times_and_values(
+        reference_series.time_index,
+        get_time_covariate_values(reference_series.time_index),
+        columns=TIME_COVARIATE_COLUMNS,
     )
-    hour = datetime_attribute_timeseries(
-        reference_series, attribute="hour", dtype=np.float32
+
+
+def get_rolling_means(values: np.ndarray, windows: list[int]) -> np.ndarray:
+    """
+    Compute the rolling mean of every column for several windows with a single cumulative sum.
+
+    The means are the same as those of `add_rolling_mean`, which only uses past data: the mean of
+    a window at row i covers rows i - 2 * window to i - window - 1, where rows before the start
+    repeat the first row, and the mean at the first row is 0.
+
+    Args:
+        values: The values of shape (rows, columns)
+        windows: The window lengths in rows
+
+    Returns:
+        The means of shape (rows, columns * len(windows)), one block of columns per window.
+    """
+    n_rows, n_columns = values.shape
+    max_window = max(windows)
+
+    # Row k of the padded cumulative sum is the sum of all rows before k - 2 * max_window
+    padded = np.concatenate(
+        [np.repeat(values[:1], 2 * max_window, axis=0), values]
+    ).astype(np.float64)
+    cumulative_sum = np.concatenate(
+        [np.zeros((1, n_columns)), np.cumsum(padded, axis=0)]
     )
-    covariates_time = weekday.stack(hour).stack(month)
 
-    # Always scale time covariates
-    covariates_time = Scaler().fit_transform(covariates_time)
+    rows = np.arange(n_rows) + 2 * max_window
+    means = []
+    for window in windows:
+        mean = (
+            cumulative_sum[rows - window] - cumulative_sum[rows - 2 * window]
+        ) / window
+        mean[:1] = 0
+        means.append(mean)
 
-    return covariates_time
+    return np.concatenate(means, axis=1).astype(values.dtype)
 
 
-def add_rolling_mean(data: TimeSeries, lag: int):
-    transformation = {
-        "function": "mean",
-        "mode": "rolling",
-        "window": lag,
-        "center": False,  # We do not want to use future data
-        "min_periods": 1,
-    }
-
-    # Prepend first value, repeat it lag times, to make sure the time series is not shortened
-    prepend = data.values()[0:1]
-    prepend = np.repeat(prepend, lag, axis=0)
-    transformed_timeseries = data.prepend_values(prepend)
-
-    # Apply transformation
-    transformed_timeseries = transformed_timeseries.window_transform(
-        transforms=transformation,
-        forecasting_safe=False,
-        include_current=False,
-        treat_na=0,
+def add_rolling_means(data: TimeSeries, windows: list[int]) -> TimeSeries:
+    """
+    Add rolling means to a series, like chained `add_rolling_mean` calls: every window is computed
+    over the columns of the series and all rolling means of the windows before it.
+    """
+    values = data.values(copy=False)
+    columns = list(data.columns)
+    for window in windows:
+        values = np.concatenate([values, get_rolling_means(values, [window])], axis=1)
+        columns += [f"rolling_mean_{window}_{column}" for column in columns]
+
+    return TimeSeries.from_times_and_values(
+        times=data.time_index, values=values, columns=columns
     )
-    transformed_timeseries = transformed_timeseries.shift(lag)
-    transformed_timeseries = transformed_timeseries.astype(data.dtype)
-
-    transformed_timeseries = transformed_timeseries.split_after(data.end_time())[0]
-
-    # Make sure we do not change the time index of the series
-    assert (
-        transformed_timeseries.start_time() == data.start_time()
-    ), "Start time of transformed series must be equal to start time of original series."
-    assert (
-        transformed_timeseries.end_time() == data.end_time()
-    ), "End time of transformed series must be equal to end time of original series."
-    assert len(transformed_timeseries) == len(
-        data
-    ), "Length of transformed series must be equal to length of original series."
-
-    return data.stack(transformed_timeseries)
+
+
+def add_rolling_mean(data: TimeSeries, lag: int):
+    return add_rolling_means(data, [lag])
+
+
+class IncrementalRollingMeans:
+    """
+    Computes the rolling means of `add_rolling_means` for new rows only, e.g. when a new hour of
+    live data arrives, instead of recomputing them over the whole history.
+
+    Only the last `2 * window` rows of the input of every window are kept, which is all the history
+    the rolling means of the next rows depend on.
+    """
+
+    def __init__(self, windows: list[int]):
+        self.windows = windows
+        self._tails: list[np.ndarray] = []
+        self._end_time: pd.Timestamp | None = None
+
+    def update(self, data: TimeSeries) -> TimeSeries:
+        """
+        Add the rolling means to the rows that follow the rows of the previous update.
+
+        Args:
+            data: The new rows, starting right after the rows of the previous update
+
+        Returns:
+            The new rows with their rolling means, with the same columns as `add_rolling_means`.
+        """
+        if (
+            self._end_time is not None
+            and data.start_time() != self._end_time + data.freq
+        ):
+            raise ValueError(
+                f"The new rows must start at {self._end_time + data.freq}, "
+                f"but start at {data.start_time()}."
+            )
+
+        values = data.values(copy=False)
+        columns = list(data.columns)
+        tails = []
+        for i, window in enumerate(self.windows):
+            tail = self._tails[i] if self._tails else values[:0]
+            rows = np.concatenate([tail, values])
+            means = get_rolling_means(rows, [window])[len(tail) :]
+            tails.append(rows[-2 * window :])
+
+            values = np.concatenate([values, means], axis=1)
+            columns += [f"rolling_mean_{window}_{column}" for column in columns]
+
+        self._tails = tails
+        self._end_time = data.end_time()
+
+        return TimeSeries.from_times_and_values(
+            times=data.time_index, values=values, columns=columns
+        )
 
 
 def add_kinetic_wind_energy_simplified(weather_data: TimeSeries) -> TimeSeries:
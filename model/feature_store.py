@@ -0,0 +1,246 @@
+import hashlib
+import json
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+from darts import TimeSeries
+from darts.timeseries import DIMS, HIERARCHY_TAG, STATIC_COV_TAG
+
+from model import config, data, feature_engineering
+from model.feature_engineering import get_covariates_time
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE_NAME = "manifest.json"
+FEATURES_FILE_NAME = "features.npy"
+
+# Bump this whenever the way a feature set is computed or stored changes
+FEATURE_STORE_VERSION = 2
+
+# Feature sets in the order they are stacked. Every rolling window is computed over all the
+# feature sets before it, exactly like `add_rolling_means` in training.
+WEATHER_FEATURE_SET = "weather"
+TIME_FEATURE_SET = "time"
+ROLLING_WINDOWS = [1, 24, 24 * 7]
+ROLLING_FEATURE_SETS = [f"rolling_mean_{window}" for window in ROLLING_WINDOWS]
+KINETIC_WIND_ENERGY_FEATURE_SET = "kinetic_wind_energy"
+FEATURE_SETS = [
+    WEATHER_FEATURE_SET,
+    TIME_FEATURE_SET,
+    *ROLLING_FEATURE_SETS,
+    KINETIC_WIND_ENERGY_FEATURE_SET,
+]
+
+
+def get_feature_sets(weather: bool, feature_engineering_enabled: bool) -> list[str]:
+    """
+    Get the feature sets that make up the covariates of a training configuration.
+
+    Args:
+        weather: Whether the weather covariates are used
+        feature_engineering_enabled: Whether the engineered features are used
+
+    Returns:
+        The names of the feature sets in the order they are stacked.
+    """
+    if not weather:
+        if feature_engineering_enabled:
+            raise ValueError("Feature engineering requires the weather covariates.")
+        return [TIME_FEATURE_SET]
+
+    if not feature_engineering_enabled:
+        return [WEATHER_FEATURE_SET, TIME_FEATURE_SET]
+
+    return FEATURE_SETS
+
+
+def build(
+    store_dir: str = config.FEATURE_STORE_PATH, use_weather_station_cache: bool = False
+) -> None:
+    """
+    Compute every feature set once and write them to a single float32 array in the feature store.
+
+    The weather data is loaded like in training, so the store must be built from the same weather
+    source that is used for training. The array is stored column-major, so every feature set and
+    every run of adjacent feature sets is one contiguous block of the file. All feature sets share
+    the hourly index of the weather data, which is stored in the manifest together with the
+    columns of every feature set and a hash of the weather data. The store is only rebuilt if the
+    weather data or the feature code changed.
+
+    Args:
+        store_dir: The directory of the feature store
+        use_weather_station_cache: Whether to build from the weather station cache instead of the
+            weather data files
+    """
+    weather = data.load_weather(use_weather_station_cache)
+    source_hash = _get_source_hash(weather)
+    manifest = _read_manifest(store_dir)
+    if manifest is not None and manifest["source_hash"] == source_hash:
+        logger.info("Feature store in %s is up to date", store_dir)
+        return
+
+    os.makedirs(store_dir, exist_ok=True)
+    feature_sets = {}
+    arrays = []
+
+    def add_feature_set(name: str, series: TimeSeries):
+        feature_sets[name] = {
+            "start": sum(
+                len(feature_set["columns"]) for feature_set in feature_sets.values()
+            ),
+            "columns": list(series.columns),
+        }
+        arrays.append(series.values(copy=False).astype(np.float32, copy=False))
+        logger.info("Computed feature set %s with %s columns", name, series.width)
+
+    add_feature_set(WEATHER_FEATURE_SET, weather)
+    covariates_time = get_covariates_time(weather)
+    add_feature_set(TIME_FEATURE_SET, covariates_time)
+
+    covariates = weather.stack(covariates_time)
+    for name, window in zip(ROLLING_FEATURE_SETS, ROLLING_WINDOWS):
+        n_columns = covariates.width
+        covariates = feature_engineering.add_rolling_means(covariates, [window])
+        add_feature_set(name, covariates[list(covariates.columns[n_columns:])])
+
+    n_columns = covariates.width
+    covariates = feature_engineering.add_kinetic_wind_energy_simplified(covariates)
+    add_feature_set(
+        KINETIC_WIND_ENERGY_FEATURE_SET,
+        covariates[list(covariates.columns[n_columns:])],
+    )
+
+    # Remove the manifest first and write the manifest last, so that a partially built store is
+    # never used. The features are written to a temporary file that replaces the old one, so that
+    # a process that still maps the old file keeps reading it.
+    manifest_path = os.path.join(store_dir, MANIFEST_FILE_NAME)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+    features_path = os.path.join(store_dir, FEATURES_FILE_NAME)
+    temporary_path = f"{features_path}.{os.getpid()}.tmp"
+    # Every feature set is written into its columns directly instead of concatenating them
+    features = np.lib.format.open_memmap(
+        temporary_path,
+        mode="w+",
+        dtype=np.float32,
+        shape=(len(weather), sum(array.shape[1] for array in arrays)),
+        fortran_order=True,
+    )
+    for feature_set, array in zip(feature_sets.values(), arrays):
+        start = feature_set["start"]
+        features[:, start : start + array.shape[1]] = array
+    features.flush()
+    del features
+    os.replace(temporary_path, features_path)
+
+    manifest = {
+        "version": FEATURE_STORE_VERSION,
+        "source_hash": source_hash,
+        "use_weather_station_cache": use_weather_station_cache,
+        "start": weather.start_time().isoformat(),
+        "length": len(weather),
+        "freq": weather.freq_str,
+        "feature_sets": feature_sets,
+    }
+    temporary_path = f"{manifest_path}.{os.getpid()}.tmp"
+    with open(temporary_path, "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=4)
+    os.replace(temporary_path, manifest_path)
+
+
+def load(
+    feature_sets: list[str],
+    weather: TimeSeries,
+    store_dir: str = config.FEATURE_STORE_PATH,
+) -> TimeSeries:
+    """
+    Load feature sets from the feature store as one covariate series.
+
+    The array is memory-mapped and feature sets that are adjacent in the store, like all
+    combinations of `get_feature_sets`, are returned as a view of it. So only the requested
+    feature sets are read from disk and nothing is copied into memory.
+
+    Args:
+        feature_sets: The names of the feature sets to load, in the order they are stacked
+        weather: The weather data of the training, which the store must have been built from
+        store_dir: The directory of the feature store
+
+    Returns:
+        A TimeSeries with the columns of all requested feature sets.
+    """
+    manifest = _read_manifest(store_dir)
+    if manifest is None:
+        raise FileNotFoundError(
+            f"No feature store found in {store_dir}, build it with "
+            "`python -m model.scripts.build_feature_store` first."
+        )
+    if manifest["source_hash"] != _get_source_hash(weather):
+        raise ValueError(
+            f"Feature store in {store_dir} was built from other weather data, rebuild it with "
+            "`python -m model.scripts.build_feature_store` and the same weather source "
+            "(--use_weather_station_cache) as the training."
+        )
+
+    unknown_feature_sets = set(feature_sets) - set(manifest["feature_sets"])
+    if unknown_feature_sets:
+        raise KeyError(f"Unknown feature sets: {sorted(unknown_feature_sets)}")
+
+    times = pd.date_range(
+        start=manifest["start"], periods=manifest["length"], freq=manifest["freq"]
+    )
+    values = np.load(os.path.join(store_dir, FEATURES_FILE_NAME), mmap_mode="r")
+    column_indexes = [
+        manifest["feature_sets"][name]["start"] + i
+        for name in feature_sets
+        for i in range(len(manifest["feature_sets"][name]["columns"]))
+    ]
+    if column_indexes == list(
+        range(column_indexes[0], column_indexes[0] + len(column_indexes))
+    ):
+        values = values[:, column_indexes[0] : column_indexes[-1] + 1]
+    else:
+        # Feature sets that are not adjacent in the store can only be loaded as a copy
+        values = values[:, column_indexes]
+
+    # Build the series from the array directly, as `from_times_and_values` copies it
+    xa = xr.DataArray(
+        values[:, :, np.newaxis],
+        dims=DIMS,
+        coords={
+            DIMS[0]: times,
+            DIMS[1]: [
+                column
+                for name in feature_sets
+                for column in manifest["feature_sets"][name]["columns"]
+            ],
+        },
+        attrs={STATIC_COV_TAG: None, HIERARCHY_TAG: None},
+    )
+    return TimeSeries(xa, copy=False)
+
+
+def _get_source_hash(weather: TimeSeries) -> str:
+    digest = hashlib.sha256(f"v{FEATURE_STORE_VERSION}".encode())
+    digest.update(weather.time_index.asi8.tobytes())
+    digest.update(",".join(weather.columns).encode())
+    digest.update(np.ascontiguousarray(weather.values(copy=False)).tobytes())
+
+    return digest.hexdigest()
+
+
+def _read_manifest(store_dir: str) -> dict | None:
+    manifest_path = os.path.join(store_dir, MANIFEST_FILE_NAME)
+    if not os.path.exists(manifest_path):
+        return None
+
+    with open(manifest_path, encoding="utf-8") as file:
+        manifest = json.load(file)
+
+    if manifest.get("version") != FEATURE_STORE_VERSION:
+        return None
+
+    return manifest
@@ -0,0 +1,10 @@
+from dataclasses import dataclass
+
+
+@dataclass
+class DataRequirementInfo:
+    smard_data_lookback: int
+    weather_data_lookback: int
+    weather_data_lookahead: int
+    smard_data_columns: list[str]
+    weather_data_columns: list[str]
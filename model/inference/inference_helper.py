@@ -1,41 +1,39 @@
-from dataclasses import dataclass
 import os
 
 import joblib
-from darts import TimeSeries
+from darts import TimeSeries, models
 from darts.dataprocessing.transformers import Scaler
-from darts.models import RNNModel
+from darts.models.forecasting.torch_forecasting_model import TorchForecastingModel
 
 from model.feature_engineering import get_covariates_time
-from model.util import get_covariate_args_for_model
-
-
-@dataclass
-class DataRequirementInfo:
-    smard_data_lookback: int
-    weather_data_lookback: int
-    weather_data_lookahead: int
-    smard_data_columns: list[str]
-    weather_data_columns: list[str]
+from model.inference.data_requirements import (  # pylint: disable=W0611
+    DataRequirementInfo,
+)
+from model.util import get_covariate_args_for_model, load_model_manifest
 
 
 class InferenceHelper:
     def __init__(self, model_dir: str):
         self.model_dir = model_dir
 
-        # Load model from file
-        self.model = RNNModel(
-            model="LSTM",
-            hidden_dim=64,
-            n_rnn_layers=3,
-            dropout=0.028777667213468805,
-            training_length=424,
-            input_chunk_length=212,
-            n_epochs=5,
-        )
+        # Create the model from the hyperparameters in its manifest
+        self.manifest = load_model_manifest(self.model_dir)
+        model_class = getattr(models, self.manifest["model_class"])
+        self.model = model_class(**self.manifest["model_params"])
 
-        self.model = self.model.load(os.path.join(self.model_dir, "model"))
-        # self.model.load_from_checkpoint(self.model_dir) + "/model.ckpt"
+        # Load the trained weights. The full darts model file is optional for torch models,
+        # without it the manifest is trusted and the sanity checks are skipped
+        model_path = os.path.join(self.model_dir, "model")
+        if isinstance(self.model, TorchForecastingModel):
+            has_model_file = os.path.exists(model_path)
+            self.model.load_weights(
+                model_path,
+                load_encoders=has_model_file,
+                skip_checks=not has_model_file,
+                map_location="cpu",
+            )
+        else:
+            self.model = model_class.load(model_path)
 
         self.scaler = Scaler()
         self.scaler = joblib.load(self.model_dir + "/scaler_smard")
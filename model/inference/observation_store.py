@@ -0,0 +1,197 @@
+import logging
+import os
+import time
+
+import pandas as pd
+from filelock import FileLock
+
+from model import config
+
+logger = logging.getLogger(__name__)
+
+SMARD_SERIES = "smard"
+WEATHER_SERIES = "weather"
+
+# Columns the store adds to every observation
+IS_FINAL_COLUMN = "is_final"
+FETCHED_AT_COLUMN = "fetched_at"
+
+# Recently published SMARD hours are still corrected, so they are fetched again until they are
+# older than this relative to the latest published hour
+SMARD_PROVISIONAL_HOURS = 24
+# Meteostat replaces model data with station observations for a few days
+WEATHER_PROVISIONAL_HOURS = 72
+
+# Observations older than this are dropped when the store is compacted
+RETENTION_HOURS = 30 * 24
+# Number of appended files after which a series is compacted into a single file
+MAX_PARTS = 24
+
+# Appends and compactions of a series must not interleave, also across processes sharing the store
+LOCK_FILE_NAME = ".lock"
+
+
+class ObservationStore:
+    """
+    Append-only store of live observations on local disk, so that a forecast refresh only needs to
+    fetch the hours that are new or still provisional.
+
+    Every series (e.g. "smard") is a directory of parquet files. Every append writes a new file with
+    the fetched hours, each marked as final or provisional. When an hour was fetched more than
+    once, the latest observation is used.
+    """
+
+    def __init__(self, store_dir: str = config.OBSERVATION_STORE_PATH):
+        self.store_dir = store_dir
+
+    def append(
+        self,
+        series: str,
+        data: pd.DataFrame,
+        final_until: pd.Timestamp | None,
+    ):
+        """
+        Record fetched observations.
+
+        Args:
+            series: The name of the series, e.g. "smard"
+            data: The observations with a "timestamp" column
+            final_until: The last hour whose observations will not change anymore, or None if all
+                of them are provisional. Hours with missing values are always provisional.
+        """
+        fetched_at = pd.Timestamp.now("UTC").tz_localize(None)
+        data = data[
+            data["timestamp"] >= fetched_at - pd.Timedelta(hours=RETENTION_HOURS)
+        ]
+        if data.empty:
+            return
+
+        is_final = data.notna().all(axis=1)
+        if final_until is None:
+            is_final &= False
+        else:
+            is_final &= data["timestamp"] <= final_until
+        data = data.assign(**{IS_FINAL_COLUMN: is_final, FETCHED_AT_COLUMN: fetched_at})
+
+        series_dir = os.path.join(self.store_dir, series)
+        os.makedirs(series_dir, exist_ok=True)
+        with FileLock(os.path.join(series_dir, LOCK_FILE_NAME)):
+            self._write_part(series_dir, data)
+
+            if len(self._get_part_paths(series)) > MAX_PARTS:
+                self._compact(series)
+
+    def read(
+        self, series: str, start: pd.Timestamp, end: pd.Timestamp | None = None
+    ) -> pd.DataFrame:
+        """
+        Read the latest observation of every stored hour between `start` and `end` (inclusive).
+
+        Args:
+            series: The name of the series, e.g. "smard"
+            start: The first hour to read
+            end: The last hour to read, or None to read until the latest stored hour
+
+        Returns:
+            A DataFrame with a "timestamp" column and the observed values, sorted by time.
+        """
+        data = self._read_observations(series)
+        in_range = data["timestamp"] >= start
+        if end is not None:
+            in_range &= data["timestamp"] <= end
+
+        return (
+            data[in_range]
+            .drop(columns=[IS_FINAL_COLUMN, FETCHED_AT_COLUMN])
+            .reset_index(drop=True)
+        )
+
+    def get_first_missing_hour(
+        self, series: str, start: pd.Timestamp, end: pd.Timestamp
+    ) -> pd.Timestamp | None:
+        """
+        Get the first hour between `start` and `end` (inclusive) that has no final observation.
+
+        Returns:
+            The first hour that needs to be fetched, or None if all hours are final.
+        """
+        data = self._read_observations(series)
+        final_hours = pd.DatetimeIndex(data.loc[data[IS_FINAL_COLUMN], "timestamp"])
+        hours = pd.date_range(start, end, freq="h")
+        missing_hours = hours[~hours.isin(final_hours)]
+
+        return missing_hours[0] if len(missing_hours) else None
+
+    def _get_part_paths(self, series: str) -> list[str]:
+        series_dir = os.path.join(self.store_dir, series)
+        if not os.path.isdir(series_dir):
+            return []
+
+        return sorted(
+            os.path.join(series_dir, name)
+            for name in os.listdir(series_dir)
+            if name.endswith(".parquet")
+        )
+
+    def _read_parts(self, series: str) -> list[pd.DataFrame]:
+        # Reads do not take the lock, so a compaction may delete parts after they were listed. The
+        # merged part is written before, so it is part of the next listing.
+        while True:
+            parts = []
+            for path in self._get_part_paths(series):
+                try:
+                    parts.append(pd.read_parquet(path))
+                except FileNotFoundError:
+                    break
+            else:
+                return parts
+
+    def _read_observations(self, series: str) -> pd.DataFrame:
+        parts = self._read_parts(series)
+        if not parts:
+            return pd.DataFrame(
+                {
+                    "timestamp": pd.Series(dtype="datetime64[ns]"),
+                    IS_FINAL_COLUMN: pd.Series(dtype=bool),
+                    FETCHED_AT_COLUMN: pd.Series(dtype="datetime64[ns]"),
+                }
+            )
+
+        # Keep the latest observation of every hour
+        return (
+            pd.concat(parts, ignore_index=True)
+            .sort_values([FETCHED_AT_COLUMN, "timestamp"], kind="stable")
+            .drop_duplicates("timestamp", keep="last")
+            .sort_values("timestamp")
+            .reset_index(drop=True)
+        )
+
+    def _compact(self, series: str):
+        """
+        Merge all files of a series into one, dropping outdated observations. Must be called while
+        holding the lock of the series.
+        """
+        part_paths = self._get_part_paths(series)
+        data = self._read_observations(series)
+        retention_start = pd.Timestamp.now("UTC").tz_localize(None) - pd.Timedelta(
+            hours=RETENTION_HOURS
+        )
+        data = data[data["timestamp"] >= retention_start]
+
+        # Write the merged file before deleting the old ones, duplicates are harmless
+        self._write_part(os.path.join(self.store_dir, series), data)
+        for path in part_paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # Already removed by a process that does not use the lock
+                pass
+        logger.info("Compacted %s files of %s", len(part_paths), series)
+
+    @staticmethod
+    def _write_part(series_dir: str, data: pd.DataFrame):
+        # Write to a temporary file first so that an interrupted write leaves no broken file behind
+        path = os.path.join(series_dir, f"part-{time.time_ns()}.parquet")
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        data.to_parquet(temporary_path, index=False)
+        os.replace(temporary_path, path)
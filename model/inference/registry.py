@@ -0,0 +1,59 @@
+import logging
+import os
+from typing import TYPE_CHECKING
+
+# The model classes are only imported when models are loaded, so that the TorchScript runtime
+# works without darts
+if TYPE_CHECKING:
+    from model.inference.inference_helper import InferenceHelper
+    from model.inference.runtime import RuntimeModel
+
+logger = logging.getLogger(__name__)
+
+RUNTIMES = ["darts", "torchscript"]
+
+
+class ModelRegistry:
+    """Keeps trained models loaded in memory, so that they can be used without any disk I/O."""
+
+    def __init__(self):
+        self._models: dict[str, "InferenceHelper | RuntimeModel"] = {}
+
+    def load(self, model_results_dir: str, names: list[str], runtime: str = "darts"):
+        """
+        Load models from their directories in `model_results_dir`.
+
+        Parameters
+        ----------
+        model_results_dir
+            The directory containing one directory per trained model, e.g. `model_results`.
+        names
+            The names of the model directories to load, e.g. `["lstm"]`.
+        runtime
+            "darts" to load the trained darts models, or "torchscript" to load the models exported
+            with `model.scripts.export_model`.
+        """
+        # pylint: disable=C0415
+        if runtime == "darts":
+            from model.inference.inference_helper import InferenceHelper as model_class
+        elif runtime == "torchscript":
+            from model.inference.runtime import RuntimeModel as model_class
+        else:
+            raise ValueError(f"Unknown runtime {runtime}, expected one of {RUNTIMES}")
+
+        for name in names:
+            self._models[name] = model_class(os.path.join(model_results_dir, name))
+            logger.info("Loaded model %s with the %s runtime", name, runtime)
+
+    def get(self, name: str) -> "InferenceHelper | RuntimeModel":
+        """Get a loaded model by the name of its directory."""
+        if name not in self._models:
+            raise KeyError(
+                f"Model {name} is not loaded. Loaded models: {list(self._models)}"
+            )
+
+        return self._models[name]
+
+    @property
+    def names(self) -> list[str]:
+        return list(self._models)
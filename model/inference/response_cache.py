@@ -0,0 +1,139 @@
+import json
+import logging
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+
+from model import config
+
+logger = logging.getLogger(__name__)
+
+# Responses that can still change are revalidated after this many seconds
+DEFAULT_TTL_SECONDS = 60
+
+
+class ResponseCache:
+    """
+    Disk cache of JSON responses, e.g. the weekly SMARD chart data.
+
+    Immutable responses are served from disk forever. Other responses are served from disk for
+    `ttl_seconds` and then revalidated with a conditional request, which the server answers with
+    304 Not Modified if the response did not change.
+
+    In replay-only mode the network is never used, so that tests and benchmarks can run against
+    responses recorded earlier in the same directory.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = config.SMARD_RESPONSE_CACHE_PATH,
+        ttl_seconds: float = DEFAULT_TTL_SECONDS,
+        replay_only: bool = False,
+    ):
+        self.cache_dir = cache_dir
+        self.ttl_seconds = ttl_seconds
+        self.replay_only = replay_only
+
+        self.hits = 0
+        self.revalidations = 0
+        self.downloads = 0
+        self._stats_lock = threading.Lock()
+
+    def get(
+        self, session: requests.Session, url: str, immutable: bool = False
+    ) -> tuple[int, dict | None]:
+        """
+        Get the JSON body of a URL, from disk if possible.
+
+        Args:
+            session: The session used for requests
+            url: The URL to get
+            immutable: Whether the response will never change, e.g. because it covers a week that
+                is over, so that it never has to be revalidated
+
+        Returns:
+            A tuple (status_code, data) with the HTTP status code and the parsed JSON body, which is
+            None unless the status code is 200.
+        """
+        path = self._get_path(url)
+        entry = self._read_entry(path)
+
+        if entry is not None and (
+            self.replay_only
+            or entry["immutable"]
+            or time.time() - entry["fetched_at"] < self.ttl_seconds
+        ):
+            self._count("hits")
+            return 200, entry["data"]
+
+        if self.replay_only:
+            raise FileNotFoundError(f"No recorded response for {url} in {path}")
+
+        # Revalidate the cached response, or download it if there is none
+        headers = {}
+        if entry is not None and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry is not None and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        response = session.get(url, headers=headers)
+
+        if response.status_code == 304 and entry is not None:
+            self._count("revalidations")
+            entry.update(fetched_at=time.time(), immutable=immutable)
+            self._write_entry(path, entry)
+            return 200, entry["data"]
+
+        if response.status_code != 200:
+            return response.status_code, None
+
+        self._count("downloads")
+        entry = {
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "fetched_at": time.time(),
+            "immutable": immutable,
+            "data": response.json(),
+        }
+        self._write_entry(path, entry)
+        return 200, entry["data"]
+
+    def get_stats(self) -> dict[str, int]:
+        """Get the number of responses served from disk, revalidated and downloaded."""
+        return {
+            "hits": self.hits,
+            "revalidations": self.revalidations,
+            "downloads": self.downloads,
+        }
+
+    def _count(self, counter: str):
+        with self._stats_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _get_path(self, url: str) -> str:
+        # The file name of a SMARD chunk already identifies the energy type, region and week
+        name = urlparse(url).path.strip("/").replace("/", "_")
+        return os.path.join(self.cache_dir, name)
+
+    @staticmethod
+    def _read_entry(path: str) -> dict | None:
+        try:
+            with open(path, encoding="utf-8") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+        except json.JSONDecodeError:
+            logger.warning("Ignoring corrupt cached response %s", path)
+            return None
+
+    @staticmethod
+    def _write_entry(path: str, entry: dict):
+        # Write to a temporary file first so that an interrupted write leaves no broken file behind
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as file:
+            json.dump(entry, file)
+        os.replace(temporary_path, path)
@@ -0,0 +1,173 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import torch
+from torch import nn
+
+from model.inference.data_requirements import DataRequirementInfo
+from model.time_covariates import get_time_covariate_values
+
+RUNTIME_MODEL_FILE_NAME = "model.ts"
+RUNTIME_MANIFEST_FILE_NAME = "runtime_manifest.json"
+RUNTIME_FORMAT_VERSION = 1
+
+
+class LSTMForecaster(nn.Module):
+    """
+    The LSTM of a darts RNNModel as a standalone module that can be compiled with TorchScript.
+
+    It runs the same autoregressive loop as darts: the input at every step is the target at that
+    step together with the covariates of the next step. The inverse transform of the target
+    scaler is folded into the output.
+    """
+
+    def __init__(
+        self,
+        rnn: nn.LSTM,
+        output_layer: nn.Linear,
+        target_min: np.ndarray,
+        target_scale: np.ndarray,
+    ):
+        super().__init__()
+        self.rnn = rnn
+        self.output_layer = output_layer
+        self.register_buffer(
+            "target_min", torch.tensor(target_min, dtype=torch.float32)
+        )
+        self.register_buffer(
+            "target_scale", torch.tensor(target_scale, dtype=torch.float32)
+        )
+
+    def forward(self, past_target: torch.Tensor, covariates: torch.Tensor):
+        """
+        Args:
+            past_target: The target of shape (batch, input_chunk_length, targets)
+            covariates: The covariates of shape (batch, input_chunk_length + n, covariates),
+                covering the steps of `past_target` and the `n` steps to predict
+
+        Returns:
+            The rescaled prediction of shape (batch, n, targets).
+        """
+        n_past = past_target.shape[1]
+        n_steps = covariates.shape[1] - n_past
+
+        # Pair the target at every step with the covariates of the next step
+        next_covariates = covariates[:, 1:, :]
+        out, hidden = self.rnn(
+            torch.cat([past_target, next_covariates[:, :n_past, :]], dim=2)
+        )
+        step_prediction = self.output_layer(out[:, -1:, :])
+        predictions = [step_prediction]
+
+        for step in range(1, n_steps):
+            out, hidden = self.rnn(
+                torch.cat(
+                    [
+                        step_prediction,
+                        next_covariates[:, n_past + step - 1 : n_past + step, :],
+                    ],
+                    dim=2,
+                ),
+                hidden,
+            )
+            step_prediction = self.output_layer(out)
+            predictions.append(step_prediction)
+
+        prediction = torch.cat(predictions, dim=1)
+        return (prediction - self.target_min) / self.target_scale
+
+
+def to_hourly(data: pd.DataFrame) -> pd.DataFrame:
+    """Index a frame by its "timestamp" column and fill missing hours with 0, like darts."""
+    data = data.set_index("timestamp")
+    hours = pd.date_range(data.index.min(), data.index.max(), freq="h")
+    return data.reindex(hours, fill_value=0)
+
+
+class RuntimeModel:
+    """
+    A model exported with `model.scripts.export_model`, run with TorchScript on the CPU.
+
+    It takes the same data as `InferenceHelper`, but as pandas DataFrames with a "timestamp"
+    column, and does not import darts.
+    """
+
+    def __init__(self, model_dir: str):
+        self.model_dir = model_dir
+
+        with open(
+            os.path.join(model_dir, RUNTIME_MANIFEST_FILE_NAME), encoding="utf-8"
+        ) as file:
+            self.manifest = json.load(file)
+        if self.manifest["format_version"] != RUNTIME_FORMAT_VERSION:
+            raise ValueError(
+                f"The exported model in {model_dir} has format version "
+                f"{self.manifest['format_version']}, export it again."
+            )
+
+        self.module = torch.jit.load(
+            os.path.join(model_dir, RUNTIME_MODEL_FILE_NAME), map_location="cpu"
+        )
+        self.module.eval()
+        self.input_chunk_length = self.manifest["input_chunk_length"]
+
+    def get_data_request_info(self, n_steps_ahead: int) -> DataRequirementInfo:
+        return DataRequirementInfo(
+            smard_data_lookback=self.input_chunk_length,
+            weather_data_lookback=self.input_chunk_length,
+            weather_data_lookahead=n_steps_ahead,
+            smard_data_columns=self.manifest["target_columns"],
+            weather_data_columns=self.manifest["weather_columns"],
+        )
+
+    def predict(
+        self, smard_data: pd.DataFrame, weather_data: pd.DataFrame, n_steps_ahead: int
+    ) -> pd.DataFrame:
+        """
+        Predict the energy mix after the SMARD data.
+
+        Args:
+            smard_data: The SMARD data with a "timestamp" column
+            weather_data: The weather data with a "timestamp" column, covering the last
+                `input_chunk_length` hours of the SMARD data and the hours to predict
+            n_steps_ahead: The number of hours to predict
+
+        Returns:
+            A DataFrame with a "timestamp" column and the predicted energy mix of every hour.
+        """
+        smard_data = to_hourly(smard_data)
+        weather_data = to_hourly(weather_data)
+
+        # The covariates are stacked in the same order as in `InferenceHelper.predict`
+        past_target = smard_data.iloc[-self.input_chunk_length :]
+        covariates = np.concatenate(
+            [
+                weather_data.to_numpy(dtype=np.float32),
+                get_time_covariate_values(weather_data.index),
+            ],
+            axis=1,
+        )
+        times = pd.date_range(
+            past_target.index[0],
+            periods=self.input_chunk_length + n_steps_ahead,
+            freq="h",
+        )
+        positions = weather_data.index.get_indexer(times)
+        if (positions < 0).any():
+            raise ValueError(
+                f"The weather data must cover {times[0]} to {times[-1]}, but covers "
+                f"{weather_data.index[0]} to {weather_data.index[-1]}."
+            )
+
+        with torch.inference_mode():
+            prediction = self.module(
+                torch.from_numpy(past_target.to_numpy(dtype=np.float32)[None]),
+                torch.from_numpy(covariates[positions][None]),
+            )[0].numpy()
+
+        energy_mix = pd.DataFrame(prediction, columns=list(smard_data.columns))
+        energy_mix.insert(0, "timestamp", times[self.input_chunk_length :])
+
+        return energy_mix
@@ -1,20 +1,43 @@
 import requests
 import logging
 import pytz
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
 import pandas as pd
-from darts import TimeSeries
 
+from model import config
+from model.inference.response_cache import ResponseCache
 from model.util import fix_float64
 
 logger = logging.getLogger(__name__)
 
+ENERGY_TYPE_TO_CODE_MAPPING = {
+    "biomass_mwh": 4066,
+    "hydropower_mwh": 1226,
+    "wind_offshore_mwh": 1225,
+    "wind_onshore_mwh": 4067,
+    "photovoltaic_mwh": 4068,
+    "other_renewables_mwh": 1228,
+    "nuclear_mwh": 1224,
+    "brown_coal_mwh": 1223,
+    "hard_coal_mwh": 4069,
+    "natural_gas_mwh": 4071,
+    "pumped_storage_mwh": 4070,
+    "other_conventional_mwh": 1227,
+}
 
-def get_week_start_dates_until_cutoff(n_lookback):
+# The chunk of a week does not change anymore once the week is over and its last hours have been
+# published, so it is cached forever
+CLOSED_WEEK_DELAY = timedelta(days=1)
+
+DEFAULT_RESPONSE_CACHE = ResponseCache()
+
+
+def get_week_start_dates_until_cutoff(n_lookback, now=None):
     """Returns a list of the start dates of weeks from now until the given cutoff date at 00:00:00"""
     timezone = pytz.timezone("Europe/Berlin")  # hard coded to Germany (for now)
-    current_date = datetime.now(timezone)
+    current_date = now or datetime.now(timezone)
     current_date = current_date.replace(
         hour=0, minute=0, second=0, microsecond=0
     )  # Start from beginning of today
@@ -36,21 +59,39 @@ def get_week_start_dates_until_cutoff(n_lookback):
     return week_starts
 
 
-def fetch_energy_data(session, url, energy_type):
+def get_smard_url(code, week_start_timestamp):
+    """Returns the URL of the hourly SMARD data of an energy type for the week starting at the given timestamp (in ms)"""
+    return f"https://smard.api.proxy.bund.dev/app/chart_data/{code}/DE/{code}_DE_hour_{week_start_timestamp}.json"
+
+
+def is_week_closed(week_start_date, now=None):
+    """Returns whether the SMARD chunk of the week starting at the given date will not change anymore"""
+    now = now or datetime.now(week_start_date.tzinfo)
+    return week_start_date + timedelta(days=7) + CLOSED_WEEK_DELAY <= now
+
+
+def fetch_energy_data(session, url, energy_type, cache=None, immutable=False):
     """
     Fetches energy data for a given energy type and URL.
     Args:
         session (requests.Session): The session object for making requests.
         url (str): The URL for the API request.
         energy_type (str): The type of energy for which data is being fetched.
+        cache (ResponseCache): The cache the response is served from, if any.
+        immutable (bool): Whether the response will never change and can be cached forever.
 
     Returns:
         dict: A dictionary with timestamps and energy data if successful, None otherwise.
     """
     try:
-        response = session.get(url)
-        if response.status_code == 200:
-            response_data = response.json()
+        if cache is not None:
+            status_code, response_data = cache.get(session, url, immutable=immutable)
+        else:
+            response = session.get(url)
+            status_code = response.status_code
+            response_data = response.json() if status_code == 200 else None
+
+        if status_code == 200:
             series = response_data["series"]
             return {
                 "timestamp": [x[0] for x in series],
@@ -58,7 +99,7 @@ def fetch_energy_data(session, url, energy_type):
             }
         else:
             logger.error(
-                f"Error fetching data for {energy_type}: Status code {response.status_code}"
+                f"Error fetching data for {energy_type}: Status code {status_code}"
             )
             return {
                 "timestamp": [0.0 for x in range(0, 168)],
@@ -70,53 +111,69 @@ def fetch_energy_data(session, url, energy_type):
         return None
 
 
-def fetch_smard_data(n_lookback):
+def fetch_smard_data(
+    n_lookback,
+    max_concurrent_requests=config.SMARD_MAX_CONCURRENT_REQUESTS,
+    on_last_timestamp=None,
+    cache=DEFAULT_RESPONSE_CACHE,
+    now=None,
+):
     """
     Fetches energy data from the SMARD API for various energy types.
     Data is fetched for each week starting from the current date back to the week of the cutoff date.
     Each API call fetches data for a specific energy type for the entire week.
-    The data from all calls are combined into a single TimeSeries object.
+    All API calls are issued concurrently and their data are combined into a single DataFrame.
     Args:
-        cutoff_date (datetime): The date until which the energy data is fetched.
-                                Data is fetched in weekly intervals up to this date.
+        n_lookback (int): The number of hours of data to fetch, ending at the latest available hour.
+        max_concurrent_requests (int): The maximum number of API calls that run at the same time.
+        on_last_timestamp (Callable[[pd.Timestamp], None]): Called with the timestamp of the latest
+                                available hour as soon as it is known, while older weeks may still
+                                be downloading.
+        cache (ResponseCache): The cache the weekly chunks are served from, or None to always
+                               download them.
+        now (datetime): The current time in Europe/Berlin, e.g. to replay recorded responses.
 
     Returns:
-        TimeSeries: A Darts TimeSeries object containing the energy data for each type.
+        pd.DataFrame: A DataFrame with a timestamp column and the energy data for each type.
 
     Example:
-        >>> cutoff_date = datetime(2024, 1, 1)
-        >>> energy_data_timeseries = fetch_smard_data(cutoff_date)
-        # Returns a TimeSeries object with energy data up to the specified cutoff date
+        >>> energy_data = fetch_smard_data(212)
+        # Returns a DataFrame with the latest 212 hours of energy data
     """
 
-    energy_type_to_code_mapping = {
-        "biomass_mwh": 4066,
-        "hydropower_mwh": 1226,
-        "wind_offshore_mwh": 1225,
-        "wind_onshore_mwh": 4067,
-        "photovoltaic_mwh": 4068,
-        "other_renewables_mwh": 1228,
-        "nuclear_mwh": 1224,
-        "brown_coal_mwh": 1223,
-        "hard_coal_mwh": 4069,
-        "natural_gas_mwh": 4071,
-        "pumped_storage_mwh": 4070,
-        "other_conventional_mwh": 1227,
-    }
-
-    week_start_dates = get_week_start_dates_until_cutoff(n_lookback=n_lookback)
+    week_start_dates = get_week_start_dates_until_cutoff(n_lookback=n_lookback, now=now)
     all_data_frames = []
 
-    with requests.Session() as session:
+    with requests.Session() as session, ThreadPoolExecutor(
+        max_workers=max_concurrent_requests
+    ) as executor:
+        session.mount(
+            "https://",
+            requests.adapters.HTTPAdapter(pool_maxsize=max_concurrent_requests),
+        )
+
+        futures = {
+            (week_start_date, energy_type): executor.submit(
+                fetch_energy_data,
+                session,
+                get_smard_url(
+                    code, int(week_start_date.timestamp() * 1000)
+                ),  # Convert to milliseconds
+                energy_type,
+                cache,
+                is_week_closed(week_start_date, now),
+            )
+            for week_start_date in week_start_dates
+            for energy_type, code in ENERGY_TYPE_TO_CODE_MAPPING.items()
+        }
+
+        # Weeks are assembled from the newest to the oldest, so the latest available hour is
+        # known as soon as the newest week with complete data has arrived
         for week_start_date in week_start_dates:
-            week_start_timestamp = int(
-                week_start_date.timestamp() * 1000
-            )  # Convert to milliseconds
             weekly_data = {}
 
-            for energy_type, code in energy_type_to_code_mapping.items():
-                url = f"https://smard.api.proxy.bund.dev/app/chart_data/{code}/DE/{code}_DE_hour_{week_start_timestamp}.json"
-                energy_data = fetch_energy_data(session, url, energy_type)
+            for energy_type in ENERGY_TYPE_TO_CODE_MAPPING:
+                energy_data = futures[(week_start_date, energy_type)].result()
                 if energy_data:
                     if "timestamp" not in weekly_data:
                         weekly_data["timestamp"] = energy_data["timestamp"]
@@ -129,6 +186,13 @@ def fetch_smard_data(n_lookback):
                 )
                 all_data_frames.append(weekly_df)
 
+                complete_rows = weekly_df.reindex(
+                    columns=["timestamp", *ENERGY_TYPE_TO_CODE_MAPPING]
+                ).dropna(how="any")
+                if on_last_timestamp is not None and not complete_rows.empty:
+                    on_last_timestamp(complete_rows["timestamp"].max())
+                    on_last_timestamp = None
+
     # Concatenate all weekly data frames
     full_df = (
         pd.concat(all_data_frames).sort_values(by="timestamp").reset_index(drop=True)
@@ -148,6 +212,46 @@ def fetch_smard_data(n_lookback):
     return full_df
 
 
+def fetch_latest_smard_timestamp(
+    energy_type="biomass_mwh", cache=DEFAULT_RESPONSE_CACHE, now=None
+):
+    """
+    Fetches the timestamp of the latest hour for which SMARD has published data of an energy type.
+    Only the chunks of the current and the previous week are requested, which makes this a cheap
+    way to find out whether new data has landed.
+    Args:
+        energy_type (str): The type of energy whose latest timestamp is fetched.
+        cache (ResponseCache): The cache the weekly chunks are served from, or None to always
+                               download them.
+        now (datetime): The current time in Europe/Berlin, e.g. to replay recorded responses.
+
+    Returns:
+        pd.Timestamp: The latest published hour, or None if no data was found.
+    """
+    code = ENERGY_TYPE_TO_CODE_MAPPING[energy_type]
+
+    with requests.Session() as session:
+        for week_start_date in get_week_start_dates_until_cutoff(
+            n_lookback=7 * 24, now=now
+        ):
+            week_start_timestamp = int(week_start_date.timestamp() * 1000)
+            url = get_smard_url(code, week_start_timestamp)
+            energy_data = fetch_energy_data(
+                session, url, energy_type, cache, is_week_closed(week_start_date, now)
+            )
+            if not energy_data:
+                continue
+
+            # On an error response, fetch_energy_data returns zeros at timestamp 0 instead of
+            # None, so only the hours of the requested week count as published
+            weekly_df = pd.DataFrame(energy_data).dropna()
+            weekly_df = weekly_df[weekly_df["timestamp"] >= week_start_timestamp]
+            if not weekly_df.empty:
+                return pd.to_datetime(weekly_df["timestamp"].max(), unit="ms")
+
+    return None
+
+
 if __name__ == "__main__":
     cutoff_date = datetime(2024, 1, 23)
     energy_data_timeseries = fetch_smard_data(cutoff_date)
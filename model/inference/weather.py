@@ -1,11 +1,33 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
+import numpy as np
 import pandas as pd
 from meteostat import Hourly
 
 from model import config
+from model.inference.observation_store import WEATHER_PROVISIONAL_HOURS
 from model.util import fix_float64
 
+logger = logging.getLogger(__name__)
+
+STATION_COLUMNS = ["temp", "tsun", "wspd", "pres", "prcp"]
+FETCHED_AT_COLUMN = "fetched_at"
+
+# Meteostat's spatial aggregation first sums precipitation and sunshine duration per station and
+# hour, which turns missing values into 0, and then averages the stations
+ZERO_FILLED_COLUMNS = ["tsun", "prcp"]
+
+# The station groups used for inference and the columns taken from each of them
+SOLAR_INFERENCE_COLUMNS = ["temp", "tsun"]
+WIND_INFERENCE_COLUMNS = ["wspd", "pres", "prcp"]
+
+# Station files are rewritten by one refresh at a time
+_lock = threading.Lock()
+
 
 def fetch_weather_data(last_timestamp, n_lookback, n_lookahead):
     """
@@ -22,25 +44,222 @@ def fetch_weather_data(last_timestamp, n_lookback, n_lookahead):
     start_date = last_timestamp - timedelta(hours=n_lookback)
     end_date = last_timestamp + timedelta(hours=n_lookahead)
 
-    solar_stations_data = Hourly(config.SOLAR_IDS, start_date, end_date)
-    solar_stations_data = solar_stations_data.normalize()
-    solar_stations_data = solar_stations_data.aggregate("1H", spatial=True)
-    solar_stations_data = solar_stations_data.fetch()
-
-    wind_stations_data = Hourly(config.WIND_IDS, start_date, end_date)
-    wind_stations_data = wind_stations_data.normalize()
-    wind_stations_data = wind_stations_data.aggregate("1H", spatial=True)
-    wind_stations_data = wind_stations_data.fetch()
-
-    weather_data = pd.concat(
-        [
-            solar_stations_data[["temp", "tsun"]],
-            wind_stations_data[["wspd", "pres", "prcp"]],
-        ],
-        axis=1,
+    station_data = get_station_data(
+        config.SOLAR_IDS + config.WIND_IDS, start_date, end_date
+    )
+    solar_stations_data = aggregate_stations(
+        station_data, config.SOLAR_IDS, SOLAR_INFERENCE_COLUMNS
     )
+    wind_stations_data = aggregate_stations(
+        station_data, config.WIND_IDS, WIND_INFERENCE_COLUMNS
+    )
+
+    weather_data = pd.concat([solar_stations_data, wind_stations_data], axis=1)
     weather_data = weather_data.reset_index(names=["timestamp"])
 
     weather_data = fix_float64(weather_data)
 
     return weather_data
+
+
+def get_station_data(
+    station_ids: list[int],
+    start: datetime,
+    end: datetime,
+    cache_dir: str = config.WEATHER_STATION_CACHE_PATH,
+) -> dict[int, pd.DataFrame]:
+    """
+    Get the hourly data of weather stations from the station cache, refreshing stale stations.
+
+    Every station is cached in its own parquet file. A station is refreshed from the first hour
+    in the range that is missing or still provisional, i.e. that was fetched less than
+    `WEATHER_PROVISIONAL_HOURS` after it. On a cold cache, the whole range is fetched at once.
+
+    Args:
+        station_ids: The Meteostat IDs of the stations
+        start: The first hour to get
+        end: The last hour to get
+
+    Returns:
+        A DataFrame per station with an hourly index from `start` to `end` and the columns in
+        `STATION_COLUMNS`. Hours without data are NaN.
+    """
+    hours = pd.date_range(start, end, freq="h")
+
+    with _lock:
+        cached_data = {
+            station: _read_station(cache_dir, station) for station in station_ids
+        }
+
+        # Fetch the stale stations together, starting at the first stale hour of any of them
+        first_stale_hours = {
+            station: first_stale_hour
+            for station, data in cached_data.items()
+            if (first_stale_hour := _get_first_stale_hour(data, hours)) is not None
+        }
+        if first_stale_hours:
+            fetch_start = min(first_stale_hours.values())
+            logger.info(
+                "Refreshing %s weather stations from %s",
+                len(first_stale_hours),
+                fetch_start,
+            )
+            fetched_data = fetch_stations(list(first_stale_hours), fetch_start, end)
+
+            for station, data in fetched_data.items():
+                cached_data[station] = _merge_station(cached_data[station], data)
+                _write_station(cache_dir, station, cached_data[station])
+
+    return {
+        station: data[STATION_COLUMNS].reindex(hours)
+        for station, data in cached_data.items()
+    }
+
+
+def fetch_stations(
+    station_ids: list[int], start: datetime, end: datetime
+) -> dict[int, pd.DataFrame]:
+    """
+    Fetch the hourly data of weather stations from Meteostat, with the solar and wind stations
+    fetched concurrently.
+
+    Returns:
+        A DataFrame per station with an hourly index from `start` to `end`, the columns in
+        `STATION_COLUMNS` and the time the data was fetched.
+    """
+    groups = [
+        [station for station in station_ids if station in group_ids]
+        for group_ids in [config.SOLAR_IDS, config.WIND_IDS]
+    ]
+    groups.append(
+        [
+            station
+            for station in station_ids
+            if station not in config.SOLAR_IDS + config.WIND_IDS
+        ]
+    )
+    groups = [group for group in groups if group]
+
+    with ThreadPoolExecutor(max_workers=len(groups)) as executor:
+        results = executor.map(
+            lambda group: _fetch_station_group(group, start, end), groups
+        )
+        return {station: data for result in results for station, data in result.items()}
+
+
+def aggregate_stations(
+    station_data: dict[int, pd.DataFrame], station_ids: list[int], columns: list[str]
+) -> pd.DataFrame:
+    """
+    Average the data of a group of stations at every hour, like meteostat's spatial aggregation.
+
+    Training and inference both aggregate with this function, so that their weather data is
+    identical.
+
+    Args:
+        station_data: The data of every station by its ID, all with the same hourly index
+        station_ids: The IDs of the stations in the group
+        columns: The columns to aggregate
+
+    Returns:
+        A DataFrame with the averaged columns, rounded to one decimal like in meteostat, and the
+        same index as the station data.
+    """
+    # Meteostat groups the stations by their sorted IDs, which sets the order they are summed in
+    station_ids = sorted(station_ids, key=str)
+
+    # Shape (stations, hours, columns)
+    values = np.stack(
+        [
+            station_data[station][columns].to_numpy(dtype=np.float64)
+            for station in station_ids
+        ]
+    )
+    zero_filled = np.isin(columns, ZERO_FILLED_COLUMNS)
+    values[:, :, zero_filled] = np.nan_to_num(values[:, :, zero_filled], nan=0)
+
+    # Sum the stations in order with Kahan summation like pandas, so that the rounded means are
+    # identical to meteostat's
+    sums = np.zeros(values.shape[1:])
+    compensation = np.zeros(values.shape[1:])
+    counts = np.zeros(values.shape[1:], dtype=np.int64)
+    for station_values in values:
+        is_observed = ~np.isnan(station_values)
+        corrected = np.where(is_observed, station_values, 0) - compensation
+        new_sums = sums + corrected
+        compensation = np.where(is_observed, new_sums - sums - corrected, compensation)
+        sums = np.where(is_observed, new_sums, sums)
+        counts += is_observed
+
+    means = np.divide(sums, counts, out=np.full(sums.shape, np.nan), where=counts > 0)
+
+    return pd.DataFrame(
+        means.round(1), index=station_data[station_ids[0]].index, columns=columns
+    )
+
+
+def _fetch_station_group(
+    station_ids: list[int], start: datetime, end: datetime
+) -> dict[int, pd.DataFrame]:
+    fetched_at = pd.Timestamp.now("UTC").tz_localize(None)
+    data = Hourly(station_ids, start, end).fetch()
+    hours = pd.date_range(start, end, freq="h")
+
+    station_data = {}
+    for station in station_ids:
+        if "station" in data.index.names:
+            station_index = data.index.get_level_values("station").astype(str)
+            rows = data[station_index == str(station)].droplevel("station")
+        else:
+            rows = data
+        station_data[station] = (
+            rows.reindex(hours, columns=STATION_COLUMNS)
+            .astype("float64")
+            .assign(**{FETCHED_AT_COLUMN: fetched_at})
+        )
+
+    return station_data
+
+
+def _get_first_stale_hour(
+    data: pd.DataFrame, hours: pd.DatetimeIndex
+) -> pd.Timestamp | None:
+    final_until = data[FETCHED_AT_COLUMN] - pd.Timedelta(
+        hours=WEATHER_PROVISIONAL_HOURS
+    )
+    final_hours = data.index[data.index.to_numpy() <= final_until.to_numpy()]
+    stale_hours = hours[~hours.isin(final_hours)]
+
+    return stale_hours[0] if len(stale_hours) else None
+
+
+def _merge_station(cached: pd.DataFrame, fetched: pd.DataFrame) -> pd.DataFrame:
+    merged = pd.concat([cached[~cached.index.isin(fetched.index)], fetched])
+    return merged.sort_index()
+
+
+def _get_station_path(cache_dir: str, station: int) -> str:
+    return os.path.join(cache_dir, f"{station}.parquet")
+
+
+def _read_station(cache_dir: str, station: int) -> pd.DataFrame:
+    path = _get_station_path(cache_dir, station)
+    if not os.path.exists(path):
+        return pd.DataFrame(
+            {
+                **{column: pd.Series(dtype="float64") for column in STATION_COLUMNS},
+                FETCHED_AT_COLUMN: pd.Series(dtype="datetime64[ns]"),
+            },
+            index=pd.DatetimeIndex([], name="time"),
+        )
+
+    return pd.read_parquet(path)
+
+
+def _write_station(cache_dir: str, station: int, data: pd.DataFrame):
+    # Write to a temporary file first so that an interrupted write leaves no broken file behind
+    os.makedirs(cache_dir, exist_ok=True)
+    path = _get_station_path(cache_dir, station)
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    data.to_parquet(temporary_path)
+    os.replace(temporary_path, path)
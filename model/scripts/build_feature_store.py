@@ -0,0 +1,23 @@
+import argparse
+import logging
+
+from model import config, feature_store
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--store_dir", type=str, default=config.FEATURE_STORE_PATH)
+    parser.add_argument(
+        "--use_weather_station_cache",
+        default=False,
+        action="store_true",
+        help="Build from the weather station cache, for training with the same flag",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    feature_store.build(args.store_dir, args.use_weather_station_cache)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""
+Export a trained LSTM to TorchScript, so that it can be served with `RuntimeModel` without darts.
+
+Run from the project root:
+
+    python -m model.scripts.export_model --model_dir model_results/lstm --check
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import torch
+from darts.models import RNNModel
+
+from model.inference.inference_helper import InferenceHelper
+from model.inference.runtime import (
+    RUNTIME_FORMAT_VERSION,
+    RUNTIME_MANIFEST_FILE_NAME,
+    RUNTIME_MODEL_FILE_NAME,
+    LSTMForecaster,
+    RuntimeModel,
+)
+from model.scripts.fetch_live_data import fetch
+from model.time_covariates import TIME_COVARIATE_COLUMNS
+from model.util import convert_df_to_time_series
+
+N_STEPS_AHEAD = 7 * 24
+N_LATENCY_RUNS = 10
+
+
+def export(model_dir: str):
+    """
+    Export the LSTM in `model_dir` to TorchScript and write it next to the darts model.
+
+    Args:
+        model_dir: The directory of the trained model, e.g. `model_results/lstm`
+    """
+    helper = InferenceHelper(model_dir)
+    darts_model = helper.model
+    if (
+        not isinstance(darts_model, RNNModel)
+        or darts_model.model_params.get("model") != "LSTM"
+    ):
+        raise ValueError("Only LSTM models can be exported.")
+
+    module = darts_model.model
+    if module.likelihood is not None or module.use_reversible_instance_norm:
+        raise ValueError(
+            "Models with a likelihood or reversible instance norm cannot be exported."
+        )
+
+    data_req = helper.get_data_request_info(N_STEPS_AHEAD)
+    n_targets = len(data_req.smard_data_columns)
+    n_covariates = len(data_req.weather_data_columns) + len(TIME_COVARIATE_COLUMNS)
+    if module.rnn.input_size != n_targets + n_covariates:
+        raise ValueError(
+            f"The model expects {module.rnn.input_size} inputs, but the live data has "
+            f"{n_targets} targets and {n_covariates} covariates."
+        )
+
+    # Fold the inverse transform of the target scaler into the model
+    target_scaler = helper.scaler._fitted_params[0]  # pylint: disable=W0212
+    forecaster = LSTMForecaster(
+        module.rnn, module.V, target_scaler.min_, target_scaler.scale_
+    ).eval()
+    torch.jit.script(forecaster).save(os.path.join(model_dir, RUNTIME_MODEL_FILE_NAME))
+
+    manifest = {
+        "format_version": RUNTIME_FORMAT_VERSION,
+        "input_chunk_length": darts_model.input_chunk_length,
+        "target_columns": data_req.smard_data_columns,
+        "weather_columns": data_req.weather_data_columns,
+        "time_covariate_columns": TIME_COVARIATE_COLUMNS,
+    }
+    with open(
+        os.path.join(model_dir, RUNTIME_MANIFEST_FILE_NAME), "w", encoding="utf-8"
+    ) as file:
+        json.dump(manifest, file, indent=4)
+
+
+def get_random_data(
+    helper: InferenceHelper, seed: int
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Generate SMARD and weather data in the range the model was trained on."""
+    rng = np.random.default_rng(seed)
+    data_req = helper.get_data_request_info(N_STEPS_AHEAD)
+    target_scaler = helper.scaler._fitted_params[0]  # pylint: disable=W0212
+
+    end = pd.Timestamp.now().floor("h")
+    smard_data = pd.DataFrame(
+        rng.uniform(
+            target_scaler.data_min_,
+            target_scaler.data_max_,
+            (data_req.smard_data_lookback, len(data_req.smard_data_columns)),
+        ).astype(np.float32),
+        columns=data_req.smard_data_columns,
+    )
+    smard_data.insert(
+        0,
+        "timestamp",
+        pd.date_range(end=end, periods=data_req.smard_data_lookback, freq="h"),
+    )
+
+    n_weather_hours = (
+        data_req.weather_data_lookback + data_req.weather_data_lookahead + 1
+    )
+    weather_data = pd.DataFrame(
+        rng.uniform(0, 1, (n_weather_hours, len(data_req.weather_data_columns))).astype(
+            np.float32
+        ),
+        columns=data_req.weather_data_columns,
+    )
+    weather_data.insert(
+        0,
+        "timestamp",
+        pd.date_range(
+            end - pd.Timedelta(hours=data_req.weather_data_lookback - 1),
+            periods=n_weather_hours,
+            freq="h",
+        ),
+    )
+
+    return smard_data, weather_data
+
+
+def check(model_dir: str, live: bool, seed: int):
+    """
+    Compare the predictions and latency of the exported model with the darts model.
+
+    Args:
+        model_dir: The directory of the trained and exported model
+        live: Whether to use the live data instead of random data
+        seed: The seed of the random data
+    """
+    helper = InferenceHelper(model_dir)
+    runtime_model = RuntimeModel(model_dir)
+
+    if live:
+        smard_data, weather_data = fetch(
+            helper.get_data_request_info(N_STEPS_AHEAD), as_time_series=False
+        )
+    else:
+        smard_data, weather_data = get_random_data(helper, seed)
+
+    def predict_darts() -> pd.DataFrame:
+        prediction = helper.predict(
+            convert_df_to_time_series(smard_data),
+            convert_df_to_time_series(weather_data),
+            N_STEPS_AHEAD,
+        )
+        return prediction.pd_dataframe().reset_index()
+
+    def predict_runtime() -> pd.DataFrame:
+        return runtime_model.predict(smard_data, weather_data, N_STEPS_AHEAD)
+
+    expected, actual = predict_darts(), predict_runtime()
+    if not (
+        pd.DatetimeIndex(expected["timestamp"]) == pd.DatetimeIndex(actual["timestamp"])
+    ).all():
+        raise AssertionError("The predictions have different timestamps.")
+
+    columns = list(runtime_model.manifest["target_columns"])
+    absolute_error = np.abs(
+        expected[columns].to_numpy(dtype=np.float64)
+        - actual[columns].to_numpy(dtype=np.float64)
+    )
+    relative_error = absolute_error / np.maximum(
+        np.abs(expected[columns].to_numpy(dtype=np.float64)), 1
+    )
+    print(f"Max absolute difference: {absolute_error.max():.6f} MWh")
+    print(f"Max relative difference: {relative_error.max():.2e}")
+
+    for name, predict in [("darts", predict_darts), ("torchscript", predict_runtime)]:
+        latencies = []
+        for _ in range(N_LATENCY_RUNS):
+            start = time.perf_counter()
+            predict()
+            latencies.append(time.perf_counter() - start)
+        print(f"Median latency ({name}): {np.median(latencies) * 1000:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_dir", type=str, default="model_results/lstm")
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="Compare the exported model with the darts model after exporting",
+    )
+    parser.add_argument(
+        "--live", action="store_true", help="Check with the live data instead"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    assert not torch.cuda.is_available(), "We want to run this on CPU only."
+
+    export(args.model_dir)
+    print(f"Exported {args.model_dir}")
+
+    if args.check:
+        check(args.model_dir, args.live, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,110 @@
-from datetime import datetime, timedelta
+import contextlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, ContextManager
+
+import pandas as pd
 
 from model.inference.weather import fetch_weather_data
 from model.inference.smard import fetch_smard_data
-from model.inference.inference_helper import DataRequirementInfo
+from model.inference.data_requirements import DataRequirementInfo
+from model.inference.observation_store import (
+    SMARD_PROVISIONAL_HOURS,
+    SMARD_SERIES,
+    WEATHER_PROVISIONAL_HOURS,
+    WEATHER_SERIES,
+    ObservationStore,
+)
 
 from model.util import convert_df_to_time_series
 
 
-def fetch(data_req: DataRequirementInfo):
-    smard_data = fetch_smard_data(n_lookback=data_req.smard_data_lookback)
-    last_timestamp = smard_data["timestamp"].max()
+def fetch(
+    data_req: DataRequirementInfo,
+    timer: Callable[[str], ContextManager] | None = None,
+    as_time_series: bool = True,
+    store: ObservationStore | None = None,
+):
+    # Returns the data as pandas DataFrames with a "timestamp" column if `as_time_series` is
+    # False, e.g. for the exported model runtime that does not use darts
+    # The timer, if given, measures the time spent in each fetch, e.g. for metrics
+    # Only the hours that are not final in the observation store are fetched, the rest of the
+    # data is read from the store. On a cold start the whole lookback is fetched at once.
+    timer = timer or (lambda _stage: contextlib.nullcontext())
+    store = store or ObservationStore()
+    now = pd.Timestamp.now("UTC").tz_localize(None).floor("h")
 
-    weather_data = fetch_weather_data(
-        last_timestamp,
-        n_lookback=data_req.weather_data_lookback,
-        n_lookahead=data_req.weather_data_lookahead,
-    )
+    def fetch_weather_data_timed(last_timestamp):
+        start = last_timestamp - pd.Timedelta(hours=data_req.weather_data_lookback)
+        end = last_timestamp + pd.Timedelta(hours=data_req.weather_data_lookahead)
+        first_missing_hour = store.get_first_missing_hour(WEATHER_SERIES, start, end)
+        if first_missing_hour is None:
+            # Every hour is final, so only the lookahead is fetched
+            first_missing_hour = last_timestamp
+
+        with timer("weather_fetch"):
+            weather_data = fetch_weather_data(
+                last_timestamp,
+                n_lookback=max(
+                    (last_timestamp - first_missing_hour) // pd.Timedelta(hours=1), 0
+                ),
+                n_lookahead=data_req.weather_data_lookahead,
+            )
+
+        store.append(
+            WEATHER_SERIES,
+            weather_data,
+            final_until=now - pd.Timedelta(hours=WEATHER_PROVISIONAL_HOURS),
+        )
+        return store.read(WEATHER_SERIES, start, end)[list(weather_data.columns)]
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        weather_futures: dict[datetime, Future] = {}
+
+        def fetch_weather_data_async(last_timestamp):
+            weather_futures[last_timestamp] = executor.submit(
+                fetch_weather_data_timed, last_timestamp
+            )
+
+        # The latest published hour is not known yet, so look for missing hours in a day more
+        # than the lookback
+        first_missing_hour = store.get_first_missing_hour(
+            SMARD_SERIES,
+            now
+            - pd.Timedelta(
+                hours=data_req.smard_data_lookback + SMARD_PROVISIONAL_HOURS
+            ),
+            now,
+        )
+        if first_missing_hour is None:
+            # Every hour is final, so only the latest hour is fetched to find the last timestamp
+            first_missing_hour = now
+
+        # Start downloading the weather data as soon as the last SMARD hour is known
+        with timer("smard_fetch"):
+            smard_data = fetch_smard_data(
+                n_lookback=(now - first_missing_hour) // pd.Timedelta(hours=1) + 1,
+                on_last_timestamp=fetch_weather_data_async,
+            )
+        last_timestamp = smard_data["timestamp"].max()
+
+        store.append(
+            SMARD_SERIES,
+            smard_data,
+            final_until=last_timestamp - pd.Timedelta(hours=SMARD_PROVISIONAL_HOURS),
+        )
+        smard_data = store.read(
+            SMARD_SERIES,
+            last_timestamp - pd.Timedelta(hours=data_req.smard_data_lookback - 1),
+            last_timestamp,
+        )[list(smard_data.columns)]
+
+        if last_timestamp not in weather_futures:
+            fetch_weather_data_async(last_timestamp)
+        weather_data = weather_futures[last_timestamp].result()
+
+    if not as_time_series:
+        return smard_data, weather_data
 
     smard_data = convert_df_to_time_series(smard_data)
     weather_data = convert_df_to_time_series(weather_data)
@@ -0,0 +1,114 @@
+"""Tests of the cross-validation in `model.evaluation` on a small synthetic energy mix."""
+
+import numpy as np
+import pandas as pd
+import pytest
+from darts import TimeSeries
+from darts.dataprocessing.transformers import Scaler
+from darts.metrics import rmse
+from darts.models import LinearRegressionModel, RandomForest
+from darts.models.forecasting.forecasting_model import ForecastingModel
+
+from model.config import EMISSION_FACTORS
+from model.evaluation import co2_rmse, cross_validation_without_refit
+
+FORECAST_HORIZON = 24
+N_PREFIX_HOURS = 20 * 24
+N_TEST_HOURS = 5 * FORECAST_HORIZON
+LAGS = 24
+
+
+def get_toy_data() -> tuple[TimeSeries, TimeSeries, TimeSeries, Scaler]:
+    """
+    Get a noisy daily pattern of every energy type and a noisy covariate that it depends on.
+
+    Returns:
+        The prefix and test series, the covariates and a scaler fitted on the prefix.
+    """
+    rng = np.random.default_rng(0)
+    times = pd.date_range("2024-01-01", periods=N_PREFIX_HOURS + N_TEST_HOURS, freq="h")
+    # Noise keeps the lagged features linearly independent, unlike a pure sine
+    covariate = np.sin(2 * np.pi * np.arange(len(times)) / 24) + rng.normal(
+        0, 0.1, len(times)
+    )
+    values = (
+        100
+        + 50 * covariate[:, np.newaxis] * rng.uniform(0.5, 1.5, len(EMISSION_FACTORS))
+        + rng.normal(0, 5, (len(times), len(EMISSION_FACTORS)))
+    )
+
+    series = TimeSeries.from_times_and_values(
+        times, values, columns=list(EMISSION_FACTORS)
+    )
+    covariates = TimeSeries.from_times_and_values(
+        times, covariate[:, np.newaxis], columns=["covariate"]
+    )
+    prefix, test = series.split_after(N_PREFIX_HOURS - 1)
+
+    return prefix, test, covariates, Scaler().fit(prefix)
+
+
+def run_cross_validation(
+    model: ForecastingModel, **kwargs
+) -> tuple[dict[str, float], list[dict[str, float]]]:
+    """
+    Run the cross-validation of a model on the toy data.
+
+    Returns:
+        The averaged metrics and the running averages reported after every split.
+    """
+    prefix, test, covariates, scaler = get_toy_data()
+    running_averages = []
+    metrics = cross_validation_without_refit(
+        model=model,
+        prefix_series=prefix,
+        test_series=test,
+        metrics={"rmse": rmse, "co2_rmse": co2_rmse},
+        data_scaler=scaler,
+        covariates=covariates,
+        forecast_horizon=FORECAST_HORIZON,
+        on_split_end=lambda _i, split_metrics: running_averages.append(split_metrics),
+        **kwargs,
+    )
+
+    return metrics, running_averages
+
+
+def test_batched_matches_per_split():
+    prefix, _, covariates, scaler = get_toy_data()
+    model = LinearRegressionModel(
+        lags=LAGS, lags_past_covariates=LAGS, output_chunk_length=FORECAST_HORIZON
+    )
+    model.fit(scaler.transform(prefix), past_covariates=covariates)
+
+    metrics, running_averages = run_cross_validation(model)
+    batched_metrics, batched_running_averages = run_cross_validation(
+        model, batched=True
+    )
+
+    # The running averages after every split only match if every split has the same RMSEs
+    assert len(running_averages) == N_TEST_HOURS // FORECAST_HORIZON
+    assert batched_running_averages == [
+        pytest.approx(split_metrics, rel=1e-9) for split_metrics in running_averages
+    ]
+    assert batched_metrics == pytest.approx(metrics, rel=1e-9)
+
+
+def test_parallel_refit_does_not_depend_on_workers():
+    # The trees of a random forest are random unless every split is seeded
+    model = RandomForest(
+        lags=LAGS,
+        lags_past_covariates=LAGS,
+        output_chunk_length=FORECAST_HORIZON,
+        n_estimators=5,
+    )
+
+    metrics, running_averages = run_cross_validation(
+        model, refit=True, truncate_refit_train_dataset=7 * 24, n_jobs=2
+    )
+    other_metrics, other_running_averages = run_cross_validation(
+        model, refit=True, truncate_refit_train_dataset=7 * 24, n_jobs=3
+    )
+
+    assert other_running_averages == running_averages
+    assert other_metrics == metrics
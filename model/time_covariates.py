@@ -0,0 +1,63 @@
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+TIME_COVARIATE_COLUMNS = ["weekday", "hour", "month"]
+
+# The fixed range of every time covariate, with the month starting at 0 like in darts. Scaling
+# with these ranges gives the same values as fitting a MinMax scaler on any series covering a
+# full year, like the training data, but does not depend on the window that is scaled.
+TIME_COVARIATE_RANGES = {"weekday": (0, 6), "hour": (0, 23), "month": (0, 11)}
+
+# Number of hourly ranges whose covariates are kept in memory
+CACHE_SIZE = 32
+
+
+def get_time_covariate_values(times: pd.DatetimeIndex) -> np.ndarray:
+    """
+    Get the time covariates of a time index, min-max scaled with the fixed ranges in
+    `TIME_COVARIATE_RANGES`.
+
+    The covariates of hourly indexes are cached per range, so the returned array is read-only.
+
+    Args:
+        times: The time index of the covariates
+
+    Returns:
+        A float32 array of shape (len(times), 3) with the weekday, hour and month.
+    """
+    is_hourly = times.freq == "h" or (
+        len(times) > 1 and (np.diff(times.asi8) == pd.Timedelta(hours=1).value).all()
+    )
+    if is_hourly and len(times) > 0:
+        return _get_hourly_time_covariate_values(times[0], len(times))
+
+    return _compute_time_covariate_values(times)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _get_hourly_time_covariate_values(start: pd.Timestamp, n_hours: int) -> np.ndarray:
+    values = _compute_time_covariate_values(
+        pd.date_range(start, periods=n_hours, freq="h")
+    )
+    values.flags.writeable = False
+    return values
+
+
+def _compute_time_covariate_values(times: pd.DatetimeIndex) -> np.ndarray:
+    values = np.stack([times.weekday, times.hour, times.month - 1], axis=1).astype(
+        np.float32
+    )
+    data_min = np.array(
+        [TIME_COVARIATE_RANGES[column][0] for column in TIME_COVARIATE_COLUMNS],
+        dtype=np.float32,
+    )
+    data_max = np.array(
+        [TIME_COVARIATE_RANGES[column][1] for column in TIME_COVARIATE_COLUMNS],
+        dtype=np.float32,
+    )
+
+    # Same arithmetic as sklearn's MinMaxScaler
+    scale = 1 / (data_max - data_min)
+    return values * scale + (0 - data_min * scale)
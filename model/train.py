@@ -1,16 +1,20 @@
 import argparse
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
 
 import joblib
 import optuna
+from filelock import FileLock
+from optuna.trial import TrialState
 from darts import TimeSeries
 from darts.dataprocessing.transformers import Scaler
 from darts.metrics import rmse
 from darts.models import RNNModel, XGBModel
 from darts.models.forecasting.forecasting_model import ForecastingModel
 
-from model import config, data, evaluation, feature_engineering
+from model import config, data, evaluation, feature_engineering, feature_store
 from model.feature_engineering import get_covariates_time
-from model.util import get_covariate_args_for_model
+from model.util import get_covariate_args_for_model, save_model_manifest
 
 
 def fit_model(
@@ -86,47 +90,61 @@ def get_model_hparams(model_name: str, trial) -> dict:
     return {}
 
 
-def main():
-    # Parse arguments
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--model_name", type=str)
-    parser.add_argument("--output_dir", type=str)
-    parser.add_argument("--disable_scaling", default=False, action="store_true")
-    parser.add_argument("--disable_weather", default=False, action="store_true")
-    parser.add_argument(
-        "--enable_feature_engineering", default=False, action="store_true"
-    )
-    parser.add_argument("--enable_refit", default=False, action="store_true")
-    args = parser.parse_args()
-    scaling = not args.disable_scaling
+def get_pruner() -> optuna.pruners.BasePruner:
+    # Trials report their running CO2 RMSE after every evaluation split. A trial is stopped as
+    # soon as it is worse than the median of the previous trials at the same split.
+    return optuna.pruners.MedianPruner(n_startup_trials=2, n_warmup_steps=4)
 
+
+def load_training_data(args):
     # Load data
-    dataset = data.load()
-    covariates_time = get_covariates_time(dataset.weather)
+    dataset = data.load(use_weather_station_cache=args.use_weather_station_cache)
 
-    if not args.disable_weather:
-        covariates = dataset.weather.stack(covariates_time)
+    if args.use_feature_store:
+        covariates = feature_store.load(
+            feature_store.get_feature_sets(
+                weather=not args.disable_weather,
+                feature_engineering_enabled=args.enable_feature_engineering,
+            ),
+            dataset.weather,
+        )
     else:
-        covariates = covariates_time
+        covariates_time = get_covariates_time(dataset.weather)
 
-    # Engineer features
-    if args.enable_feature_engineering:
-        covariates = feature_engineering.add_rolling_mean(covariates, 1)
-        covariates = feature_engineering.add_rolling_mean(covariates, 24)
-        covariates = feature_engineering.add_rolling_mean(covariates, 24 * 7)
-        covariates = feature_engineering.add_kinetic_wind_energy_simplified(covariates)
+        if not args.disable_weather:
+            covariates = dataset.weather.stack(covariates_time)
+        else:
+            covariates = covariates_time
+
+        # Engineer features
+        if args.enable_feature_engineering:
+            covariates = feature_engineering.add_rolling_means(
+                covariates, [1, 24, 24 * 7]
+            )
+            covariates = feature_engineering.add_kinetic_wind_energy_simplified(
+                covariates
+            )
 
     # Create scaler for SMARD data if scaling is enabled
     scaler_smard = None
-    if scaling:
+    if not args.disable_scaling:
         scaler_smard = Scaler()
         scaler_smard.fit(dataset.train)
 
+    return dataset, covariates, scaler_smard
+
+
+def get_objective(
+    model_name: str,
+    dataset: data.Dataset,
+    covariates: TimeSeries,
+    scaler_smard: Scaler | None,
+):
     # Create optuna objective function
     def objective(trial):
         # Get model with current hyperparameters
-        hparams = get_model_hparams(args.model_name, trial)
-        model = get_model(args.model_name, hparams)
+        hparams = get_model_hparams(model_name, trial)
+        model = get_model(model_name, hparams)
 
         # Train the model
         fit_model(
@@ -137,6 +155,12 @@ def main():
             scaler_smard=scaler_smard,
         )
 
+        # Report the running CO2 RMSE after every split so that hopeless trials are pruned
+        def report(split: int, running_metrics: dict[str, float]):
+            trial.report(running_metrics["co2_rmse"], step=split)
+            if trial.should_prune():
+                raise optuna.TrialPruned()
+
         # Evaluate the model
         metrics = evaluation.cross_validation_without_refit(
             model=model,
@@ -146,6 +170,7 @@ def main():
             data_scaler=scaler_smard,
             covariates=covariates,
             forecast_horizon=7 * 24,
+            on_split_end=report,
         )
 
         # Print and return the evaluation result
@@ -153,9 +178,137 @@ def main():
         print(f"Eval CO2 RMSE: {eval_co2_rmse}")
         return eval_co2_rmse
 
-    # Run study
-    study = optuna.create_study(direction="minimize")
-    study.optimize(objective, n_trials=config.N_OPTUNA_TRIALS)
+    return objective
+
+
+def run_study(study: optuna.Study, objective, lock_path: str | None = None):
+    # Count the trials of earlier runs and of the other workers sharing the storage, so that a
+    # resumed study only runs the rest and all workers together run exactly N_OPTUNA_TRIALS. A
+    # worker only starts a trial while holding the lock, so two workers never start the last one.
+    lock = FileLock(lock_path) if lock_path is not None else contextlib.nullcontext()
+    states = (
+        TrialState.COMPLETE,
+        TrialState.PRUNED,
+        TrialState.RUNNING,
+        TrialState.WAITING,
+    )
+    while True:
+        with lock:
+            n_started = len(study.get_trials(deepcopy=False, states=states))
+            if n_started >= config.N_OPTUNA_TRIALS:
+                return
+            trial = study.ask()
+
+        try:
+            value = objective(trial)
+        except optuna.TrialPruned:
+            study.tell(trial, state=TrialState.PRUNED)
+        except Exception:
+            study.tell(trial, state=TrialState.FAIL)
+            raise
+        else:
+            study.tell(trial, value)
+
+
+def fail_stale_trials(study: optuna.Study):
+    # Trials that a crashed run left running would count as started forever, so they are failed
+    # and run again. Only call this while no worker is running trials of the study.
+    for trial in study.get_trials(deepcopy=False, states=(TrialState.RUNNING,)):
+        study.tell(trial.number, state=TrialState.FAIL)
+
+
+def run_study_worker(args, study_name: str, storage: str, lock_path: str):
+    # Runs in a separate process, which loads its own copy of the data
+    study = optuna.load_study(
+        study_name=study_name, storage=storage, pruner=get_pruner()
+    )
+    dataset, covariates, scaler_smard = load_training_data(args)
+    run_study(
+        study,
+        get_objective(args.model_name, dataset, covariates, scaler_smard),
+        lock_path,
+    )
+
+
+def main():
+    # Parse arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_name", type=str)
+    parser.add_argument("--output_dir", type=str)
+    parser.add_argument("--disable_scaling", default=False, action="store_true")
+    parser.add_argument("--disable_weather", default=False, action="store_true")
+    parser.add_argument(
+        "--enable_feature_engineering", default=False, action="store_true"
+    )
+    parser.add_argument("--enable_refit", default=False, action="store_true")
+    parser.add_argument(
+        "--refit_n_jobs",
+        type=int,
+        default=1,
+        help="Number of processes refitting test splits in parallel with --enable_refit",
+    )
+    parser.add_argument(
+        "--use_feature_store",
+        default=False,
+        action="store_true",
+        help="Load the covariates from the feature store instead of computing them",
+    )
+    parser.add_argument(
+        "--use_weather_station_cache",
+        default=False,
+        action="store_true",
+        help="Load the weather data from the weather station cache shared with inference",
+    )
+    parser.add_argument(
+        "--n_jobs",
+        type=int,
+        default=1,
+        help="Number of processes running Optuna trials in parallel",
+    )
+    parser.add_argument(
+        "--study_name",
+        type=str,
+        default=None,
+        help="Name of the Optuna study, reusing a name resumes that study "
+        "(defaults to the model name)",
+    )
+    parser.add_argument(
+        "--storage",
+        type=str,
+        default=None,
+        help="Optuna storage URL (defaults to a SQLite database in the output directory)",
+    )
+    args = parser.parse_args()
+
+    # Create or resume the study, it is persisted so that a crash does not lose finished trials
+    storage = args.storage or f"sqlite:///{args.output_dir}/optuna.db"
+    study = optuna.create_study(
+        study_name=args.study_name or args.model_name,
+        storage=storage,
+        direction="minimize",
+        pruner=get_pruner(),
+        load_if_exists=True,
+    )
+    fail_stale_trials(study)
+
+    # Run study, either in this process or in a pool of processes sharing the storage
+    if args.n_jobs > 1:
+        lock_path = f"{args.output_dir}/optuna.lock"
+        with ProcessPoolExecutor(max_workers=args.n_jobs) as executor:
+            futures = [
+                executor.submit(
+                    run_study_worker, args, study.study_name, storage, lock_path
+                )
+                for _ in range(args.n_jobs)
+            ]
+            for future in futures:
+                future.result()
+        dataset, covariates, scaler_smard = load_training_data(args)
+    else:
+        dataset, covariates, scaler_smard = load_training_data(args)
+        run_study(
+            study, get_objective(args.model_name, dataset, covariates, scaler_smard)
+        )
 
     # Re-train model with best hyperparameters
     model = get_model(args.model_name, study.best_params)
@@ -177,7 +330,11 @@ def main():
         covariates=covariates,
         forecast_horizon=7 * 24,
         refit=args.enable_refit,
+        batched=not args.enable_refit,
+        n_jobs=args.refit_n_jobs,
+        return_error_profile=True,
     )
+    error_profile = metrics.pop("error_profile")
 
     # Print results
     print(f"Test CO2 RMSE: {metrics['co2_rmse']}")
@@ -187,8 +344,12 @@ def main():
         file.write("Test metrics\n")
         file.write(str(metrics))
 
+    # Save the error per lead time and energy source next to the results
+    error_profile.save(args.output_dir)
+
     # Save model
     model.save(f"{args.output_dir}/model")
+    save_model_manifest(model, args.output_dir)
     joblib.dump(scaler_smard, f"{args.output_dir}/scaler_smard")
 
 
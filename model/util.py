@@ -1,6 +1,15 @@
+from __future__ import annotations
+
+import json
+import os
+from typing import TYPE_CHECKING
+
 import pandas as pd
-from darts import TimeSeries
-from darts.models.forecasting.forecasting_model import ForecastingModel
+
+# darts is only imported where it is needed, so that the data helpers can be used without it
+if TYPE_CHECKING:
+    from darts import TimeSeries
+    from darts.models.forecasting.forecasting_model import ForecastingModel
 
 
 def convert_comma_str_to_float(german_number_str: str) -> float:
@@ -29,6 +38,8 @@ def fix_float64(data: pd.DataFrame) -> pd.DataFrame:
 
 
 def convert_df_to_time_series(df: pd.DataFrame):  # pylint: disable=C0103
+    from darts import TimeSeries  # pylint: disable=C0415
+
     df = df.set_index("timestamp")
     time_series = TimeSeries.from_dataframe(
         df,
@@ -77,3 +88,54 @@ def get_covariate_args_for_model(model: ForecastingModel, covariates: TimeSeries
         covariate_args_inference["future_covariates"] = covariates
 
     return covariate_args, covariate_args_inference
+
+
+MODEL_MANIFEST_FILE_NAME = "manifest.json"
+
+
+def save_model_manifest(model: ForecastingModel, output_dir: str):
+    """
+    Save the class and the hyperparameters of a model next to its checkpoint, so that
+    inference can re-create the model without hard-coding them.
+
+    Parameters
+    ----------
+    model
+        A ForecastingModel instance.
+    output_dir
+        The directory the model is saved to.
+    """
+    model_params = {}
+    for name, value in model.model_params.items():
+        try:
+            json.dumps(value)
+        except TypeError:
+            continue
+        model_params[name] = value
+
+    manifest = {"model_class": type(model).__name__, "model_params": model_params}
+    with open(  # pylint: disable=W1514
+        os.path.join(output_dir, MODEL_MANIFEST_FILE_NAME), "w"
+    ) as file:
+        json.dump(manifest, file, indent=4)
+
+
+def load_model_manifest(model_dir: str) -> dict:
+    """
+    Load the manifest saved by `save_model_manifest`.
+
+    Parameters
+    ----------
+    model_dir
+        The directory the model was saved to.
+
+    Returns
+    -------
+    dict
+        A dict with the name of the model class (`model_class`) and its hyperparameters
+        (`model_params`).
+    """
+    with open(  # pylint: disable=W1514
+        os.path.join(model_dir, MODEL_MANIFEST_FILE_NAME)
+    ) as file:
+        return json.load(file)